@@ -0,0 +1,135 @@
+import base64
+import io
+import wave
+from functools import lru_cache
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Peak level after normalization, in dB below full scale (same as pydub's normalize(headroom=0.5))
+NORMALIZE_HEADROOM_DB = 0.5
+
+@lru_cache(maxsize=16)
+def _lowpass(up: int, down: int, taps_per_phase: int = 10, beta: float = 5.0) -> np.ndarray:
+    """
+    Windowed-sinc (Kaiser) anti-aliasing filter for resampling by up/down,
+    designed at the upsampled rate with a DC gain of `up`.
+    """
+    factor = max(up, down)
+    half = taps_per_phase * factor
+    n = np.arange(-half, half + 1, dtype=np.float64)
+    cutoff = 0.5 / factor
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(len(n), beta)
+    return (h * (up / h.sum())).astype(np.float32)
+
+def _decimate(x: np.ndarray, h: np.ndarray, down: int, n_out: int, delay: int) -> np.ndarray:
+    """
+    Polyphase decimation: y[n] = sum_k h[k] x[n*down + delay - k], computed as the sum of
+    `down` short convolutions at the output rate.
+    """
+    phase_taps = -(-len(h) // down)
+    pad = phase_taps * down
+    padded = np.concatenate([np.zeros(pad, dtype=np.float32), x, np.zeros(pad + down, dtype=np.float32)])
+    y = np.zeros(n_out, dtype=np.float32)
+    for r in range(down):
+        # Input phase r, started phase_taps outputs early so the convolution has its history.
+        phase = padded[delay - r::down][:n_out + phase_taps]
+        y += np.convolve(phase, h[r::down])[phase_taps:phase_taps + n_out]
+    return y
+
+def resample_poly(x: np.ndarray, up: int, down: int) -> np.ndarray:
+    """
+    Resample a 1-D float signal by the rational factor up/down with a polyphase FIR filter.
+    Only the output samples are computed, so nothing is spent on zero-stuffed or
+    discarded samples.
+    """
+    g = gcd(up, down)
+    up, down = up // g, down // g
+    x = np.asarray(x, dtype=np.float32)
+    if up == down == 1:
+        return x
+    h = _lowpass(up, down)
+    n_out = -(-len(x) * up // down)
+    delay = (len(h) - 1) // 2
+    if n_out == 0:
+        return np.zeros(0, dtype=np.float32)
+    if up == 1:
+        return _decimate(x, h, down, n_out, delay)
+    # Output n is sample m = n*down + delay of the (virtually) upsampled, filtered signal,
+    # which only touches filter phase m % up and input samples ending at m // up.
+    m = np.arange(n_out, dtype=np.int64) * down + delay
+    taps = -(-len(h) // up)
+    padded = np.concatenate([np.zeros(taps - 1, dtype=np.float32), x, np.zeros(taps, dtype=np.float32)])
+    windows = sliding_window_view(padded, taps)
+    index = np.minimum(m // up, len(windows) - 1)
+    y = np.empty(n_out, dtype=np.float32)
+    phase = m % up
+    for p in range(up):
+        sub = np.zeros(taps, dtype=np.float32)
+        sub[:len(h[p::up])] = h[p::up]
+        selected = phase == p
+        y[selected] = windows[index[selected]] @ sub[::-1].copy()
+    return y
+
+def normalize(x: np.ndarray, headroom_db: float = NORMALIZE_HEADROOM_DB) -> np.ndarray:
+    """
+    Scale a float signal (int16 range) so its peak sits `headroom_db` below full scale.
+    """
+    peak = float(np.max(np.abs(x))) if x.size else 0.0
+    if peak == 0.0:
+        return x
+    return x * (32767.0 * 10 ** (-headroom_db / 20) / peak)
+
+def wav_bytes(samples: np.ndarray, rate: int, channels: int = 1) -> bytes:
+    """
+    Wrap int16 samples in an in-memory WAV container.
+    """
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.astype("<i2").tobytes())
+    return buffer.getvalue()
+
+def pcm_to_wav(pcm: bytes, in_rate: int = 48000, in_channels: int = 2, out_rate: int = 16000) -> bytes:
+    """
+    Convert raw 16-bit PCM (Discord's 48 kHz stereo by default) to a normalized mono
+    16 kHz WAV file for transcription, entirely in memory.
+    """
+    samples = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2 // in_channels * in_channels)
+    mono = samples[0::in_channels].astype(np.float32)
+    for channel in range(1, in_channels):
+        mono += samples[channel::in_channels]
+    mono *= 1.0 / in_channels
+    resampled = normalize(resample_poly(mono, out_rate, in_rate))
+    return wav_bytes(np.clip(np.rint(resampled), -32768, 32767), out_rate)
+
+def wav_to_pcm(data: bytes, out_rate: int = 48000, out_channels: int = 2) -> bytes:
+    """
+    Decode a 16-bit PCM WAV file (e.g. a TTS reply) to raw PCM at Discord's 48 kHz stereo,
+    resampling and up/downmixing as needed. Raises ValueError for anything else.
+    """
+    try:
+        with wave.open(io.BytesIO(data), "rb") as wav:
+            rate, channels, width = wav.getframerate(), wav.getnchannels(), wav.getsampwidth()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"not a PCM WAV file: {e}")
+    if width != 2:
+        raise ValueError(f"unsupported sample width: {width * 8} bit")
+    samples = np.frombuffer(frames, dtype="<i2", count=len(frames) // 2 // channels * channels)
+    mono = samples[0::channels].astype(np.float32)
+    for channel in range(1, channels):
+        mono += samples[channel::channels]
+    mono *= 1.0 / channels
+    resampled = np.clip(np.rint(resample_poly(mono, out_rate, rate)), -32768, 32767).astype("<i2")
+    return np.repeat(resampled, out_channels).tobytes()
+
+def pcm_to_wav_base64(pcm: bytes) -> str:
+    """
+    pcm_to_wav plus base64 encoding, for the transcribe endpoint. CPU-bound: run it in a
+    worker thread (asyncio.to_thread) rather than on the event loop.
+    """
+    return base64.b64encode(pcm_to_wav(pcm)).decode("utf-8")
@@ -0,0 +1,260 @@
+import asyncio
+import time
+
+from http_client import KoboldHTTP
+
+# Capabilities that can be served by their own pool of KoboldCpp instances.
+CAPABILITIES = ("generate", "txt2img", "transcribe", "tts", "websearch")
+
+# Endpoint name -> (capability pool, path, timeout kind)
+ENDPOINTS = {
+    "generate": ("generate", "/api/v1/generate", "generate"),
+    "stream": ("generate", "/api/extra/generate/stream", "generate"),
+    "tokencount": ("generate", "/api/extra/tokencount", "tokencount"),
+    "txt2img": ("txt2img", "/sdapi/v1/txt2img", "txt2img"),
+    "websearch": ("websearch", "/api/extra/websearch", "websearch"),
+    "transcribe": ("transcribe", "/api/extra/transcribe", "transcribe"),
+    "tts": ("tts", "/api/extra/tts", "tts"),
+    "abort": ("generate", "/api/extra/abort", "tokencount"),
+    "embeddings": ("generate", "/api/extra/embeddings", "tokencount"),
+}
+
+# Helper requests sent to the generate pool. They never open or close its circuit
+# breakers, so a build without the endpoint (or a slow one) can't take generation down.
+HELPER_ENDPOINTS = frozenset(("tokencount", "embeddings"))
+
+class DeliveryFailed(Exception):
+    """
+    Raised by a request whose backend answered but whose result could not be delivered
+    (e.g. a Discord error while streaming it). Not counted against the backend and not
+    retried, since a retry would post the reply a second time.
+    """
+
+# KoboldCpp's performance endpoint: cheap, and reports the server's own request queue.
+PROBE_PATH = "/api/extra/perf"
+
+class Backend:
+    """
+    One KoboldCpp instance: its load, probe latency and circuit breaker state.
+
+    The breaker opens after `failure_threshold` consecutive failures and stays open for
+    `cooldown` seconds. After that a single trial request (or a successful probe) is let
+    through; success closes the breaker, failure opens it again.
+    """
+    __slots__ = ("base_url", "in_flight", "queue", "latency_ms", "failures", "open_until",
+                 "trial", "requests", "errors")
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.in_flight = 0       # requests this bot has running on it
+        self.queue = 0           # requests queued on the server (from the last probe)
+        self.latency_ms = 0.0    # probe round trip, exponentially smoothed
+        self.failures = 0        # consecutive failures
+        self.open_until = 0.0
+        self.trial = False
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float, failure_threshold: int) -> bool:
+        if self.failures < failure_threshold:
+            return True
+        return now >= self.open_until and not self.trial
+
+    def load(self) -> tuple:
+        return (self.in_flight + self.queue, self.latency_ms)
+
+    def state(self, now: float, failure_threshold: int) -> str:
+        if self.failures < failure_threshold:
+            return "up"
+        return "half-open" if now >= self.open_until else "open"
+
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial = False
+
+    def record_failure(self, now: float, failure_threshold: int, cooldown: float):
+        self.errors += 1
+        self.failures += 1
+        self.trial = False
+        if self.failures >= failure_threshold:
+            self.open_until = now + cooldown
+
+class BackendRouter:
+    """
+    Routes requests across one or more KoboldCpp instances per capability.
+
+    Each request goes to the least-loaded available backend of its pool (requests in
+    flight from this bot plus the server's own queue, then probe latency). A request
+    that fails is retried on another backend of the pool, up to `retries` times, and
+    repeated failures open that backend's circuit breaker. A background task probes
+    every backend each `probe_interval` seconds to refresh load and latency and to
+    close breakers of instances that came back.
+
+    With a single backend this behaves like a direct request. With `metrics` (see
+    metrics.Metrics), every attempt's duration is recorded per endpoint and outcome.
+    """
+
+    def __init__(self, http: KoboldHTTP, pools: dict, probe_interval: float = 15.0,
+                 failure_threshold: int = 3, cooldown: float = 30.0, retries: int = 2, metrics=None):
+        self.http = http
+        self.metrics = metrics
+        self.probe_interval = probe_interval
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.retries = retries
+        self.backends = {}  # base url -> Backend, shared between pools serving the same instance
+        self.pools = {}
+        for capability, urls in pools.items():
+            self.pools[capability] = [
+                self.backends.setdefault(url.rstrip("/"), Backend(url.rstrip("/"))) for url in urls
+            ]
+        for capability, path, timeout_kind in ENDPOINTS.values():
+            for backend in self.pools.get(capability, []):
+                http.register(timeout_kind, backend.base_url + path)
+        self.task = None
+
+    def size(self, capability: str) -> int:
+        return len(self.pools.get(capability, []))
+
+    def _pick(self, capability: str, tried: set, trial: bool = True) -> Backend:
+        now = time.monotonic()
+        candidates = [backend for backend in self.pools.get(capability, []) if backend not in tried]
+        available = [backend for backend in candidates if backend.available(now, self.failure_threshold)]
+        if available:
+            backend = min(available, key=Backend.load)
+            if trial and backend.failures >= self.failure_threshold:
+                backend.trial = True
+            return backend
+        if candidates and not tried:
+            # Every breaker is open: try the one that has been down the longest
+            # rather than failing without a single attempt.
+            return min(candidates, key=lambda backend: backend.open_until)
+        return None
+
+    async def call(self, endpoint: str, request, on_dispatch=None):
+        """
+        Run `request(url)` against the best backend for `endpoint`, retrying on another
+        backend when it fails. A result of None (how the HTTP helpers report errors)
+        counts as a failure. Returns the first successful result, or None.
+        `on_dispatch(base_url)` is called before each attempt. Results of HELPER_ENDPOINTS
+        are left out of the breakers.
+        """
+        capability, path, _ = ENDPOINTS[endpoint]
+        tracked = endpoint not in HELPER_ENDPOINTS
+        tried = set()
+        for attempt in range(self.retries + 1):
+            backend = self._pick(capability, tried, trial=tracked)
+            if backend is None:
+                break
+            tried.add(backend)
+            backend.in_flight += 1
+            backend.requests += 1
+            if on_dispatch is not None:
+                on_dispatch(backend.base_url)
+            started = time.perf_counter()
+            try:
+                result = await request(backend.base_url + path)
+            except asyncio.CancelledError:
+                backend.trial = False
+                raise
+            except DeliveryFailed:
+                backend.record_success()
+                raise
+            except Exception as e:
+                print(f"❌ {endpoint} request to {backend.base_url} failed: {e}")
+                result = None
+            finally:
+                backend.in_flight -= 1
+            if self.metrics is not None:
+                self.metrics.observe(
+                    "backend_request_seconds", time.perf_counter() - started,
+                    endpoint=endpoint, outcome="ok" if result is not None else "error"
+                )
+            if result is not None:
+                if tracked:
+                    backend.record_success()
+                return result
+            if tracked:
+                backend.record_failure(time.monotonic(), self.failure_threshold, self.cooldown)
+            if attempt < self.retries and len(tried) < self.size(capability):
+                print(f"Retrying {endpoint} on another backend ({backend.base_url} failed)")
+        return None
+
+    async def abort(self, base_url: str, genkey: str) -> bool:
+        """
+        Ask one backend to stop the generation running under `genkey`.
+        """
+        url = base_url + ENDPOINTS["abort"][1]
+        try:
+            session = self.http.session_for(url)
+            async with session.post(url, json={"genkey": genkey}, timeout=self.http.timeout_for(url)) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Status code: {resp.status}")
+                return True
+        except Exception as e:
+            print(f"❌ Abort on {base_url} failed: {e}")
+            return False
+
+    async def _probe(self, backend: Backend):
+        url = backend.base_url + PROBE_PATH
+        started = time.perf_counter()
+        try:
+            session = self.http.session_for(url)
+            async with session.get(url, timeout=self.http.timeout_for(url, 5)) as resp:
+                if resp.status == 404:
+                    # Older KoboldCpp without the perf endpoint: alive, but no queue figures.
+                    data = {}
+                elif resp.status != 200:
+                    raise Exception(f"Status code: {resp.status}")
+                else:
+                    data = await resp.json()
+        except Exception as e:
+            backend.record_failure(time.monotonic(), self.failure_threshold, self.cooldown)
+            print(f"❌ Health probe of {backend.base_url} failed: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        backend.latency_ms = elapsed_ms if backend.latency_ms == 0 else 0.7 * backend.latency_ms + 0.3 * elapsed_ms
+        backend.queue = int(data.get("queue", 0) or 0)
+        # A healthy probe counts as the half-open trial, but doesn't cut a cooldown short.
+        if time.monotonic() >= backend.open_until:
+            backend.record_success()
+
+    async def probe(self):
+        """
+        Probe every backend once.
+        """
+        await asyncio.gather(*(self._probe(backend) for backend in self.backends.values()))
+
+    async def _run(self):
+        while True:
+            await self.probe()
+            await asyncio.sleep(self.probe_interval)
+
+    def start(self):
+        """
+        Start the periodic health probes. Must be called from within the running event loop.
+        """
+        if self.task is None and self.probe_interval > 0:
+            self.task = asyncio.create_task(self._run(), name="backend-probes")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def summary(self) -> list:
+        """
+        One line per backend: capabilities, breaker state, load, latency and error counts.
+        """
+        now = time.monotonic()
+        lines = []
+        for backend in self.backends.values():
+            capabilities = ", ".join(c for c, pool in self.pools.items() if backend in pool)
+            lines.append(
+                f"{backend.base_url} [{capabilities}]: {backend.state(now, self.failure_threshold)}, "
+                f"in flight {backend.in_flight}, server queue {backend.queue}, "
+                f"latency {backend.latency_ms:.0f} ms, requests {backend.requests}, errors {backend.errors}"
+            )
+        return lines
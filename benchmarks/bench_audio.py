@@ -0,0 +1,78 @@
+"""
+Benchmark for the per-utterance voice audio path: 48 kHz stereo PCM from Discord to a
+normalized 16 kHz mono WAV, base64-encoded for the transcribe endpoint.
+
+Compares the in-process NumPy path (audio.py) with the old pydub/ffmpeg path, which is
+only measured if pydub and ffmpeg are installed. Run from the repository root:
+
+    python benchmarks/bench_audio.py
+"""
+import base64
+import os
+import sys
+import time
+from io import BytesIO
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from audio import pcm_to_wav_base64
+
+RUNS = 10
+
+def synthetic_pcm(seconds: float) -> bytes:
+    """Speech-like test signal: a few harmonics with a syllable envelope plus noise."""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(48000 * seconds)) / 48000
+    voice = sum(np.sin(2 * np.pi * f * t) / (i + 1) for i, f in enumerate((180, 360, 720, 1440)))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    mono = voice * envelope * 6000 + rng.normal(0, 200, t.size)
+    return np.repeat(mono.astype("<i2"), 2).tobytes()
+
+def pydub_path(pcm: bytes) -> str:
+    from pydub import AudioSegment
+    audio = AudioSegment(
+        data=pcm, sample_width=2, frame_rate=48000, channels=2
+    ).set_channels(1).set_frame_rate(16000).set_sample_width(2).normalize(headroom=0.5)
+    wav_buffer = BytesIO()
+    audio.export(wav_buffer, format="wav", codec="pcm_s16le", parameters=["-ar", "16000", "-ac", "1"])
+    return base64.b64encode(wav_buffer.getvalue()).decode("utf-8")
+
+def measure(func, pcm):
+    wall = []
+    cpu = []
+    for _ in range(RUNS):
+        started_wall = time.perf_counter()
+        started_cpu = time.process_time()
+        func(pcm)
+        cpu.append(time.process_time() - started_cpu)
+        wall.append(time.perf_counter() - started_wall)
+    return np.median(wall) * 1000, np.median(cpu) * 1000
+
+def pydub_available() -> bool:
+    try:
+        import pydub  # noqa: F401
+        from pydub.utils import which
+    except ImportError:
+        return False
+    return which("ffmpeg") is not None
+
+def main():
+    compare = pydub_available()
+    if not compare:
+        print("pydub/ffmpeg not installed: measuring the NumPy path only.")
+    # Note: process_time does not include the ffmpeg child process, so the pydub
+    # CPU column understates its real cost; wall time includes it.
+    print(f"{'utterance':>9} {'numpy wall ms':>14} {'numpy cpu ms':>13} {'pydub wall ms':>14} {'pydub cpu ms':>13}")
+    for seconds in (1, 3, 10):
+        pcm = synthetic_pcm(seconds)
+        numpy_wall, numpy_cpu = measure(pcm_to_wav_base64, pcm)
+        if compare:
+            pydub_wall, pydub_cpu = measure(pydub_path, pcm)
+            print(f"{seconds:>8}s {numpy_wall:>14.2f} {numpy_cpu:>13.2f} {pydub_wall:>14.2f} {pydub_cpu:>13.2f}")
+        else:
+            print(f"{seconds:>8}s {numpy_wall:>14.2f} {numpy_cpu:>13.2f} {'-':>14} {'-':>13}")
+
+if __name__ == "__main__":
+    main()
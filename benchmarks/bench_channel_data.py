@@ -0,0 +1,65 @@
+"""
+Microbenchmark for the per-message channel bookkeeping in on_message:
+user tracking, append_history and building the stop sequences in prepare_payload.
+
+Compares the old list-based BotChannelData with the current one for channels with
+many participants. Run from the repository root:
+
+    python benchmarks/bench_channel_data.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bot_data import BotChannelData
+
+BOT_NAME = "KetisBot"
+MESSAGES = 1000
+
+class LegacyChannelData:
+    def __init__(self):
+        self.chat_history = []
+        self.users = []
+
+def legacy_message(data, user, text):
+    if user not in data.users:
+        data.users.append(user)
+    data.chat_history.append(f"{user}: {text}")
+    if len(data.chat_history) > 20:
+        data.chat_history = data.chat_history[-20:]
+    stop_seq = ["\n###", "### ", f"\n{BOT_NAME}:", f"{BOT_NAME}:"]
+    for name in data.users:
+        seq1 = f"{name}:"
+        seq2 = f"\n{name}:"
+        if seq1 not in stop_seq:
+            stop_seq.append(seq1)
+        if seq2 not in stop_seq:
+            stop_seq.append(seq2)
+    return stop_seq
+
+def current_message(data, user, text):
+    data.add_user(user)
+    data.chat_history.append(f"{user}: {text}")
+    return data.stop_sequences(BOT_NAME)
+
+def run(step, data, users):
+    names = [f"user{i}" for i in range(users)]
+    # Warm up so every participant is already known, as in a long-running channel.
+    for name in names:
+        step(data, name, "hello")
+    started = time.perf_counter()
+    for i in range(MESSAGES):
+        step(data, names[i % users], "a message of ordinary length for the benchmark")
+    return (time.perf_counter() - started) / MESSAGES * 1e6
+
+def main():
+    print(f"{'users':>6} {'legacy us/msg':>14} {'current us/msg':>15} {'speedup':>8}")
+    for users in (10, 100, 300, 500):
+        legacy = run(legacy_message, LegacyChannelData(), users)
+        current = run(current_message, BotChannelData(), users)
+        print(f"{users:>6} {legacy:>14.2f} {current:>15.2f} {legacy / current:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
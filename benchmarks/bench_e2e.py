@@ -0,0 +1,408 @@
+"""
+End-to-end benchmark of the bot against a fake KoboldCpp server (fake_kobold.py, started
+as a subprocess), without a Discord gateway. Synthetic messages go through main.on_message,
+synthetic interactions through the slash command handlers, and synthetic PCM through
+commands.voice_listener, using the real scheduler, router, caches and HTTP pool.
+
+Reports per scenario: completed operations, throughput, p50/p99 latency, CPU time of the
+bot process (the fake server runs in its own process) and resident memory.
+Chat latency is the time until the first reply message (or streamed chunk) is posted,
+slash command latency the time until the handler returns, and voice latency the time from
+the end of an utterance until its spoken reply starts playing.
+Run from the repository root:
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --scenarios chat,stream --generate-latency 1.0
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from fake_kobold import REPLY
+
+SCENARIOS = ("chat", "stream", "burst", "search", "draw", "describe", "voice")
+
+# === Fake Discord objects ===
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str):
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{user_id}>"
+        self.voice = None
+        self.guild_permissions = SimpleNamespace(administrator=False)
+
+class FakeSentMessage:
+    def __init__(self, content):
+        self.content = content
+
+    async def edit(self, content=None, **kwargs):
+        self.content = content
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+class FakeChannel:
+    """A text channel that records when the bot posts to it."""
+
+    def __init__(self, channel_id: int, guild):
+        self.id = channel_id
+        self.guild = guild
+        self.name = f"channel-{channel_id}"
+        self.posted = None  # future resolved by the next bot message
+
+    def expect_reply(self) -> asyncio.Future:
+        self.posted = asyncio.get_running_loop().create_future()
+        return self.posted
+
+    async def send(self, content=None, **kwargs):
+        if self.posted is not None and not self.posted.done():
+            self.posted.set_result(time.perf_counter())
+        return FakeSentMessage(content)
+
+    def typing(self):
+        return FakeTyping()
+
+class FakeMessage:
+    def __init__(self, author: FakeUser, channel: FakeChannel, content: str, mentions: list):
+        self.author = author
+        self.channel = channel
+        self.content = content
+        self.clean_content = content
+        self.mentions = mentions
+
+    async def reply(self, content=None, **kwargs):
+        return FakeSentMessage(content)
+
+    async def add_reaction(self, emoji):
+        pass
+
+class FakeResponse:
+    async def defer(self, **kwargs):
+        pass
+
+    async def send_message(self, content=None, **kwargs):
+        pass
+
+    def is_done(self):
+        return True
+
+class FakeFollowup:
+    async def send(self, content=None, **kwargs):
+        return FakeSentMessage(content)
+
+class FakeInteraction:
+    def __init__(self, client, channel: FakeChannel, user: FakeUser):
+        self.client = client
+        self.channel = channel
+        self.guild = channel.guild
+        self.user = user
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+
+class FakeVoiceClient:
+    """Voice client whose sink is fed from a thread and whose playback finishes instantly."""
+
+    def __init__(self, channel: FakeChannel):
+        self.channel = channel
+        self.guild = channel.guild
+        self.sink = None
+        self.plays = 0
+        self.played = asyncio.Event()
+
+    def listen(self, sink):
+        self.sink = sink
+
+    def is_listening(self):
+        return self.sink is not None
+
+    def stop_listening(self):
+        self.sink = None
+
+    def is_connected(self):
+        return True
+
+    def is_playing(self):
+        return False
+
+    def play(self, source, after=None):
+        self.plays += 1
+        self.played.set()
+        source.cleanup()
+        if after is not None:
+            after(None)
+
+    def stop(self):
+        pass
+
+    async def disconnect(self):
+        pass
+
+# === Measurement ===
+
+def rss_mb() -> float:
+    """Current resident set size (Linux), or the peak where /proc isn't available."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float("nan")
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[int(q) - 1]
+
+async def measure(name: str, scenario) -> dict:
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    latencies = await scenario()
+    elapsed = time.perf_counter() - started
+    return {
+        "name": name,
+        "ops": len(latencies),
+        "seconds": elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "cpu_s": time.process_time() - cpu_started,
+        "rss_mb": rss_mb(),
+    }
+
+# === Scenarios ===
+
+class Harness:
+    def __init__(self, main, args):
+        self.main = main
+        self.client = main.client
+        self.args = args
+        self.bot = FakeUser(1, "Bot")
+        self.client._connection.user = self.bot
+        self.guilds = [SimpleNamespace(id=100 + g, voice_client=None) for g in range(args.channels)]
+        self.next_channel = 1000
+
+    def channel(self, guild_index: int = 0) -> FakeChannel:
+        self.next_channel += 1
+        return FakeChannel(self.next_channel, self.guilds[guild_index % len(self.guilds)])
+
+    async def wait_idle(self, channel_id: int):
+        # A reply is finished once the channel has nothing pending or in flight.
+        while channel_id in self.client.replies.channels:
+            await asyncio.sleep(0.005)
+
+    async def chat(self, streaming: bool) -> list:
+        """`channels` channels in parallel, each sending mentions and waiting for the reply."""
+        self.client.config["streaming"] = streaming
+        latencies = []
+
+        async def conversation(index):
+            channel = self.channel(index)
+            user = FakeUser(10 + index, f"user{index}")
+            for turn in range(self.args.messages):
+                posted = channel.expect_reply()
+                started = time.perf_counter()
+                await self.main.on_message(FakeMessage(user, channel, f"Bot, question {turn}?", [self.bot]))
+                latencies.append(await posted - started)
+                await self.wait_idle(channel.id)
+
+        await asyncio.gather(*(conversation(i) for i in range(self.args.channels)))
+        return latencies
+
+    async def burst(self) -> list:
+        """Many users mentioning the bot in one channel at once (debounced and coalesced)."""
+        self.client.config["streaming"] = False
+        channel = self.channel()
+        posted = channel.expect_reply()
+        started = time.perf_counter()
+        for i in range(self.args.messages * 2):
+            await self.main.on_message(FakeMessage(FakeUser(10 + i, f"user{i}"), channel, f"Bot, hi {i}", [self.bot]))
+        latencies = [await posted - started]
+        await self.wait_idle(channel.id)
+        return latencies
+
+    async def slash(self, invoke, count: int) -> list:
+        """`count` concurrent invocations of a slash command, spread over the channels."""
+        latencies = []
+
+        async def one(index):
+            interaction = FakeInteraction(self.client, self.channel(index), FakeUser(10 + index, f"user{index}"))
+            started = time.perf_counter()
+            await invoke(interaction, index)
+            latencies.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(one(i) for i in range(count)))
+        return latencies
+
+    async def search(self) -> list:
+        commands = self.main.commands
+        return await self.slash(
+            lambda interaction, i: commands.search.callback(interaction, f"query {i % 4}"),
+            self.args.channels * 2
+        )
+
+    async def draw(self) -> list:
+        commands = self.main.commands
+        orientation = SimpleNamespace(name="Square", value="square")
+        return await self.slash(
+            lambda interaction, i: commands.draw.callback(interaction, orientation, f"a cat, style {i % 3}"),
+            self.args.channels * 2
+        )
+
+    async def describe(self) -> list:
+        commands = self.main.commands
+        image = SimpleNamespace(url=self.args.url + "/image.png")
+        return await self.slash(
+            lambda interaction, i: commands.describe.callback(interaction, image),
+            self.args.channels * 2
+        )
+
+    async def voice(self) -> list:
+        """One speaker per guild talking to the bot, utterances fed at 4x real time."""
+        from playback import split_sentences
+        from voice import FRAME_BYTES
+
+        sentences = len(split_sentences(REPLY))
+        t = np.arange(FRAME_BYTES // 4) / 48000
+        speech = [np.repeat((np.sin(2 * np.pi * 180 * (t + i * 0.02)) * 8000).astype("<i2"), 2).tobytes()
+                  for i in range(50)]   # 1 s of voiced audio
+        silence = [np.repeat(np.random.default_rng(i).normal(0, 30, t.size).astype("<i2"), 2).tobytes()
+                   for i in range(50)]  # 1 s of background noise
+        latencies = []
+
+        async def session(index):
+            channel = self.channel(index)
+            vc = FakeVoiceClient(channel)
+            speaker = FakeUser(10 + index, f"speaker{index}")
+            task = asyncio.create_task(self.main.commands.voice_listener(vc, channel, self.client))
+            while vc.sink is None:
+                await asyncio.sleep(0.001)
+
+            def feed(packets):
+                for pcm in packets:
+                    vc.sink.write(speaker, SimpleNamespace(pcm=pcm, packet=SimpleNamespace(ssrc=index)))
+                    time.sleep(0.005)
+
+            try:
+                for turn in range(self.args.messages):
+                    vc.played.clear()
+                    await asyncio.to_thread(feed, speech)
+                    ended = time.perf_counter()
+                    await asyncio.to_thread(feed, silence)
+                    await vc.played.wait()
+                    latencies.append(time.perf_counter() - ended)
+                    player = vc.tts_player
+                    while player.stats["sentences"] + player.stats["failed"] < (turn + 1) * sentences:
+                        await asyncio.sleep(0.005)
+            finally:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                if hasattr(vc, "tts_player"):
+                    await vc.tts_player.close()
+
+        await asyncio.gather(*(session(i) for i in range(self.args.channels)))
+        return latencies
+
+# === Runner ===
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_server(args) -> subprocess.Popen:
+    command = [sys.executable, os.path.join(ROOT, "benchmarks", "fake_kobold.py"), "--port", str(args.port),
+               "--tokens-per-second", str(args.tokens_per_second)]
+    for endpoint in ("generate", "txt2img", "transcribe", "tts", "websearch"):
+        command += [f"--{endpoint}-latency", str(getattr(args, f"{endpoint}_latency"))]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    server.stdout.readline()  # "Fake KoboldCpp listening on ..."
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--channels", type=int, default=8, help="concurrent channels / guilds")
+    parser.add_argument("--messages", type=int, default=5, help="turns per channel")
+    parser.add_argument("--generate-latency", type=float, default=0.2)
+    parser.add_argument("--txt2img-latency", type=float, default=0.5)
+    parser.add_argument("--transcribe-latency", type=float, default=0.1)
+    parser.add_argument("--tts-latency", type=float, default=0.05)
+    parser.add_argument("--websearch-latency", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    args = parser.parse_args()
+    args.port = free_port()
+    args.url = f"http://127.0.0.1:{args.port}"
+    scenarios = [name for name in args.scenarios.split(",") if name]
+
+    data_dir = tempfile.mkdtemp(prefix="bench_e2e_")
+    os.environ.update({
+        "KAI_ENDPOINT": args.url,
+        "BOT_TOKEN": "benchmark",
+        "ADMIN_NAME": "admin",
+        "DB_PATH": os.path.join(data_dir, "botdata.db"),
+        "DATA_DIR": data_dir,
+        "BACKEND_PROBE_INTERVAL": "0",
+        "DESCRIBE_CACHE_PERSIST": "0",
+    })
+    server = start_server(args)
+    try:
+        import main as bot
+
+        async def run():
+            await bot.setup_hook()
+            harness = Harness(bot, args)
+            runs = {
+                "chat": lambda: harness.chat(streaming=False),
+                "stream": lambda: harness.chat(streaming=True),
+                "burst": harness.burst,
+                "search": harness.search,
+                "draw": harness.draw,
+                "describe": harness.describe,
+                "voice": harness.voice,
+            }
+            results = []
+            try:
+                for name in scenarios:
+                    results.append(await measure(name, runs[name]))
+            finally:
+                await bot.shutdown()
+            return results
+
+        print(f"{args.channels} channels, {args.messages} turns each, generate latency {args.generate_latency}s\n")
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, "w"))))
+            results = asyncio.run(run())
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"\n{'scenario':<10}  {'ops':>5}  {'ops/s':>7}  {'p50 ms':>8}  {'p99 ms':>8}  {'cpu s':>6}  {'rss MB':>7}")
+    for result in results:
+        print(f"{result['name']:<10}  {result['ops']:>5}  {result['ops'] / result['seconds']:>7.1f}  "
+              f"{result['p50_ms']:>8.0f}  {result['p99_ms']:>8.0f}  {result['cpu_s']:>6.2f}  {result['rss_mb']:>7.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Cold-start benchmark: time for a fresh interpreter to import main.py (configuration,
+stores, client and handlers) and to register the command tree and compute its sync
+fingerprint, plus the cost of the voice/audio imports that are now deferred to the first
+/joinvoice. Each run is a new process, so nothing is cached in memory between runs.
+Run from the repository root:
+
+    python benchmarks/bench_startup.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+RUNS = 7
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.commands.setup(main.client)
+main.commands.command_fingerprint(main.client.tree)
+registered = time.perf_counter()
+voice_loaded = "numpy" in sys.modules or "discord.ext.voice_recv" in sys.modules
+import discord.ext.voice_recv, voice, audio, playback
+deferred = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "setup_ms": (registered - imported) * 1000,
+    "deferred_ms": (deferred - registered) * 1000,
+    "voice_loaded": voice_loaded,
+}))
+"""
+
+def run_once(env: dict) -> dict:
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+def main():
+    data_dir = tempfile.mkdtemp(prefix="bench_startup_")
+    env = dict(os.environ)
+    env.update({
+        "KAI_ENDPOINT": "http://127.0.0.1:5001",
+        "BOT_TOKEN": "benchmark",
+        "ADMIN_NAME": "admin",
+        "DB_PATH": os.path.join(data_dir, "botdata.db"),
+        "DATA_DIR": data_dir,
+    })
+    run_once(env)  # warm the OS file cache and create the database
+    runs = [run_once(env) for _ in range(RUNS)]
+    print(f"Median of {RUNS} fresh processes\n")
+    print(f"import main.py:                 {statistics.median(r['import_ms'] for r in runs):7.1f} ms")
+    print(f"register commands + fingerprint: {statistics.median(r['setup_ms'] for r in runs):6.1f} ms")
+    print(f"deferred voice/audio imports:   {statistics.median(r['deferred_ms'] for r in runs):7.1f} ms "
+          f"(loaded at startup: {'yes' if any(r['voice_loaded'] for r in runs) else 'no'})")
+
+if __name__ == "__main__":
+    main()
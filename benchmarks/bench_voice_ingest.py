@@ -0,0 +1,124 @@
+"""
+Stress test for the voice receive path: a fake sink thread delivers 20 ms packets from
+many speakers at once, the way discord-ext-voice-recv calls the BasicSink callback.
+
+Compares the old design, where every packet is handed to the event loop
+(call_soon_threadsafe into a loop-side segmenter), with the current one, where
+VoiceSegmenter.feed buffers on the sink thread and only finished utterances reach the
+loop. Reports the time spent in the sink callback per packet, how often and how long
+the event loop is woken for voice work, and total CPU.
+Run from the repository root:
+
+    python benchmarks/bench_voice_ingest.py
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from voice import VoiceSegmenter, FRAME_BYTES
+
+SPEAKERS = (1, 4, 12, 32)
+SECONDS = 10          # simulated audio per speaker
+UTTERANCE = 1.5       # seconds of speech, then SILENCE seconds of quiet packets
+SILENCE = 1.0
+
+def packets_for(seconds: float, speech: float, silence: float, seed: int) -> list:
+    """20 ms stereo packets alternating speech-like tones and quiet background."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(FRAME_BYTES // 4) / 48000
+    packets = []
+    for index in range(int(seconds * 50)):
+        if (index * 0.02) % (speech + silence) < speech:
+            mono = np.sin(2 * np.pi * (150 + seed * 10) * (t + index * 0.02)) * 8000
+        else:
+            mono = rng.normal(0, 30, t.size)
+        packets.append(np.repeat(mono.astype("<i2"), 2).tobytes())
+    return packets
+
+class LoopSideSegmenter(VoiceSegmenter):
+    """The previous design: the segmenter runs on the event loop, fed once per packet."""
+
+    def sink_callback(self, ssrc, user, pcm):
+        self.loop.call_soon_threadsafe(self.feed, ssrc, user, pcm)
+
+def run(speakers: int, loop_side: bool) -> dict:
+    streams = [packets_for(SECONDS, UTTERANCE, SILENCE, seed) for seed in range(speakers)]
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        segments = []
+        wakeups = 0
+        loop_busy = 0.0
+
+        def on_segment(segment):
+            segments.append(segment)
+
+        segmenter = (LoopSideSegmenter if loop_side else VoiceSegmenter)(
+            on_segment, hangover=0.3, loop=loop
+        )
+
+        # Count and time every callback the loop runs on behalf of the voice path.
+        original = loop.call_soon_threadsafe
+        def timed(func, *args):
+            nonlocal loop_busy
+            started = time.perf_counter()
+            func(*args)
+            loop_busy += time.perf_counter() - started
+        def counting_call_soon_threadsafe(func, *args):
+            nonlocal wakeups
+            wakeups += 1
+            return original(timed, func, *args)
+        loop.call_soon_threadsafe = counting_call_soon_threadsafe
+
+        callback = segmenter.sink_callback if loop_side else segmenter.feed
+        callback_time = 0.0
+
+        def sink_thread():
+            nonlocal callback_time
+            # Packets arrive interleaved across speakers, 20 ms apart (2x real time).
+            for index in range(len(streams[0])):
+                tick = time.perf_counter()
+                for ssrc, packets in enumerate(streams):
+                    started = time.perf_counter()
+                    callback(ssrc, f"user{ssrc}", packets[index])
+                    callback_time += time.perf_counter() - started
+                time.sleep(max(0.0, 0.01 - (time.perf_counter() - tick)))
+
+        cpu_started = time.process_time()
+        thread = threading.Thread(target=sink_thread)
+        thread.start()
+        while thread.is_alive():
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)  # let the last utterances close
+        cpu = time.process_time() - cpu_started
+        segmenter.close()
+        loop.call_soon_threadsafe = original
+        packets = speakers * len(streams[0])
+        return {
+            "callback_us": callback_time / packets * 1e6,
+            "wakeups": wakeups,
+            "loop_ms": loop_busy * 1000,
+            "segments": len(segments),
+            "cpu_ms": cpu * 1000,
+        }
+
+    return asyncio.run(main())
+
+def main():
+    print(f"{SECONDS}s of audio per speaker, {UTTERANCE}s utterances\n")
+    print(f"{'speakers':>8}  {'design':<10}  {'sink us/pkt':>11}  {'loop wakeups':>12}  {'loop ms':>8}  "
+          f"{'segments':>8}  {'cpu ms':>8}")
+    for speakers in SPEAKERS:
+        for name, loop_side in (("per-packet", True), ("sink", False)):
+            result = run(speakers, loop_side)
+            print(f"{speakers:>8}  {name:<10}  {result['callback_us']:>11.1f}  {result['wakeups']:>12}  "
+                  f"{result['loop_ms']:>8.1f}  {result['segments']:>8}  {result['cpu_ms']:>8.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Local stand-in for a KoboldCpp server, for benchmarks. Serves the endpoints the bot uses
+(generate, SSE streaming, tokencount, txt2img, websearch, transcribe, tts, abort, perf)
+with canned responses after a configurable delay, plus a test image at /image.png.
+Run from the repository root:
+
+    python benchmarks/fake_kobold.py --port 5001 --generate-latency 0.5
+
+or start it in-process with FakeKobold(...).start().
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import sys
+import zlib
+from collections import Counter
+
+import numpy as np
+from aiohttp import web
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from audio import wav_bytes
+
+REPLY = "Sure, here is a reasonably sized answer with a few sentences. It keeps going for a while. That should do."
+
+def png_bytes(width: int = 64, height: int = 64) -> bytes:
+    """A solid-colour RGB PNG, built without Pillow."""
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    rows = b"".join(b"\x00" + bytes((200, 80, 40)) * width for _ in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+class FakeKobold:
+    """
+    `latency` maps endpoint names (generate, txt2img, transcribe, tts, websearch) to
+    seconds per request; streaming sends `reply` word by word at `tokens_per_second`.
+    `requests` counts calls per path.
+    """
+
+    def __init__(self, latency: dict = None, tokens_per_second: float = 50.0, reply: str = REPLY,
+                 transcript: str = "hey bot, what's the weather like today"):
+        self.latency = {"generate": 0.2, "txt2img": 1.0, "transcribe": 0.1, "tts": 0.1, "websearch": 0.2}
+        self.latency.update(latency or {})
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.transcript = transcript
+        self.requests = Counter()
+        self.image = png_bytes()
+        self.speech = wav_bytes((np.sin(np.arange(24000) / 24000 * 2 * np.pi * 220) * 8000).astype("<i2"), 24000)
+        self.runner = None
+
+    async def _delay(self, request: web.Request, endpoint: str):
+        self.requests[request.path] += 1
+        await asyncio.sleep(self.latency[endpoint])
+
+    async def generate(self, request):
+        await self._delay(request, "generate")
+        return web.json_response({"results": [{"text": self.reply}]})
+
+    async def stream(self, request):
+        self.requests[request.path] += 1
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self.latency["generate"] / 4)  # prompt processing before the first token
+        for word in self.reply.split(" "):
+            await response.write(f"event: message\ndata: {json.dumps({'token': word + ' '})}\n\n".encode())
+            await asyncio.sleep(1 / self.tokens_per_second)
+        await response.write_eof()
+        return response
+
+    async def tokencount(self, request):
+        self.requests[request.path] += 1
+        data = await request.json()
+        return web.json_response({"value": len(data.get("prompt", "")) // 4 + 1})
+
+    async def txt2img(self, request):
+        data = await request.json()
+        await self._delay(request, "txt2img")
+        image = base64.b64encode(self.image).decode()
+        return web.json_response({"images": [image] * int(data.get("batch_size", 1))})
+
+    async def websearch(self, request):
+        data = await request.json()
+        await self._delay(request, "websearch")
+        return web.json_response([
+            {"title": f"Result {i} for {data.get('q', '')}", "desc": "A short description of the page.",
+             "url": f"https://example.com/{i}"}
+            for i in range(3)
+        ])
+
+    async def transcribe(self, request):
+        await request.read()
+        await self._delay(request, "transcribe")
+        return web.json_response({"text": self.transcript})
+
+    async def tts(self, request):
+        await self._delay(request, "tts")
+        return web.Response(body=self.speech, content_type="audio/wav")
+
+    async def abort(self, request):
+        self.requests[request.path] += 1
+        return web.json_response({"success": "true"})
+
+    async def perf(self, request):
+        self.requests[request.path] += 1
+        return web.json_response({"queue": 0})
+
+    async def image_file(self, request):
+        self.requests[request.path] += 1
+        return web.Response(body=self.image, content_type="image/png")
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.add_routes([
+            web.post("/api/v1/generate", self.generate),
+            web.post("/api/extra/generate/stream", self.stream),
+            web.post("/api/extra/tokencount", self.tokencount),
+            web.post("/sdapi/v1/txt2img", self.txt2img),
+            web.post("/api/extra/websearch", self.websearch),
+            web.post("/api/extra/transcribe", self.transcribe),
+            web.post("/api/extra/tts", self.tts),
+            web.post("/api/extra/abort", self.abort),
+            web.get("/api/extra/perf", self.perf),
+            web.get("/image.png", self.image_file),
+        ])
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 5001) -> str:
+        self.runner = web.AppRunner(self.app())
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        return f"http://{host}:{port}"
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake KoboldCpp server for benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    for endpoint in ("generate", "txt2img", "transcribe", "tts", "websearch"):
+        parser.add_argument(f"--{endpoint}-latency", type=float, default=None,
+                            help=f"seconds per {endpoint} request")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    args = parser.parse_args()
+    latency = {
+        endpoint: getattr(args, f"{endpoint}_latency")
+        for endpoint in ("generate", "txt2img", "transcribe", "tts", "websearch")
+        if getattr(args, f"{endpoint}_latency") is not None
+    }
+    server = FakeKobold(latency, args.tokens_per_second)
+
+    async def serve():
+        print(f"Fake KoboldCpp listening on {await server.start(args.host, args.port)}", flush=True)
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
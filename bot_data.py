@@ -1,58 +1,148 @@
 import os
 import time
 import json
+from collections import OrderedDict, deque
+
+# Number of messages kept in each channel's history (the prompt builder packs as many
+# of the most recent ones as fit the token budget)
+history_limit = 50
 
 class BotChannelData:
+    __slots__ = (
+        "chat_history", "bot_reply_timestamp", "bot_override_memory", "bot_idletime",
+        "users", "tts_provider", "tts_voice", "_stop_cache",
+        "message_count", "prompt_start", "last_prompt", "prompt_tokens_reused", "prompt_tokens_evaluated"
+    )
+
     def __init__(self):
-        self.chat_history = []
+        # Bounded ring buffer: appending past history_limit drops the oldest message in O(1)
+        self.chat_history = deque(maxlen=history_limit)
         self.bot_reply_timestamp = time.time() - 9999
         self.bot_override_memory = ""
         self.bot_idletime = 120
-        self.users = []
+        # Insertion-ordered set of user display names (dict keys)
+        self.users = {}
         self.tts_provider = "koboldcpp"
         self.tts_voice = "kobo"
+        self._stop_cache = None
+        # Prompt window bookkeeping. Messages are numbered by message_count, so
+        # chat_history[0] is message number message_count - len(chat_history).
+        self.message_count = 0
+        self.prompt_start = 0
+        self.last_prompt = None
+        self.prompt_tokens_reused = 0
+        self.prompt_tokens_evaluated = 0
+
+    def add_user(self, name):
+        """Track a user by display name. O(1); invalidates the cached stop sequences."""
+        if name not in self.users:
+            self.users[name] = None
+            self._stop_cache = None
+
+    def stop_sequences(self, bot_name):
+        """
+        Return the stop sequences for this channel: the base markers, the bot's name and
+        every tracked user. Cached until the user set or the bot name changes.
+        """
+        if self._stop_cache is None or self._stop_cache[0] != bot_name:
+            stop_seq = {"\n###": None, "### ": None, f"\n{bot_name}:": None, f"{bot_name}:": None}
+            for user in self.users:
+                stop_seq.setdefault(f"{user}:", None)
+                stop_seq.setdefault(f"\n{user}:", None)
+            self._stop_cache = (bot_name, list(stop_seq))
+        return self._stop_cache[1]
+
+# Hot channels, kept in least-recently-used order. Cold channels live in the store
+# and are loaded again on first access.
+bot_data = OrderedDict()
+max_cached_channels = 1000
+store = None
+
+# Channels changed since the last flush, written by persistence.WriteBehind
+dirty_channels = set()
+# Snapshots of dirty channels that were evicted before they could be flushed
+evicted_records = {}
 
-# Global dictionary for channel data
-bot_data = {}
+def configure(channel_store, cache_size=1000, history_size=50):
+    """Set the backing store, the number of channels kept in memory and the history length."""
+    global store, max_cached_channels, history_limit
+    store = channel_store
+    max_cached_channels = cache_size
+    history_limit = history_size
 
 # Global dictionary for auto-whitelisting and voice sinks
 def get_channel_data(channel_id):
     """Return BotChannelData for a given channel_id. Auto-whitelist if missing."""
-    if channel_id not in bot_data:
-        bot_data[channel_id] = BotChannelData()
-    return bot_data[channel_id]
-
-def export_config():
-    config = []
-    for channel_id, data in bot_data.items():
-        config.append({
-            "channel_id": channel_id,
-            "bot_idletime": data.bot_idletime,
-            "bot_override_memory": data.bot_override_memory,
-            "chat_history": data.chat_history
-        })
-    with open('botsettings.json', 'w', encoding='utf-8') as file:
-        json.dump(config, file, indent=2)
-
-def import_config():
+    data = bot_data.get(channel_id)
+    if data is not None:
+        bot_data.move_to_end(channel_id)
+        return data
+
+    data = BotChannelData()
+    record = evicted_records.get(channel_id)
+    if record is None and store is not None:
+        try:
+            record = store.load(channel_id)
+        except Exception as e:
+            print(f"Failed to load channel {channel_id}:", e)
+    if record is not None:
+        apply_record(data, record)
+    bot_data[channel_id] = data
+
+    # Evict cold channels; dirty ones keep a snapshot until the next flush writes them.
+    while len(bot_data) > max_cached_channels:
+        old_id, old_data = bot_data.popitem(last=False)
+        if old_id in dirty_channels:
+            evicted_records[old_id] = channel_record(old_id, old_data)
+    return data
+
+def mark_dirty(channel_id):
+    """Mark a channel as changed so the next flush persists it."""
+    dirty_channels.add(channel_id)
+
+def channel_record(channel_id, data):
+    """Return a JSON-serializable snapshot of a channel's persisted fields."""
+    return {
+        "channel_id": channel_id,
+        "bot_idletime": data.bot_idletime,
+        "bot_override_memory": data.bot_override_memory,
+        "tts_voice": data.tts_voice,
+        "chat_history": list(data.chat_history),
+        "message_count": data.message_count
+    }
+
+def apply_record(data, item):
+    """Copy a stored channel record onto a BotChannelData."""
+    data.bot_idletime = int(item.get('bot_idletime', 120))
+    data.bot_override_memory = item.get('bot_override_memory', "")
+    data.tts_voice = item.get('tts_voice', "kobo")
+    data.chat_history = deque(item.get('chat_history', []), maxlen=history_limit)
+    # Message numbers carry over restarts (long-term memory tracks them), older records start over
+    data.message_count = max(int(item.get('message_count', 0)), len(data.chat_history))
+
+def import_config(legacy_store=None):
+    """
+    One-time migration into the store: if it is empty, copy in the records of
+    `legacy_store` (the per-channel JSON files) or, failing that, the old botsettings.json.
+    Channels themselves are loaded lazily by get_channel_data.
+    """
     try:
-        if os.path.exists('botsettings.json'):
+        if store is None or store.count() > 0:
+            return
+        records = legacy_store.load_all() if legacy_store is not None else []
+        if not records and os.path.exists('botsettings.json'):
             with open('botsettings.json', 'r', encoding='utf-8') as file:
-                data = json.load(file)
-                for item in data:
-                    channel_id = item['channel_id']
-                    if channel_id not in bot_data:
-                        bot_data[channel_id] = BotChannelData()
-                    bot_data[channel_id].bot_idletime = int(item.get('bot_idletime', 120))
-                    bot_data[channel_id].bot_override_memory = item.get('bot_override_memory', "")
-                    bot_data[channel_id].chat_history = item.get('chat_history', [])
+                records = json.load(file)
+        if records:
+            store.save_many({item['channel_id']: item for item in records})
+            print(f"Migrated {len(records)} channels into the channel store")
     except Exception as e:
         print("Failed to load configuration:", e)
 
 def append_history(channel_id, speaker, text):
-    """Append a message to the conversation history and limit history to the last 20 messages."""
-    if channel_id in bot_data:
-        message = f"{speaker}: {text}"
-        bot_data[channel_id].chat_history.append(message)
-        if len(bot_data[channel_id].chat_history) > 20:
-            bot_data[channel_id].chat_history = bot_data[channel_id].chat_history[-20:]
+    """Append a message to the conversation history, bounded to the last history_limit messages."""
+    data = get_channel_data(channel_id)
+    message = f"{speaker}: {text}"
+    data.chat_history.append(message)
+    data.message_count += 1
+    mark_dirty(channel_id)
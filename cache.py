@@ -0,0 +1,121 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+def normalize_query(query: str) -> str:
+    """
+    Cache key for a free-text query: case and whitespace don't matter.
+    """
+    return " ".join(query.lower().split())
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire after `ttl` seconds, with in-flight
+    deduplication: concurrent `get_or_fetch` calls for the same key share one fetch
+    (singleflight) instead of each hitting the backend.
+
+    None results are never cached, since that is how the HTTP helpers report failures.
+    With `ttl` None entries never expire. An optional `store` (load(key) / save(key, value),
+    e.g. SqliteCacheStore) keeps fetched values across restarts and is consulted on a miss
+    by `get_or_fetch`, in a worker thread so the event loop never waits on the database;
+    `get` and `put` only use the in-memory entries. Stored values don't expire, so the
+    store is meant for caches without a TTL.
+    """
+
+    def __init__(self, ttl: float = 600.0, max_entries: int = 256, store=None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.store = store
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+        self.inflight = {}            # key -> Future shared by concurrent callers
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "shared": 0,
+            "expired": 0,
+            "evictions": 0,
+            "store_hits": 0,
+        }
+
+    def _lookup(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self.entries[key]
+            self.stats["expired"] += 1
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    async def _load(self, key):
+        if self.store is None:
+            return None
+        value = await asyncio.to_thread(self.store.load, key)
+        if value is not None:
+            self.stats["store_hits"] += 1
+            self._remember(key, value)
+        return value
+
+    def get(self, key):
+        """
+        Return the cached value for `key`, or None if it is missing or expired.
+        """
+        value = self._lookup(key)
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def _remember(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        self.entries[key] = (expires_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def put(self, key, value):
+        if value is None:
+            return
+        self._remember(key, value)
+
+    async def get_or_fetch(self, key, fetch):
+        """
+        Return the cached value for `key`, or await `fetch()` once for all concurrent
+        callers and cache its result.
+        """
+        value = self._lookup(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+        future = self.inflight.get(key)
+        if future is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(future)
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[key] = future
+        try:
+            # Concurrent callers wait on the store lookup too, so it runs once
+            value = await self._load(key)
+            if value is not None:
+                self.stats["hits"] += 1
+                return value
+            self.stats["misses"] += 1
+            value = await fetch()
+            if value is not None:
+                self._remember(key, value)
+                if self.store is not None:
+                    await asyncio.to_thread(self.store.save, key, value)
+            return value
+        finally:
+            # Waiters see None if the fetch failed or was cancelled, like any failed request.
+            future.set_result(value)
+            del self.inflight[key]
+
+    def hit_rate(self) -> str:
+        """
+        Share of lookups served without a backend call (cache hits plus shared in-flight requests).
+        """
+        served = self.stats["hits"] + self.stats["shared"]
+        lookups = served + self.stats["misses"]
+        return f"{served / lookups:.0%}" if lookups else "n/a"
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+class _ChannelState:
+    __slots__ = ("pending", "version", "first_pending", "task", "busy", "batch")
+
+    def __init__(self):
+        self.pending = []        # messages that still need an answer
+        self.version = 0         # bumped on every new message, for the debounce
+        self.first_pending = 0.0
+        self.task = None
+        self.busy = False        # a reply is being generated
+        self.batch = None        # the batch being answered, None once discarded
+
+class ReplyCoalescer:
+    """
+    Per-channel debounce and coalescing of the messages that trigger a reply.
+
+    A reply starts once the channel has been quiet for `debounce` seconds (at most
+    `max_delay` after the first waiting message), and covers every message that arrived
+    until then. Messages that arrive while a reply is being generated are batched into a
+    single follow-up reply, so N rapid messages cost at most two generations and none is
+    left unanswered. With the "supersede" policy the reply in flight is cancelled
+    instead (see GenerationTracker) and the follow-up starts right away.
+
+    `reply(channel_id, messages)` is awaited for each batch; it should check `is_current`
+    before building its prompt and before recording its answer, since the batch may be
+    discarded while it waits in the scheduler.
+    """
+
+    def __init__(self, reply, generations=None, debounce: float = 0.5, max_delay: float = 2.0,
+                 policy: str = "coalesce"):
+        self.reply = reply
+        self.generations = generations
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self.policy = policy
+        self.channels = {}
+        self.stats = {
+            "messages": 0,
+            "replies": 0,
+            "coalesced": 0,
+            "superseded": 0,
+        }
+
+    def submit(self, channel_id, message):
+        """
+        Queue a message that should be answered in its channel.
+        """
+        state = self.channels.get(channel_id)
+        if state is None:
+            state = self.channels[channel_id] = _ChannelState()
+        if not state.pending:
+            state.first_pending = time.monotonic()
+        state.pending.append(message)
+        state.version += 1
+        self.stats["messages"] += 1
+        if state.busy and self.policy == "supersede" and self.generations is not None:
+            self.stats["superseded"] += self.generations.cancel(channel_id=channel_id, kind="chat", reason="superseded")
+        if state.task is None:
+            state.task = asyncio.create_task(self._run(channel_id, state), name=f"replies-{channel_id}")
+
+    def discard(self, channel_id):
+        """
+        Drop the messages still waiting for a reply in a channel (e.g. after /reset), and
+        mark the batch being answered, if any, as stale.
+        """
+        state = self.channels.get(channel_id)
+        if state is not None:
+            state.pending.clear()
+            state.batch = None
+
+    def is_current(self, channel_id, batch) -> bool:
+        """
+        Return False if `batch` was discarded since its reply started.
+        """
+        state = self.channels.get(channel_id)
+        return state is not None and state.batch is batch
+
+    async def _settle(self, state: _ChannelState):
+        # Wait until no message arrived for `debounce` seconds, or `max_delay` passed.
+        while True:
+            seen = state.version
+            remaining = state.first_pending + self.max_delay - time.monotonic()
+            await asyncio.sleep(max(0.0, min(self.debounce, remaining)))
+            if state.version == seen or time.monotonic() - state.first_pending >= self.max_delay:
+                return
+
+    async def _run(self, channel_id, state: _ChannelState):
+        try:
+            while state.pending:
+                if self.debounce > 0:
+                    await self._settle(state)
+                if not state.pending:
+                    break
+                batch, state.pending = state.pending, []
+                self.stats["replies"] += 1
+                self.stats["coalesced"] += len(batch) - 1
+                state.busy = True
+                state.batch = batch
+                try:
+                    await self.reply(channel_id, batch)
+                except Exception as e:
+                    print(f"Reply in channel {channel_id} failed: {e}")
+                finally:
+                    state.busy = False
+                    state.batch = None
+        finally:
+            state.task = None
+            if not state.pending:
+                self.channels.pop(channel_id, None)
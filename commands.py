@@ -1,95 +1,154 @@
 import discord
 import time
-import base64
 import asyncio
-import re
+import hashlib
+import json
 from io import BytesIO
 
-import aiohttp
 from discord import app_commands
-from discord.ext import voice_recv
-from pydub import AudioSegment
 
 # Local modules
-from bot_data import BotChannelData, get_channel_data, bot_data, export_config, append_history
-from payload import prepare_payload
+from bot_data import BotChannelData, get_channel_data, bot_data, mark_dirty, append_history
+from payload import prepare_budgeted_payload, describe_payload
+from http_client import KoboldHTTP
+from streaming import stream_reply
+from generations import GenerationCancelled
+from cache import normalize_query
+from images import prepare_image
+from drawing import RESOLUTIONS
+from scheduler import QueueFull, PRIORITY_HIGH, PRIORITY_NORMAL, channel_key
+from persistence import SqliteCacheStore
+
+# Voice and audio modules (discord-ext-voice-recv, NumPy) are imported on first use, so
+# deployments that never join voice don't pay for them at startup.
 
 # === Asynchronous HTTP Helper Functions ===
+# All helpers go through the client's shared KoboldHTTP pool (client.kobold_http),
+# so connections are reused instead of opening a new session per request.
 
-async def async_post_bytes(url: str, data: dict, timeout: int = 60):
+async def async_post_bytes(http: KoboldHTTP, url: str, data: dict, timeout: float = None):
     """
     Perform an asynchronous POST request and return the raw bytes response.
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data, timeout=timeout) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    raise Exception(f"Status code: {resp.status}, body: {text}")
-                return await resp.read()
+        session = http.session_for(url)
+        async with session.post(url, json=data, timeout=http.timeout_for(url, timeout)) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"Status code: {resp.status}, body: {text}")
+            return await resp.read()
     except Exception as e:
         print(f"❌ async_post_bytes error: {e}")
         return None
 
-async def async_post_json(url: str, data: dict, timeout: int = 60):
+async def async_post_json(http: KoboldHTTP, url: str, data: dict, timeout: float = None):
     """
     Perform an asynchronous POST request and return the JSON response.
     """
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=data, timeout=timeout) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    raise Exception(f"Status code: {resp.status}, body: {text}")
-                return await resp.json()
+        session = http.session_for(url)
+        async with session.post(url, json=data, timeout=http.timeout_for(url, timeout)) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"Status code: {resp.status}, body: {text}")
+            return await resp.json()
     except Exception as e:
         print(f"❌ async_post_json error: {e}")
         return None
 
-async def async_get_bytes(url: str, timeout: int = 30, headers: dict = None):
+async def async_get_bytes(http: KoboldHTTP, url: str, timeout: float = 30, headers: dict = None):
     """
     Perform an asynchronous GET request and return the raw bytes response.
     """
     headers = headers or {'User-Agent': 'Mozilla/5.0'}
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, timeout=timeout) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    raise Exception(f"Status code: {resp.status}, body: {text}")
-                return await resp.read()
+        session = http.session_for(url)
+        async with session.get(url, headers=headers, timeout=http.timeout_for(url, timeout)) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                raise Exception(f"Status code: {resp.status}, body: {text}")
+            return await resp.read()
     except Exception as e:
         print(f"❌ async_get_bytes error: {e}")
         return None
 
-# === TTS Helper Function ===
+async def backend_post_json(client: discord.Client, endpoint: str, data: dict):
+    """
+    POST JSON to `endpoint` (see backends.ENDPOINTS) on the least-loaded backend,
+    retrying on another one if it fails.
+    """
+    return await client.backends.call(endpoint, lambda url: async_post_json(client.kobold_http, url, data=data))
 
-async def speak_text(vc: discord.VoiceClient, text: str, client: discord.Client, channel_id: int):
-    try:
-        currchannel = get_channel_data(channel_id)
-        selected_voice = getattr(currchannel, "tts_voice", "kobo")  # default fallback
+async def backend_post_bytes(client: discord.Client, endpoint: str, data: dict):
+    """
+    Like backend_post_json, returning the raw bytes response.
+    """
+    return await client.backends.call(endpoint, lambda url: async_post_bytes(client.kobold_http, url, data=data))
 
-        tts_response = await async_post_bytes(
-            client.tts_endpoint,
-            data={"input": text, "voice": selected_voice},
-            timeout=120
-        )
+async def generate_json(client: discord.Client, channel_id: int, payload: dict, kind: str = "chat", group=None):
+    """
+    Run a non-streaming generation under the payload's genkey, so it can be cancelled
+    (see GenerationTracker).
+    """
+    return await client.generations.call(
+        "generate", channel_id, payload,
+        lambda url: async_post_json(client.kobold_http, url, data=payload),
+        kind=kind, group=group
+    )
 
-        if not tts_response:
-            print("TTS failed: No response received.")
-            return
+# === Scheduler Helper Function ===
 
-        tts_audio = BytesIO(tts_response)
-        tts_audio.seek(0)
+async def run_queued(interaction: discord.Interaction, kind: str, factory, priority: int = PRIORITY_NORMAL):
+    """
+    Run `factory` through the client's scheduler for a deferred interaction,
+    telling the user their queue position if they have to wait.
+    """
+    async def on_queued(position):
+        await interaction.followup.send(f"⏳ You're #{position} in the queue, hang tight.", ephemeral=True)
 
-        temp_path = "/tmp/kobold_tts.wav"
-        with open(temp_path, "wb") as f:
-            f.write(tts_audio.read())
+    return await interaction.client.scheduler.run(
+        kind, channel_key(interaction.channel), factory, priority=priority, on_queued=on_queued
+    )
 
-        if not vc.is_playing():
-            vc.play(discord.FFmpegPCMAudio(temp_path))
-        else:
-            print("🔇 Bot is already playing audio.")
+# === Voice Helper Functions ===
+
+def wake_gate(client: discord.Client):
+    """
+    Return the client's wake-phrase gate (voice.WakeGate), creating it on first use.
+    """
+    if client.wake_gate is None:
+        from voice import WakeGate
+        wake = client.config["wake"]
+        client.wake_gate = WakeGate(window=wake["window"], fallback=wake["fallback"], enabled=wake["enabled"])
+    return client.wake_gate
+
+def tts_player(vc: discord.VoiceClient, client: discord.Client):
+    """
+    Return the voice client's TTS playback queue (playback.TTSPlayer), creating it on first use.
+    """
+    if not hasattr(vc, "tts_player"):
+        from playback import TTSPlayer
+
+        async def synthesize(text: str, voice: str) -> bytes:
+            with client.metrics.stage("voice", "tts"):
+                return await client.scheduler.run(
+                    "tts",
+                    channel_key(vc.channel),
+                    lambda: backend_post_bytes(client, "tts", {"input": text, "voice": voice}),
+                    priority=PRIORITY_HIGH
+                )
+        vc.tts_player = TTSPlayer(vc, synthesize, lookahead=client.config["tts_lookahead"], metrics=client.metrics)
+    return vc.tts_player
+
+async def speak_text(vc: discord.VoiceClient, text: str, client: discord.Client, channel_id: int):
+    """
+    Queue `text` for playback in the voice channel. Sentences are synthesized ahead and
+    played in order; the first one starts playing as soon as it is ready.
+    """
+    try:
+        currchannel = get_channel_data(channel_id)
+        selected_voice = getattr(currchannel, "tts_voice", "kobo")  # default fallback
+        tts_player(vc, client).speak(text, selected_voice)
     except Exception as e:
         print("TTS playback error:", e)
 
@@ -112,7 +171,6 @@ async def maxlen(interaction: discord.Interaction, max_length: int):
         await interaction.response.send_message("Maximum response length cannot exceed 512.", ephemeral=True)
         return
     interaction.client.config["maxlen"] = max_length
-    export_config()
     await interaction.response.send_message(f"Maximum response length changed to {max_length}.")
 
 @app_commands.command(name="idletime", description="Set the idle timeout for the bot.")
@@ -123,7 +181,7 @@ async def idletime(interaction: discord.Interaction, idle_time: int):
         return
     currchannel = get_channel_data(interaction.channel.id)
     currchannel.bot_idletime = idle_time
-    export_config()
+    mark_dirty(interaction.channel.id)
     await interaction.response.send_message(f"Idle timeout changed to {idle_time}.")
 
 @app_commands.command(name="memory", description="Set the bot memory override. Use '0' to reset to default memory.")
@@ -139,7 +197,7 @@ async def memory(interaction: discord.Interaction, memory: str):
     else:
         currchannel.bot_override_memory = memory
         await interaction.response.send_message(f"Memory override set to: {memory}")
-    export_config()
+    mark_dirty(interaction.channel.id)
     
 @app_commands.command(name="settts", description="Set the TTS provider and voice (admin only).")
 @app_commands.choices(voice=[
@@ -156,20 +214,96 @@ async def settts(interaction: discord.Interaction, voice: app_commands.Choice[st
 
     currchannel = get_channel_data(interaction.channel.id)
     currchannel.tts_voice = voice.value
-    export_config()
+    mark_dirty(interaction.channel.id)
     await interaction.response.send_message(f"TTS voice set to **{voice.name}**.")
-    export_config()
+
+@app_commands.command(name="promptstats", description="Show prompt cache reuse for this channel (admin only).")
+async def promptstats(interaction: discord.Interaction):
+    if not is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    currchannel = get_channel_data(interaction.channel.id)
+    reused = currchannel.prompt_tokens_reused
+    evaluated = currchannel.prompt_tokens_evaluated
+    total = reused + evaluated
+    share = f"{reused / total:.0%}" if total else "n/a"
+    await interaction.response.send_message(
+        f"Prompt tokens reused: {reused}, re-evaluated: {evaluated} (reuse {share}). "
+        f"Layout: {interaction.client.config['prompt_layout']}.",
+        ephemeral=True
+    )
+
+@app_commands.command(name="voicestats", description="Show how much voice audio the wake-phrase gate saved (admin only).")
+async def voicestats(interaction: discord.Interaction):
+    if not is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    gate = interaction.client.wake_gate
+    if gate is None:
+        await interaction.response.send_message("No voice session has run yet.", ephemeral=True)
+        return
+    stats = gate.stats
+    await interaction.response.send_message(
+        f"Voice segments: {stats['segments']}, gated out: {stats['gated_out']}, "
+        f"fully transcribed: {stats['fully_transcribed']}, gate errors: {stats['gate_errors']}. "
+        f"Audio transcribed: {stats['seconds_transcribed']:.0f}s, saved: {stats['seconds_saved']:.0f}s. "
+        f"Gate: {'on' if gate.enabled else 'off'}.",
+        ephemeral=True
+    )
+
+@app_commands.command(name="backends", description="Show the state of every KoboldCpp backend (admin only).")
+async def backends(interaction: discord.Interaction):
+    if not is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    lines = interaction.client.backends.summary()
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
+
+@app_commands.command(name="cachestats", description="Show result cache hit rates (admin only).")
+async def cachestats(interaction: discord.Interaction):
+    if not is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    lines = []
+    for name, cache in (("Search results", interaction.client.search_cache),
+                        ("Search summaries", interaction.client.summary_cache),
+                        ("Image descriptions", interaction.client.describe_cache)):
+        stats = cache.stats
+        lines.append(
+            f"{name}: {len(cache.entries)} cached, hits {stats['hits']}, misses {stats['misses']} "
+            f"(hit rate {cache.hit_rate()}), shared in-flight {stats['shared']}, "
+            f"expired {stats['expired']}, evicted {stats['evictions']}, from disk {stats['store_hits']}"
+        )
+    await interaction.response.send_message("\n".join(lines), ephemeral=True)
+
+@app_commands.command(name="metrics", description="Show per-stage latencies and queue depths (admin only).")
+async def metrics(interaction: discord.Interaction):
+    if not is_admin(interaction):
+        await interaction.response.send_message("You do not have permission to use this command.", ephemeral=True)
+        return
+    lines = interaction.client.metrics.summary() or ["No timings recorded yet."]
+    depths = ", ".join(
+        f"{kind} {lane.size} queued/{lane.running} running"
+        for kind, lane in interaction.client.scheduler.lanes.items()
+    )
+    if depths:
+        lines.append(f"Queues: {depths}")
+    await interaction.response.send_message("\n".join(lines)[:2000], ephemeral=True)
 
 # === User Slash Commands ===
 
 @app_commands.command(name="reset", description="Reset the conversation history in this channel.")
 async def reset(interaction: discord.Interaction):
     currchannel = get_channel_data(interaction.channel.id)
-    currchannel.chat_history = []
+    # Stop replies still waiting or being generated for the old conversation
+    interaction.client.replies.discard(interaction.channel.id)
+    interaction.client.generations.cancel(channel_id=interaction.channel.id, reason="reset")
+    currchannel.chat_history.clear()
     currchannel.bot_reply_timestamp = time.time() - 9999
-    export_config()
+    mark_dirty(interaction.channel.id)
+    if interaction.client.memory is not None:
+        interaction.client.memory.forget(interaction.channel.id)
     await interaction.response.send_message("Cleared bot conversation history in this channel.")
-    export_config()
 
 @app_commands.command(name="describe", description="Describe an uploaded image.")
 @app_commands.describe(image="Image attachment to describe")
@@ -183,78 +317,134 @@ async def describe(interaction: discord.Interaction, image: discord.Attachment =
         await interaction.response.defer()
 
         # Download the image using aiohttp
-        img_bytes = await async_get_bytes(image.url)
+        img_bytes = await async_get_bytes(interaction.client.kobold_http, image.url)
         if img_bytes is None:
             await interaction.followup.send("Failed to download the image.", ephemeral=True)
             return
-        uploadedimg = base64.b64encode(img_bytes).decode('utf-8')
-
-        currchannel.bot_reply_timestamp = time.time()
-        payload = prepare_payload(
-            interaction.client.user.display_name, currchannel, interaction.client.config["maxlen"]
-        )
-        payload["images"] = [uploadedimg]
-        payload["prompt"] = "### Instruction:\nPlease describe the image in detail.\n\n### Response:\n"
+        # Hash, downscale to the vision model's resolution and encode in a worker thread
+        with interaction.client.metrics.stage("slash", "describe_encode"):
+            digest, uploadedimg = await asyncio.to_thread(
+                prepare_image, img_bytes, interaction.client.config["describe_max_side"]
+            )
+        del img_bytes
+
+        async def describe_image():
+            currchannel.bot_reply_timestamp = time.time()
+            # Channel-independent: the result is cached for every channel by image content
+            payload = describe_payload(
+                interaction.client.user.display_name, uploadedimg,
+                interaction.client.config["maxlen"], interaction.client.config["max_context_length"]
+            )
 
-        resp = await async_post_json(interaction.client.submit_endpoint, data=payload)
-        if resp is not None:
-            result = resp["results"][0]["text"]
+            with interaction.client.metrics.stage("slash", "describe_generate"):
+                resp = await run_queued(
+                    interaction,
+                    "generate",
+                    lambda: generate_json(interaction.client, interaction.channel.id, payload, kind="describe")
+                )
+            return resp["results"][0]["text"] if resp is not None else None
+
+        # The same image (by content) is described once; reposts and concurrent requests reuse it
+        result = await interaction.client.describe_cache.get_or_fetch(digest, describe_image)
+        if result is not None:
             await interaction.followup.send(f"Image Description: {result}")
         else:
             await interaction.followup.send("Sorry, the image transcription failed!")
+    except QueueFull:
+        await interaction.followup.send("The bot is busy. Please try again later.", ephemeral=True)
+    except GenerationCancelled as e:
+        await interaction.followup.send(f"The image description was cancelled ({e.reason}).", ephemeral=True)
     except Exception as e:
         await interaction.followup.send(f"An error occurred: {e}")
-    export_config()
 
 @app_commands.command(name="draw", description="Generate an image from a prompt with predefined settings.")
-@app_commands.describe(orientation="Select image orientation", prompt="Prompt for image generation")
+@app_commands.describe(
+    orientation="Select image orientation",
+    prompt="Prompt for image generation",
+    seed="Seed for a reproducible image (random if omitted)"
+)
 @app_commands.choices(orientation=[
     app_commands.Choice(name="Square", value="square"),
     app_commands.Choice(name="Portrait", value="portrait"),
     app_commands.Choice(name="Landscape", value="landscape")
 ])
-async def draw(interaction: discord.Interaction, orientation: app_commands.Choice[str], prompt: str):
+async def draw(interaction: discord.Interaction, orientation: app_commands.Choice[str], prompt: str,
+               seed: app_commands.Range[int, 0, 2**31 - 1] = None):
     currchannel = get_channel_data(interaction.channel.id)
-    if interaction.client.busy.locked():
-        await interaction.response.send_message("The bot is busy. Please try again later.", ephemeral=True)
-        return
+    width, height = RESOLUTIONS.get(orientation.value, RESOLUTIONS["square"])
+
+    async def on_queued(position):
+        await interaction.followup.send(f"⏳ You're #{position} in the drawing queue, hang tight.", ephemeral=True)
 
-    resolutions = {
-        "square": {"width": 384, "height": 384},
-        "portrait": {"width": 320, "height": 448},
-        "landscape": {"width": 448, "height": 320}
-    }
-    selected = resolutions.get(orientation.value, resolutions["square"])
+    async def on_start():
+        await interaction.followup.send("🎨 Drawing your image now...", ephemeral=True)
 
-    negative_prompt = "low quality, blurry, deformed, bad anatomy"
-    steps = 20
-    cfg_scale = 7.0
+    async def on_shared():
+        await interaction.followup.send("🔁 The same image is already being drawn, you'll get a copy.", ephemeral=True)
 
     try:
         await interaction.response.defer()
         currchannel.bot_reply_timestamp = time.time()
-        payload = prepare_payload(
-            interaction.client.user.display_name, currchannel, interaction.client.config["maxlen"]
+        image = await interaction.client.draw_queue.draw(
+            prompt, width, height, channel_key(interaction.channel),
+            seed=seed if seed is not None else -1,
+            on_queued=on_queued, on_start=on_start, on_shared=on_shared
         )
-        payload.update({
-            "prompt": prompt,
-            "width": selected["width"],
-            "height": selected["height"],
-            "negative_prompt": negative_prompt,
-            "steps": steps,
-            "cfg_scale": cfg_scale
-        })
-
-        resp = await async_post_json(interaction.client.imggen_endpoint, data=payload)
-        if resp is not None:
-            result = resp["images"][0]
-            file = discord.File(BytesIO(base64.b64decode(result)), filename='drawimage.png')
-            await interaction.followup.send(file=file)
+        if image is not None:
+            await interaction.followup.send(file=discord.File(BytesIO(image), filename='drawimage.png'))
         else:
-            await interaction.response.send_message("Sorry, the image generation failed!")
+            await interaction.followup.send("Sorry, the image generation failed!")
+    except QueueFull:
+        await interaction.followup.send("The bot is busy. Please try again later.", ephemeral=True)
     except Exception as e:
-        await interaction.response.send_message(f"An error occurred: {e}")
-    export_config()
+        await interaction.followup.send(f"An error occurred: {e}")
+
+async def generate_search_summary(interaction: discord.Interaction, currchannel: BotChannelData):
+    """
+    Generate the summary for /search from the channel history (which ends with the
+    results) and send it as follow-ups. Returns the summary, or None if it failed.
+    """
+    gen_payload = await prepare_budgeted_payload(
+        interaction.client.token_counter,
+        interaction.client.user.display_name,
+        currchannel,
+        interaction.client.config["maxlen"],
+        interaction.client.config["max_context_length"],
+        user_display_name=interaction.user.display_name,
+        stable=interaction.client.config["prompt_layout"] == "stable",
+        channel_key=interaction.channel.id,
+        long_term=interaction.client.memory
+    )
+
+    if interaction.client.config["streaming"]:
+        # Stream the summary into follow-up messages as it is generated
+        return await run_queued(
+            interaction,
+            "generate",
+            lambda: interaction.client.generations.call("stream", interaction.channel.id, gen_payload, lambda url: stream_reply(
+                interaction.client.kobold_http,
+                url,
+                gen_payload,
+                interaction.client.outbox.stream(
+                    interaction.channel.id,
+                    lambda text: interaction.followup.send(text, wait=True),
+                    interaction.client.config["stream_edit_interval"],
+                    pipeline="slash"
+                ),
+                on_stop=lambda: interaction.client.generations.abort(gen_payload["genkey"])
+            ), kind="search")
+        )
+
+    gen_resp = await run_queued(
+        interaction,
+        "generate",
+        lambda: generate_json(interaction.client, interaction.channel.id, gen_payload, kind="search")
+    )
+    if gen_resp is None:
+        return None
+    summary = gen_resp["results"][0]["text"]
+    interaction.client.outbox.send(interaction.channel.id, interaction.followup.send, summary, pipeline="slash")
+    return summary
 
 @app_commands.command(name="search", description="Search the web and show a summary followed by results.")
 @app_commands.describe(query="The search query")
@@ -262,8 +452,18 @@ async def search(interaction: discord.Interaction, query: str):
     try:
         await interaction.response.defer()
 
+        # Identical queries (case and spacing aside) share cached results and one in-flight request
+        query_key = normalize_query(query)
         search_payload = {"q": query}
-        search_resp = await async_post_json(interaction.client.websearch_endpoint, data=search_payload)
+        with interaction.client.metrics.stage("slash", "search_results"):
+            search_resp = await interaction.client.search_cache.get_or_fetch(
+                query_key,
+                lambda: run_queued(
+                    interaction,
+                    "websearch",
+                    lambda: backend_post_json(interaction.client, "websearch", search_payload)
+                )
+            )
         if not search_resp:
             await interaction.followup.send("Web search failed.", ephemeral=True)
             return
@@ -284,25 +484,21 @@ async def search(interaction: discord.Interaction, query: str):
         currchannel = get_channel_data(interaction.channel.id)
         append_history(interaction.channel.id, interaction.user.display_name, prompt_text)
 
-        gen_payload = prepare_payload(
-            interaction.client.user.display_name,
-            currchannel,
-            interaction.client.config["maxlen"],
-            user_display_name=interaction.user.display_name
-        )
-
-        gen_resp = await async_post_json(interaction.client.submit_endpoint, data=gen_payload)
-        if gen_resp is not None:
-            summary = gen_resp["results"][0]["text"]
-            append_history(interaction.channel.id, interaction.client.user.display_name, summary)
-            if len(summary) > 2000:
-                for chunk in (summary[i:i+2000] for i in range(0, len(summary), 2000)):
-                    await interaction.followup.send(chunk)
-            else:
-                await interaction.followup.send(summary)
+        # A summary of the same results generated recently in this channel is reused as is.
+        # Summaries come from the channel's history and memory, so only the results are shared
+        summary_key = (interaction.channel.id, query_key)
+        summary = interaction.client.summary_cache.get(summary_key)
+        if summary is not None:
+            interaction.client.outbox.send(interaction.channel.id, interaction.followup.send, summary)
         else:
-            await interaction.followup.send("Failed to generate summary.", ephemeral=True)
-            return
+            with interaction.client.metrics.stage("slash", "search_summary"):
+                summary = await generate_search_summary(interaction, currchannel)
+            if summary is None:
+                await interaction.followup.send("Failed to generate summary.", ephemeral=True)
+                return
+            if summary.strip():
+                interaction.client.summary_cache.put(summary_key, summary)
+        append_history(interaction.channel.id, interaction.client.user.display_name, summary)
 
         results_embed = discord.Embed(title=f"Search results for: {query}", color=discord.Color.blue())
         for result in results:
@@ -310,10 +506,14 @@ async def search(interaction: discord.Interaction, query: str):
             desc  = result.get("desc", "No Description")
             url   = result.get("url", "")
             results_embed.add_field(name=title, value=f"{desc}\n[Read more]({url})", inline=False)
-        await interaction.followup.send(embed=results_embed)
+        # Queued behind the summary, so it still arrives after it
+        await interaction.client.outbox.send(interaction.channel.id, interaction.followup.send, embed=results_embed)
+    except QueueFull:
+        await interaction.followup.send("The bot is busy. Please try again later.", ephemeral=True)
+    except GenerationCancelled as e:
+        await interaction.followup.send(f"The search summary was cancelled ({e.reason}).", ephemeral=True)
     except Exception as e:
         await interaction.followup.send(f"An error occurred: {e}", ephemeral=True)
-    export_config()
 
 # === Voice Commands ===
 
@@ -330,6 +530,7 @@ async def joinvoice(interaction: discord.Interaction):
         vc = interaction.guild.voice_client
         if not vc:
             # Connect using the voice receiver client from discord-ext-voice-recv
+            from discord.ext import voice_recv
             vc = await interaction.user.voice.channel.connect(cls=voice_recv.VoiceRecvClient)
         await interaction.response.send_message(f"Joined voice channel: **{interaction.user.voice.channel.name}**")
 
@@ -339,72 +540,48 @@ async def joinvoice(interaction: discord.Interaction):
             )
     except Exception as e:
         await interaction.response.send_message(f"Failed to join voice channel: {e}", ephemeral=True)
-    export_config()
 
 async def voice_listener(vc: discord.VoiceClient, text_channel: discord.TextChannel, client: discord.Client):
     """
-    Continuously listens to the voice channel, buffers audio, detects silence,
-    and processes transcriptions for trigger phrases. When detected, sends
-    commands to generate a bot response.
+    Continuously listens to the voice channel, segments each speaker's audio into
+    utterances with voice activity detection, and processes transcriptions for
+    trigger phrases. When detected, sends commands to generate a bot response.
     """
-    audio_buffer = BytesIO()
-    buffer_lock = asyncio.Lock()
-    last_packet_time = time.time()
-    last_speaker = None
+    from discord.ext import voice_recv
+    from voice import VoiceSegmenter, Segment
+    from audio import pcm_to_wav_base64
+
     loop = asyncio.get_running_loop()
+    gate = wake_gate(client)
 
     bot_name = client.user.display_name
     maxlen = client.config["maxlen"]
-    submit_endpoint = client.submit_endpoint
-    transcribe_endpoint = client.transcribe_endpoint
-    tts_endpoint = client.tts_endpoint
+
+    # Per-speaker voice activity detection runs on the sink thread; the event loop is
+    # only woken when an utterance is finished and lands in this queue
+    segments = asyncio.Queue()
+    vad = client.config["vad"]
+    segmenter = VoiceSegmenter(
+        segments.put_nowait,
+        threshold_db=vad["threshold_db"],
+        hangover=vad["hangover"],
+        min_utterance=vad["min_utterance"],
+        max_utterance=vad["max_utterance"],
+        loop=loop
+    )
 
     def callback(user: discord.Member, packet: voice_recv.VoiceData):
-        nonlocal last_packet_time
+        if not packet.pcm:
+            return
         try:
-            asyncio.run_coroutine_threadsafe(write_audio(packet.pcm, user), loop)
-            last_packet_time = time.time()
+            segmenter.feed(packet.packet.ssrc, user, packet.pcm)
         except Exception as e:
-            print(f"Error scheduling audio write: {e}")
-
-    async def write_audio(pcm_data: bytes, user: discord.Member):
-        nonlocal audio_buffer, last_packet_time, last_speaker
-        async with buffer_lock:
-            try:
-                audio_buffer.write(pcm_data)
-                last_packet_time = time.time()
-                last_speaker = user
-            except Exception as e:
-                print(f"Error writing audio: {e}")
+            print(f"Error buffering audio: {e}")
 
-    vc.listen(voice_recv.BasicSink(callback))
-    SILENCE_TIMEOUT = 1.2  # seconds of silence to trigger processing
-
-    while True:
-        await asyncio.sleep(0.5)
-        current_time = time.time()
-        if current_time - last_packet_time < SILENCE_TIMEOUT:
-            continue
-
-        async with buffer_lock:
-            if audio_buffer.getbuffer().nbytes == 0:
-                continue
-
-            audio = AudioSegment(
-                data=audio_buffer.getvalue(),
-                sample_width=2,
-                frame_rate=48000,
-                channels=2
-            ).set_channels(1).set_frame_rate(16000).set_sample_width(2).normalize(headroom=0.5)
-
-            # Reset the audio buffer
-            audio_buffer.truncate(0)
-            audio_buffer.seek(0)
-
-        # Export the audio to WAV format
-        wav_buffer = BytesIO()
-        audio.export(wav_buffer, format="wav", codec="pcm_s16le", parameters=["-ar", "16000", "-ac", "1"])
-        base64_audio = base64.b64encode(wav_buffer.getvalue()).decode('utf-8')
+    async def transcribe(pcm: bytes) -> str:
+        # Downmix, resample to 16 kHz, normalize and wrap as WAV in a worker thread
+        with client.metrics.stage("voice", "encode"):
+            base64_audio = await asyncio.to_thread(pcm_to_wav_base64, pcm)
 
         transcribe_payload = {
             "audio_data": base64_audio,
@@ -413,54 +590,122 @@ async def voice_listener(vc: discord.VoiceClient, text_channel: discord.TextChan
             "prompt": f"The user is saying commands to a voice assistant named '{bot_name}'."
         }
 
-        try:
-            trans_response = await async_post_json(transcribe_endpoint, data=transcribe_payload, timeout=120)
-            if not trans_response:
-                print("Transcription API failed.")
-                continue
-
-            transcribed_text = trans_response.get("text", "").strip().lower()
-            if not transcribed_text:
-                continue
-
-            # Check for the trigger phrase (e.g., "hey bot")
-            if re.search(r"\b(hey[, ]+)?bot\b", transcribed_text, re.IGNORECASE):
-                print("✅ Trigger phrase matched.")
-                channel_id = text_channel.id
-                speaker_name = last_speaker.display_name if last_speaker else "Voice User"
-
-                # Update channel data with the speaker
-                currchannel = get_channel_data(channel_id)
-                if speaker_name not in currchannel.users:
-                    currchannel.users.append(speaker_name)
-                append_history(channel_id, speaker_name, transcribed_text)
-
-                currchannel.bot_reply_timestamp = time.time()
-                bot_payload = prepare_payload(bot_name, currchannel, maxlen)
-                bot_resp = await async_post_json(submit_endpoint, data=bot_payload)
-                if bot_resp is not None:
-                    bot_reply = bot_resp["results"][0]["text"]
-                    append_history(channel_id, bot_name, bot_reply)
-                    # Speak the bot's reply in the voice channel
-                    await speak_text(vc, bot_reply, client, channel_id=text_channel.id)
-                else:
-                    print(f"Voice transcription: {transcribed_text} - Bot failed to respond.")
-        except Exception as e:
-            print("Error during transcription:", e)
+        with client.metrics.stage("voice", "transcribe"):
+            trans_response = await client.scheduler.run(
+                "transcribe",
+                channel_key(text_channel),
+                lambda: backend_post_json(client, "transcribe", transcribe_payload),
+                priority=PRIORITY_HIGH
+            )
+        if not trans_response:
+            print("Transcription API failed.")
+            return None
+        return trans_response.get("text", "").strip().lower()
+
+    async def process_segment(segment: Segment):
+        # Hangover plus the hand-off from the sink thread: end of speech until we get here
+        client.metrics.observe("stage_seconds", time.monotonic() - segment.ended_at, pipeline="voice", stage="vad")
+        # Transcribe a short leading window first; only utterances that start with the
+        # trigger phrase (e.g., "hey bot") are transcribed in full
+        transcribed_text = await gate.transcribe(segment, transcribe)
+        if transcribed_text:
+            print("✅ Trigger phrase matched.")
+            channel_id = text_channel.id
+            speaker_name = segment.user.display_name if segment.user else "Voice User"
+
+            # Update channel data with the speaker
+            currchannel = get_channel_data(channel_id)
+            currchannel.add_user(speaker_name)
+            append_history(channel_id, speaker_name, transcribed_text)
+
+            currchannel.bot_reply_timestamp = time.time()
+            async def generate_voice_reply():
+                bot_payload = await prepare_budgeted_payload(
+                    client.token_counter, bot_name, currchannel, maxlen, client.config["max_context_length"],
+                    stable=client.config["prompt_layout"] == "stable",
+                    channel_key=channel_id,
+                    long_term=client.memory
+                )
+                return await generate_json(client, channel_id, bot_payload, kind="voice", group=("voice", vc.guild.id))
+
+            with client.metrics.stage("voice", "generate"):
+                bot_resp = await client.scheduler.run(
+                    "generate", channel_key(text_channel), generate_voice_reply, priority=PRIORITY_HIGH
+                )
+            if bot_resp is not None:
+                bot_reply = bot_resp["results"][0]["text"]
+                append_history(channel_id, bot_name, bot_reply)
+                # Speak the bot's reply in the voice channel
+                await speak_text(vc, bot_reply, client, channel_id=text_channel.id)
+                client.metrics.observe(
+                    "stage_seconds", time.monotonic() - segment.ended_at, pipeline="voice", stage="reply_queued"
+                )
+            else:
+                print(f"Voice transcription: {transcribed_text} - Bot failed to respond.")
+
+    vc.listen(voice_recv.BasicSink(callback))
+    try:
+        while True:
+            segment = await segments.get()
+            try:
+                await process_segment(segment)
+            except QueueFull:
+                await text_channel.send("The bot is busy and had to skip a voice request. Please try again shortly.")
+            except GenerationCancelled:
+                pass
+            except Exception as e:
+                print("Error during transcription:", e)
+    finally:
+        if vc.is_listening():
+            vc.stop_listening()
+        segmenter.close()
 
-        export_config()
-        
 @app_commands.command(name="leavevoice", description="Leave the voice channel and stop listening.")
 async def leavevoice(interaction: discord.Interaction):
     vc = interaction.guild.voice_client
+    # Nobody will hear replies still being generated for this voice session
+    interaction.client.generations.cancel(group=("voice", interaction.guild.id), reason="left voice")
     if vc and hasattr(vc, "voice_listener_task"):
         vc.voice_listener_task.cancel()
+    if vc and hasattr(vc, "tts_player"):
+        await vc.tts_player.close()
     if vc:
         await vc.disconnect()
     await interaction.response.send_message("Left the voice channel.")
 
 # === Register Commands ===
 
+def command_fingerprint(tree: app_commands.CommandTree) -> str:
+    """
+    Hash of the command definitions as they are sent to Discord.
+    """
+    definitions = sorted((command.to_dict(tree) for command in tree.get_commands()), key=lambda d: d["name"])
+    return hashlib.sha256(json.dumps(definitions, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def sync_commands(app: discord.Client, db_path: str, force: bool = False):
+    """
+    Sync the command tree with Discord only when the definitions changed since the last
+    successful sync (or with `force`). The fingerprint is kept in the bot database, so
+    restarts and gateway reconnects don't spend Discord's rate-limited sync API. Database
+    calls run in a worker thread, off the event loop.
+    """
+    fingerprint = command_fingerprint(app.tree)
+    key = f"command_tree:{app.application_id}"
+    store = None
+    try:
+        store = await asyncio.to_thread(SqliteCacheStore, db_path, "meta")
+        if not force and await asyncio.to_thread(store.load, key) == fingerprint:
+            print("Commands unchanged, skipping sync")
+            return
+        synced = await app.tree.sync()
+        await asyncio.to_thread(store.save, key, fingerprint)
+        print(f"Synced {len(synced)} commands")
+    except Exception as e:
+        print("Error syncing commands:", e)
+    finally:
+        if store is not None:
+            await asyncio.to_thread(store.close)
+
 def setup(app: discord.Client):
     """
     Register all slash commands to the client's command tree.
@@ -470,6 +715,11 @@ def setup(app: discord.Client):
     tree.add_command(idletime)
     tree.add_command(memory)
     tree.add_command(settts)
+    tree.add_command(promptstats)
+    tree.add_command(voicestats)
+    tree.add_command(backends)
+    tree.add_command(cachestats)
+    tree.add_command(metrics)
     tree.add_command(reset)
     tree.add_command(describe)
     tree.add_command(draw)
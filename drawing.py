@@ -0,0 +1,172 @@
+import asyncio
+import base64
+
+from scheduler import GenerationScheduler, PRIORITY_NORMAL
+
+# /draw defaults, sent as a lean txt2img payload (no chat history or sampler fields).
+NEGATIVE_PROMPT = "low quality, blurry, deformed, bad anatomy"
+STEPS = 20
+CFG_SCALE = 7.0
+
+RESOLUTIONS = {
+    "square": (384, 384),
+    "portrait": (320, 448),
+    "landscape": (448, 320),
+}
+
+def txt2img_payload(prompt: str, width: int, height: int, seed: int = -1, batch_size: int = 1) -> dict:
+    """
+    Build a txt2img request with only the fields the image backend uses.
+    """
+    payload = {
+        "prompt": prompt,
+        "negative_prompt": NEGATIVE_PROMPT,
+        "width": width,
+        "height": height,
+        "steps": STEPS,
+        "cfg_scale": CFG_SCALE,
+        "seed": seed,
+    }
+    if batch_size > 1:
+        payload["batch_size"] = batch_size
+    return payload
+
+def decode_images(images: list) -> list:
+    """
+    Decode the base64 PNGs of a txt2img response. CPU-bound: run it in a worker thread.
+    """
+    return [base64.b64decode(image) for image in images]
+
+class DrawJob:
+    __slots__ = ("key", "seed", "future", "on_start", "claimed")
+
+    def __init__(self, key: tuple, seed: int, future: asyncio.Future):
+        self.key = key          # (prompt, width, height)
+        self.seed = seed
+        self.future = future    # PNG bytes, or None if the generation failed
+        self.on_start = None    # feedback for requests that had to wait
+        self.claimed = False    # taken by a render (its own or another job's batch)
+
+class DrawQueue:
+    """
+    Image generation queue in front of the scheduler's txt2img lane.
+
+    Requests for the same prompt, size and explicit seed would produce the same image,
+    so they share a single job. Requests with a random seed (-1) for the same prompt and
+    size that are waiting together are rendered in one call with `batch_size` (up to
+    `max_batch`, for backends that honor it), one image per requester. The PNGs are
+    decoded in a worker thread, off the event loop.
+
+    `render(payload)` performs the txt2img request and returns the JSON response or None.
+    """
+
+    def __init__(self, scheduler: GenerationScheduler, render, max_batch: int = 1):
+        self.scheduler = scheduler
+        self.render = render
+        self.max_batch = max(1, max_batch)
+        self.jobs = {}     # (prompt, width, height, seed) -> DrawJob, for explicit seeds
+        self.waiting = {}  # (prompt, width, height) -> [DrawJob] not started yet, random seeds
+        self.stats = {
+            "requests": 0,
+            "renders": 0,
+            "deduplicated": 0,
+            "batched": 0,
+            "failed": 0,
+        }
+
+    async def draw(self, prompt: str, width: int, height: int, key: tuple, seed: int = -1,
+                   priority: int = PRIORITY_NORMAL, on_queued=None, on_start=None, on_shared=None):
+        """
+        Generate one image and return its PNG bytes, or None if it failed.
+
+        `key` is the scheduler fairness key (see channel_key). The feedback callbacks are
+        awaited with the queue position when the request has to wait (`on_queued`), when
+        its render starts after waiting (`on_start`), and when it joins an identical
+        request already queued or running (`on_shared`). Raises QueueFull like the scheduler.
+        """
+        self.stats["requests"] += 1
+        prompt_key = (prompt, width, height)
+        if seed >= 0:
+            job = self.jobs.get(prompt_key + (seed,))
+            if job is not None:
+                self.stats["deduplicated"] += 1
+                await self._notify(on_shared)
+                return await asyncio.shield(job.future)
+
+        job = DrawJob(prompt_key, seed, asyncio.get_running_loop().create_future())
+        queued = self.scheduler.submit("txt2img", key, lambda: self._render(job), priority)
+        position = self.scheduler.position(queued)
+        if position > 0:
+            job.on_start = on_start
+        if seed >= 0:
+            self.jobs[prompt_key + (seed,)] = job
+        else:
+            self.waiting.setdefault(prompt_key, []).append(job)
+        # A random-seed job can be rendered as part of another job's batch before its own
+        # turn comes, so wait for the image rather than for the scheduler job; the latter
+        # only matters if the scheduler drops it (on shutdown).
+        queued.future.add_done_callback(
+            lambda future: future.cancelled() and not job.future.done() and job.future.cancel()
+        )
+        try:
+            if position > 0:
+                await self._notify(on_queued, position)
+            return await job.future
+        finally:
+            if not queued.future.done():
+                queued.future.cancel()  # the scheduler skips it
+            if not job.future.done():
+                job.future.cancel()
+            if seed >= 0:
+                self.jobs.pop(prompt_key + (seed,), None)
+            else:
+                self._unwait(job)
+
+    async def _notify(self, callback, *args):
+        if callback is None:
+            return
+        try:
+            await callback(*args)
+        except Exception as e:
+            print(f"Draw feedback failed: {e}")
+
+    def _unwait(self, job: DrawJob):
+        waiting = self.waiting.get(job.key)
+        if waiting is not None and job in waiting:
+            waiting.remove(job)
+            if not waiting:
+                del self.waiting[job.key]
+
+    async def _render(self, job: DrawJob):
+        if job.claimed or job.future.done():
+            return None  # part of another job's batch, or abandoned
+        batch = [job]
+        if job.seed < 0:
+            self._unwait(job)
+            waiting = self.waiting.get(job.key, [])
+            while waiting and len(batch) < self.max_batch:
+                batch.append(waiting.pop(0))
+            if not waiting:
+                self.waiting.pop(job.key, None)
+        for member in batch:
+            member.claimed = True
+        images = []
+        try:
+            for member in batch:
+                await self._notify(member.on_start)
+            prompt, width, height = job.key
+            self.stats["renders"] += 1
+            self.stats["batched"] += len(batch) - 1
+            resp = await self.render(txt2img_payload(prompt, width, height, job.seed, len(batch)))
+            if resp is not None:
+                images = await asyncio.to_thread(decode_images, resp.get("images", [])[:len(batch)])
+        except Exception as e:
+            print(f"❌ Image generation failed: {e}")
+        finally:
+            # Members without an image (failure, short batch or shutdown) get None.
+            if len(images) < len(batch):
+                self.stats["failed"] += len(batch) - len(images)
+            for i, member in enumerate(batch):
+                if not member.future.done():
+                    member.future.set_result(images[i] if i < len(images) else None)
+        return images[0] if images else None
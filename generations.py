@@ -0,0 +1,126 @@
+import asyncio
+
+from backends import BackendRouter, DeliveryFailed
+
+class GenerationCancelled(Exception):
+    """
+    Raised by GenerationTracker.call when the generation was cancelled on purpose
+    (reset, leaving voice, superseded by a newer turn). Callers just drop the reply.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+class Generation:
+    __slots__ = ("genkey", "channel_id", "kind", "group", "base_url", "task", "reason")
+
+    def __init__(self, genkey, channel_id, kind, group):
+        self.genkey = genkey
+        self.channel_id = channel_id
+        self.kind = kind
+        self.group = group
+        self.base_url = None   # backend the current attempt runs on
+        self.task = None
+        self.reason = None     # set once cancelled
+
+class GenerationTracker:
+    """
+    Keeps track of in-flight text generations by genkey so they can be cancelled.
+
+    Cancelling a generation cancels the local request and tells the backend it was
+    running on to abort it (KoboldCpp's /api/extra/abort), so the backend stops spending
+    compute on a reply nobody will see and the scheduler slot goes to the next job. A
+    generation that fails or times out on a backend is aborted there too before the
+    router retries it elsewhere.
+    """
+
+    def __init__(self, backends: BackendRouter):
+        self.backends = backends
+        self.active = {}  # genkey -> Generation
+        self.pending_aborts = set()
+        self.stats = {
+            "started": 0,
+            "cancelled": 0,
+            "aborts_sent": 0,
+        }
+
+    def _abort(self, generation: Generation):
+        if generation.base_url is None:
+            return
+        self.stats["aborts_sent"] += 1
+        task = asyncio.create_task(self.backends.abort(generation.base_url, generation.genkey))
+        self.pending_aborts.add(task)
+        task.add_done_callback(self.pending_aborts.discard)
+
+    def abort(self, genkey) -> bool:
+        """
+        Tell the backend to stop a generation whose reply is already complete (e.g. a stop
+        sequence was seen in the stream), without cancelling the local request.
+        """
+        generation = self.active.get(genkey)
+        if generation is None:
+            return False
+        self._abort(generation)
+        return True
+
+    def cancel(self, channel_id=None, group=None, kind=None, reason: str = "cancelled") -> int:
+        """
+        Cancel every in-flight generation matching the given channel, group and kind.
+        Returns how many were cancelled.
+        """
+        cancelled = 0
+        for generation in list(self.active.values()):
+            if channel_id is not None and generation.channel_id != channel_id:
+                continue
+            if group is not None and generation.group != group:
+                continue
+            if kind is not None and generation.kind != kind:
+                continue
+            if generation.reason is not None:
+                continue
+            generation.reason = reason
+            generation.task.cancel()
+            self._abort(generation)
+            cancelled += 1
+        self.stats["cancelled"] += cancelled
+        return cancelled
+
+    async def call(self, endpoint: str, channel_id, payload: dict, request, kind: str = "chat", group=None):
+        """
+        Run a generation through the backend router under the payload's genkey.
+
+        `request(url)` performs the HTTP call, as for BackendRouter.call. `kind` and
+        `group` (e.g. a voice session) are what `cancel` can select on. Raises
+        GenerationCancelled if this generation is cancelled while running.
+        """
+        generation = Generation(payload["genkey"], channel_id, kind, group)
+
+        def on_dispatch(base_url):
+            generation.base_url = base_url
+
+        async def attempt(url):
+            result = await request(url)
+            if result is None:
+                # Failed or timed out: make sure the backend isn't still generating it.
+                self._abort(generation)
+            return result
+
+        self.stats["started"] += 1
+        self.active[generation.genkey] = generation
+        generation.task = asyncio.create_task(self.backends.call(endpoint, attempt, on_dispatch=on_dispatch))
+        try:
+            return await generation.task
+        except DeliveryFailed:
+            # The reply can't be shown (e.g. the channel is read-only): stop generating it
+            self._abort(generation)
+            raise
+        except asyncio.CancelledError:
+            if generation.reason is not None:
+                raise GenerationCancelled(generation.reason)
+            # The caller itself was cancelled (e.g. shutdown); stop the backend too.
+            generation.reason = "caller cancelled"
+            self._abort(generation)
+            raise
+        finally:
+            self.active.pop(generation.genkey, None)
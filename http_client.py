@@ -0,0 +1,86 @@
+from urllib.parse import urlsplit
+
+import aiohttp
+
+# Default per-endpoint timeouts in seconds. Generation and image jobs can run long,
+# web search should fail fast.
+DEFAULT_TIMEOUTS = {
+    "generate": 300,
+    "txt2img": 300,
+    "transcribe": 120,
+    "tts": 120,
+    "websearch": 30,
+    "tokencount": 10,
+    "default": 60,
+}
+
+class KoboldHTTP:
+    """
+    Long-lived, pooled HTTP sessions shared by every request the bot makes.
+
+    One aiohttp session (with its own connector) is kept per backend origin, so
+    keep-alive connections are reused across replies instead of opening a new
+    TCP/TLS connection for every call.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 20,
+                 keepalive_timeout: float = 30.0, timeouts: dict = None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(timeouts or {})
+        self.endpoints = {}  # url -> endpoint kind, used to pick a timeout
+        self.sessions = {}   # origin -> aiohttp.ClientSession
+
+    def register(self, kind: str, url: str):
+        """
+        Register an endpoint URL under a kind (generate, txt2img, ...) so requests to it
+        get that kind's timeout.
+        """
+        self.endpoints[url] = kind
+
+    def timeout_for(self, url: str, timeout: float = None) -> aiohttp.ClientTimeout:
+        """
+        Return the ClientTimeout for a URL, honouring an explicit override.
+        """
+        if timeout is None:
+            kind = self.endpoints.get(url, "default")
+            timeout = self.timeouts.get(kind, self.timeouts["default"])
+        return aiohttp.ClientTimeout(total=timeout)
+
+    def session_for(self, url: str) -> aiohttp.ClientSession:
+        """
+        Return the shared session for the origin of `url`, creating it on first use.
+        Must be called from within the running event loop.
+        """
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        session = self.sessions.get(origin)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self.sessions[origin] = session
+        return session
+
+    async def start(self):
+        """
+        Open the sessions for every registered endpoint up front.
+        """
+        for url in self.endpoints:
+            self.session_for(url)
+
+    async def close(self):
+        """
+        Close every session and its pooled connections.
+        """
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
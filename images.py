@@ -0,0 +1,49 @@
+import base64
+import hashlib
+from io import BytesIO
+
+# Pillow is optional: without it images are uploaded at their original size.
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Longest side sent to the vision model. Vision encoders work on a few hundred pixels,
+# so anything larger only bloats the request.
+DEFAULT_MAX_SIDE = 768
+
+def image_digest(data: bytes) -> str:
+    """
+    Content hash of an image, used as its cache key.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+def downscale(data: bytes, max_side: int = DEFAULT_MAX_SIDE) -> bytes:
+    """
+    Shrink an image so its longest side is at most `max_side` pixels and re-encode it
+    as JPEG. Returns the original bytes if Pillow is missing, the image is already
+    small enough, or it can't be decoded.
+    """
+    if Image is None:
+        return data
+    try:
+        with Image.open(BytesIO(data)) as image:
+            if max(image.size) <= max_side:
+                return data
+            image.draft("RGB", (max_side, max_side))  # cheap JPEG decode at reduced size
+            image = image.convert("RGB")
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, format="JPEG", quality=90)
+    except Exception as e:
+        print(f"Image downscale failed, uploading original: {e}")
+        return data
+    smaller = output.getvalue()
+    return smaller if len(smaller) < len(data) else data
+
+def prepare_image(data: bytes, max_side: int = DEFAULT_MAX_SIDE) -> tuple:
+    """
+    Return (content hash, base64 of the downscaled image) for an upload. CPU-bound: run
+    it in a worker thread (asyncio.to_thread) rather than on the event loop.
+    """
+    return image_digest(data), base64.b64encode(downscale(data, max_side)).decode("utf-8")
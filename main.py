@@ -1,16 +1,30 @@
+import time
+
+# Process start, for the cold-start time logged once the bot is ready
+STARTED = time.perf_counter()
+
 import discord
 import os
-import threading
-import time
 import base64
 import io
 import asyncio
-import aiohttp
 
 from dotenv import load_dotenv
-from discord.ext.voice_recv import VoiceRecvClient  # <-- ADDED IMPORT
-from bot_data import BotChannelData, get_channel_data, bot_data, import_config, export_config, append_history
-from payload import prepare_payload
+from bot_data import BotChannelData, get_channel_data, bot_data, configure, import_config, append_history
+from payload import prepare_budgeted_payload
+from tokens import TokenCounter
+from http_client import KoboldHTTP
+from backends import BackendRouter, CAPABILITIES
+from generations import GenerationTracker, GenerationCancelled
+from coalesce import ReplyCoalescer
+from cache import TTLCache
+from drawing import DrawQueue
+from outbound import Outbox
+from metrics import Metrics
+from persistence import JsonChannelStore, SqliteChannelStore, SqliteCacheStore, SqliteMemoryStore, WriteBehind
+from streaming import stream_reply
+from sharding import SharedSlots, run_sharded
+from scheduler import GenerationScheduler, QueueFull, PRIORITY_HIGH, PRIORITY_LOW, channel_key
 import commands
 
 # Load environment variables
@@ -26,36 +40,379 @@ KAI_ENDPOINT = os.getenv("KAI_ENDPOINT")
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_NAME = os.getenv("ADMIN_NAME")
 
-submit_endpoint = f"{KAI_ENDPOINT}/api/v1/generate"
-config = {"maxlen": 512}
+# Sharding: SHARD_COUNT (a number, or "auto" for Discord's recommendation) runs an
+# AutoShardedClient; SHARD_PROCESSES > 1 spreads the shards over that many worker processes
+# sharing the SQLite store (see sharding.py). SHARD_IDS/SHARD_PROCESS_INDEX are set for workers
+SHARD_COUNT = os.getenv("SHARD_COUNT", "")
+SHARD_PROCESSES = int(os.getenv("SHARD_PROCESSES", 1))
+SHARD_IDS = os.getenv("SHARD_IDS")
+PROCESS_INDEX = int(os.getenv("SHARD_PROCESS_INDEX", 0))
 
-intents = discord.Intents.all()
-client = discord.Client(
-    intents=intents,
-    voice_client_class=VoiceRecvClient  # <-- KEY CHANGE: Enable voice reception
+# KoboldCpp instances: KAI_ENDPOINT is a comma-separated list, and KAI_ENDPOINT_<CAPABILITY>
+# (e.g. KAI_ENDPOINT_TXT2IMG) gives a capability its own pool instead
+backend_pools = {
+    capability: [url.strip() for url in os.getenv(f"KAI_ENDPOINT_{capability.upper()}", KAI_ENDPOINT).split(",") if url.strip()]
+    for capability in CAPABILITIES
+}
+
+config = {
+    "maxlen": 512,
+    # Context size of the model; the prompt is packed to fit it
+    "max_context_length": int(os.getenv("MAX_CONTEXT_LENGTH", 4096)),
+    # "stable" keeps the prompt prefix identical between turns so KoboldCpp can reuse its cache,
+    # "sliding" always packs the most recent messages
+    "prompt_layout": os.getenv("PROMPT_LAYOUT", "stable"),
+    # Voice activity detection: level threshold (dBFS), silence before an utterance ends,
+    # minimum voiced speech per utterance and maximum utterance length (seconds)
+    "vad": {
+        "threshold_db": float(os.getenv("VAD_THRESHOLD_DB", -45)),
+        "hangover": float(os.getenv("VAD_HANGOVER", 0.8)),
+        "min_utterance": float(os.getenv("VAD_MIN_UTTERANCE", 0.4)),
+        "max_utterance": float(os.getenv("VAD_MAX_UTTERANCE", 30))
+    },
+    # Wake-phrase gating: transcribe only the first WAKE_WINDOW seconds of an utterance and
+    # the rest only if it starts with the wake phrase; WAKE_FALLBACK ("full" or "drop")
+    # decides what happens when the short transcription fails
+    "wake": {
+        "enabled": os.getenv("WAKE_GATE", "1") == "1",
+        "window": float(os.getenv("WAKE_WINDOW", 2.0)),
+        "fallback": os.getenv("WAKE_FALLBACK", "full")
+    },
+    # Stream replies token by token and edit the Discord message as text arrives
+    "streaming": os.getenv("STREAM_REPLIES", "1") == "1",
+    "stream_edit_interval": float(os.getenv("STREAM_EDIT_INTERVAL", 1.0)),
+    # Messages that trigger a reply are batched until the channel is quiet for
+    # REPLY_DEBOUNCE seconds (at most REPLY_MAX_DELAY). With REPLY_POLICY "coalesce",
+    # messages arriving during a reply get one follow-up reply afterwards; "supersede"
+    # cancels the reply in flight (and aborts it on the backend) instead
+    "reply_policy": os.getenv("REPLY_POLICY", "coalesce"),
+    "reply_debounce": float(os.getenv("REPLY_DEBOUNCE", 0.5)),
+    "reply_max_delay": float(os.getenv("REPLY_MAX_DELAY", 2.0)),
+    # Longest image side sent to the vision model by /describe (downscaling needs Pillow)
+    "describe_max_side": int(os.getenv("DESCRIBE_MAX_SIDE", 768)),
+    # Sentences synthesized ahead of voice playback
+    "tts_lookahead": int(os.getenv("TTS_LOOKAHEAD", 3))
+}
+
+# Shared HTTP pool settings (connection limits, keep-alive and per-endpoint timeouts)
+kobold_http = KoboldHTTP(
+    limit=int(os.getenv("HTTP_POOL_LIMIT", 100)),
+    limit_per_host=int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20)),
+    keepalive_timeout=float(os.getenv("HTTP_KEEPALIVE", 30)),
+    timeouts={
+        kind: float(os.getenv(f"TIMEOUT_{kind.upper()}"))
+        for kind in ("generate", "txt2img", "transcribe", "tts", "websearch")
+        if os.getenv(f"TIMEOUT_{kind.upper()}")
+    }
+)
+
+# Channel store (SQLite, channels loaded lazily into a bounded LRU) and write-behind persistence
+DB_PATH = os.getenv("DB_PATH", "botdata.db")
+channel_store = SqliteChannelStore(DB_PATH)
+configure(
+    channel_store,
+    cache_size=int(os.getenv("CHANNEL_CACHE_SIZE", 1000)),
+    history_size=int(os.getenv("HISTORY_LIMIT", 50))
+)
+persistence = WriteBehind(channel_store, interval=float(os.getenv("FLUSH_INTERVAL", 5)))
+
+# Per-stage latency histograms, queue depths, backend errors and event loop lag; served in
+# Prometheus format on METRICS_HOST:METRICS_PORT when METRICS_PORT is set, and via /metrics
+metrics = Metrics(lag_interval=float(os.getenv("METRICS_LAG_INTERVAL", 0.5)))
+metrics_port = os.getenv("METRICS_PORT")
+
+# Backend routing: health probes, circuit breakers and retries across each pool
+backends = BackendRouter(
+    kobold_http,
+    backend_pools,
+    probe_interval=float(os.getenv("BACKEND_PROBE_INTERVAL", 15)),
+    failure_threshold=int(os.getenv("BACKEND_FAILURE_THRESHOLD", 3)),
+    cooldown=float(os.getenv("BACKEND_COOLDOWN", 30)),
+    retries=int(os.getenv("BACKEND_RETRIES", 2)),
+    metrics=metrics
+)
+
+# Generation scheduler settings (concurrent jobs per backend for each endpoint kind, and
+# queue bounds); total concurrency scales with the number of backends in the pool
+concurrency = {
+    kind: int(os.getenv(f"CONCURRENCY_{kind.upper()}", 1)) * backends.size(kind)
+    for kind in CAPABILITIES
+}
+# Sharded workers share those slots through the database instead of each running its own set
+shared_slots = SharedSlots(DB_PATH, concurrency, PROCESS_INDEX) if SHARD_IDS is not None and SHARD_PROCESSES > 1 else None
+scheduler = GenerationScheduler(
+    concurrency=concurrency,
+    max_queue=int(os.getenv("QUEUE_MAX", 100)),
+    max_per_channel=int(os.getenv("QUEUE_MAX_PER_CHANNEL", 5)),
+    metrics=metrics,
+    admission=shared_slots
 )
 
+intents = discord.Intents.all()
+if SHARD_COUNT or SHARD_IDS:
+    # Each guild's events, voice connection and audio processing stay with the shard owning it
+    client = discord.AutoShardedClient(
+        intents=intents,
+        shard_count=int(SHARD_COUNT) if SHARD_COUNT not in ("", "auto") else None,
+        shard_ids=[int(shard_id) for shard_id in SHARD_IDS.split(",")] if SHARD_IDS else None
+    )
+else:
+    # Voice reception comes from the VoiceRecvClient class /joinvoice connects with
+    client = discord.Client(intents=intents)
+
 # Attach CommandTree and global variables to the client
 client.tree = discord.app_commands.CommandTree(client)
-client.submit_endpoint = submit_endpoint
-client.imggen_endpoint = f"{KAI_ENDPOINT}/sdapi/v1/txt2img"
-client.websearch_endpoint = f"{KAI_ENDPOINT}/api/extra/websearch"
-client.transcribe_endpoint = f"{KAI_ENDPOINT}/api/extra/transcribe"
-client.tts_endpoint = f"{KAI_ENDPOINT}/api/extra/tts"
-client.busy = threading.Lock()
+client.kobold_http = kobold_http
+client.backends = backends
+client.generations = GenerationTracker(backends)
+# /search results keyed on the normalized query, summaries on the channel and the query
+search_cache_ttl = float(os.getenv("SEARCH_CACHE_TTL", 600))
+search_cache_size = int(os.getenv("SEARCH_CACHE_SIZE", 256))
+client.search_cache = TTLCache(ttl=search_cache_ttl, max_entries=search_cache_size)
+client.summary_cache = TTLCache(ttl=search_cache_ttl, max_entries=search_cache_size)
+# /describe results by image content hash; kept in the database too unless DESCRIBE_CACHE_PERSIST=0
+describe_store = SqliteCacheStore(DB_PATH, table="descriptions") if os.getenv("DESCRIBE_CACHE_PERSIST", "1") == "1" else None
+client.describe_cache = TTLCache(ttl=None, max_entries=int(os.getenv("DESCRIBE_CACHE_SIZE", 512)), store=describe_store)
+client.token_counter = TokenCounter(kobold_http, backends)
+client.scheduler = scheduler
+# /draw queue: identical requests share a job; DRAW_MAX_BATCH > 1 batches random-seed
+# requests for the same prompt into one txt2img call (only if the backend honors batch_size)
+client.draw_queue = DrawQueue(
+    scheduler,
+    lambda payload: commands.backend_post_json(client, "txt2img", payload),
+    max_batch=int(os.getenv("DRAW_MAX_BATCH", 1))
+)
+client.wake_gate = None  # created on first /joinvoice (commands.wake_gate)
+# Replies and follow-ups go through per-channel send queues paced by Discord's rate limits
+# (OUTBOX_CHANNEL_RATE messages per OUTBOX_CHANNEL_PERIOD seconds per channel)
+client.outbox = Outbox(
+    channel_rate=int(os.getenv("OUTBOX_CHANNEL_RATE", 5)),
+    channel_period=float(os.getenv("OUTBOX_CHANNEL_PERIOD", 5)),
+    global_rate=int(os.getenv("OUTBOX_GLOBAL_RATE", 50)),
+    metrics=metrics
+)
+
+# Long-term memory (LONG_TERM_MEMORY=1): history that leaves the prompt window is summarized
+# in the background and indexed, and a fixed MEMORY_TOKEN_BUDGET of each prompt holds the
+# summary and the snippets most relevant to the conversation. MEMORY_EMBEDDINGS=backend uses
+# KoboldCpp's embeddings model (--embeddingsmodel) instead of the built-in hashing embeddings,
+# falling back to them for good if the backend can't embed
+client.memory = None
+if os.getenv("LONG_TERM_MEMORY") == "1":
+    from memory import LongTermMemory, hashing_embedder, with_hashing_fallback
+
+    async def memory_generate(channel_id, payload):
+        # Low priority, keyed apart from the channel so it never counts against its replies
+        return await scheduler.run(
+            "generate", ("memory", channel_id),
+            lambda: commands.generate_json(client, channel_id, payload, kind="memory"),
+            priority=PRIORITY_LOW
+        )
+
+    async def backend_embedder(texts):
+        import numpy as np
+        resp = await commands.backend_post_json(client, "embeddings", {"input": texts})
+        if not resp or len(resp.get("data", [])) != len(texts):
+            return None
+        vectors = np.array([item["embedding"] for item in sorted(resp["data"], key=lambda item: item["index"])],
+                           dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-6)
+
+    embedder = hashing_embedder
+    if os.getenv("MEMORY_EMBEDDINGS") == "backend":
+        embedder = with_hashing_fallback(backend_embedder)
+
+    client.memory = LongTermMemory(
+        SqliteMemoryStore(DB_PATH),
+        memory_generate,
+        embed=embedder,
+        token_budget=int(os.getenv("MEMORY_TOKEN_BUDGET", 256)),
+        snippets=int(os.getenv("MEMORY_SNIPPETS", 4)),
+        chunk=int(os.getenv("MEMORY_CHUNK", 8)),
+        max_snippets=int(os.getenv("MEMORY_MAX_SNIPPETS", 2000)),
+        interval=float(os.getenv("MEMORY_INTERVAL", 30)),
+        max_context_length=config["max_context_length"],
+        metrics=metrics
+    )
+client.persistence = persistence
 client.config = config
 client.admin_name = ADMIN_NAME
+client.metrics = metrics
+client.ready_after = None  # cold-start time in seconds, set on the first on_ready
+
+def component_stats():
+    """
+    Gauges and counters read from the components' own stats at scrape time (see Metrics.collect).
+    """
+    samples = []
+    for kind, lane in client.scheduler.lanes.items():
+        samples.append(("queue_depth", "gauge", {"kind": kind}, lane.size))
+        samples.append(("queue_running", "gauge", {"kind": kind}, lane.running))
+    now = time.monotonic()
+    for backend in client.backends.backends.values():
+        labels = {"backend": backend.base_url}
+        samples.append(("backend_in_flight", "gauge", labels, backend.in_flight))
+        samples.append(("backend_server_queue", "gauge", labels, backend.queue))
+        samples.append(("backend_requests_total", "counter", labels, backend.requests))
+        samples.append(("backend_errors_total", "counter", labels, backend.errors))
+        samples.append(("backend_up", "gauge", labels, int(backend.state(now, client.backends.failure_threshold) == "up")))
+    for name, cache in (("search", client.search_cache), ("summary", client.summary_cache),
+                        ("describe", client.describe_cache)):
+        for stat, value in cache.stats.items():
+            samples.append((f"cache_{stat}_total", "counter", {"cache": name}, value))
+    samples.append(("generations_active", "gauge", {}, len(client.generations.active)))
+    if client.ready_after is not None:
+        samples.append(("startup_seconds", "gauge", {}, client.ready_after))
+    samples.append(("reply_channels_pending", "gauge", {}, len(client.replies.channels)))
+    components = [("persistence", client.persistence.stats), ("draw", client.draw_queue.stats),
+                  ("replies", client.replies.stats), ("outbox", client.outbox.stats)]
+    if client.wake_gate is not None:
+        components.append(("wake_gate", client.wake_gate.stats))
+    if client.memory is not None:
+        components.append(("memory", client.memory.stats))
+    for component, stats in components:
+        for stat, value in stats.items():
+            kind = "gauge" if stat.endswith("_ms") else "counter"
+            samples.append((f"{component}_{stat}" + ("" if kind == "gauge" else "_total"), kind, {}, value))
+    return samples
+
+metrics.collect(component_stats)
 
 @client.event
-async def on_ready():
-    import_config()
-    print(f"Logged in as {client.user}")
+async def setup_hook():
+    # Open the pooled HTTP sessions and start the scheduler workers inside the running event loop
+    await client.kobold_http.start()
+    client.backends.start()
+    client.scheduler.start()
+    client.persistence.start()
+    client.metrics.start()
+    if client.memory is not None:
+        client.memory.start()
+    if metrics_port:
+        # One port per worker process when sharded
+        await client.metrics.serve(os.getenv("METRICS_HOST", "127.0.0.1"), int(metrics_port) + PROCESS_INDEX)
+    # Migrate older JSON data into the channel store once; channels then load on first use.
+    # Sharded workers skip this, the supervisor already did it before starting them
+    if SHARD_IDS is None:
+        import_config(JsonChannelStore(os.getenv("DATA_DIR", "botdata")))
+    # setup_hook runs once per start, unlike on_ready, which fires again on every reconnect.
+    # The command tree is global: the first worker syncs it for everyone, and only if the
+    # definitions changed since the last sync (FORCE_COMMAND_SYNC=1 syncs regardless)
     commands.setup(client)
+    if PROCESS_INDEX == 0:
+        await commands.sync_commands(client, DB_PATH, force=os.getenv("FORCE_COMMAND_SYNC") == "1")
+
+@client.event
+async def on_ready():
+    if client.ready_after is None:
+        client.ready_after = time.perf_counter() - STARTED
+        print(f"Logged in as {client.user}, ready {client.ready_after:.2f}s after start")
+    else:
+        print(f"Reconnected as {client.user}")
+
+@client.event
+async def on_app_command_completion(interaction, command):
+    # End-to-end slash command latency, from the interaction's creation on Discord
+    elapsed = (discord.utils.utcnow() - interaction.created_at).total_seconds()
+    client.metrics.observe("stage_seconds", elapsed, pipeline="slash", stage=command.name)
+
+async def reply_to_messages(channel_id, batch):
+    """
+    Generate one reply for a batch of messages in a channel (see ReplyCoalescer).
+    `batch` holds (message, mentioned) pairs, oldest first; the messages are already in
+    the channel history.
+    """
+    currchannel = get_channel_data(channel_id)
+    message = batch[-1][0]
+    mentioned = any(was_mentioned for _, was_mentioned in batch)
+    # Queue feedback goes to the most recent direct mention, if there is one
+    trigger = next((msg for msg, was_mentioned in reversed(batch) if was_mentioned), message)
+
+    async def generate_reply():
+        # /reset may have discarded this batch while it waited in the queue
+        if not client.replies.is_current(channel_id, batch):
+            return
+        async with message.channel.typing():
+            currchannel.bot_reply_timestamp = time.time()
+            with client.metrics.stage("text", "prepare"):
+                payload = await prepare_budgeted_payload(
+                    client.token_counter,
+                    client.user.display_name,
+                    currchannel,
+                    client.config["maxlen"],
+                    client.config["max_context_length"],
+                    user_display_name=message.author.display_name,
+                    stable=client.config["prompt_layout"] == "stable",
+                    channel_key=channel_id,
+                    long_term=client.memory
+                )
+            if not client.replies.is_current(channel_id, batch):
+                return  # reset while the prompt was being built
+            if client.config["streaming"]:
+                # The outbox posts and edits the reply as tokens arrive, without holding up
+                # the generation (and its scheduler slot) when the channel is throttled
+                with client.metrics.stage("text", "stream"):
+                    result = await client.generations.call("stream", channel_id, payload, lambda url: stream_reply(
+                        client.kobold_http,
+                        url,
+                        payload,
+                        client.outbox.stream(
+                            channel_id, message.channel.send, client.config["stream_edit_interval"], pipeline="text"
+                        ),
+                        on_stop=lambda: client.generations.abort(payload["genkey"])
+                    ))
+                if result is None:
+                    client.outbox.send(channel_id, message.channel.send, "Sorry, the generation failed.")
+                elif client.replies.is_current(channel_id, batch):
+                    append_history(channel_id, client.user.display_name, result)
+                return
+
+            with client.metrics.stage("text", "generate"):
+                data = await commands.generate_json(client, channel_id, payload)
+            if not client.replies.is_current(channel_id, batch):
+                return
+            if data is not None:
+                result = data["results"][0]["text"]
+                append_history(channel_id, client.user.display_name, result)
+                # Queued rather than awaited: delivery (and any rate limiting) happens after
+                # this generation has released its scheduler slot
+                client.outbox.send(channel_id, message.channel.send, result, pipeline="text")
+            else:
+                client.outbox.send(channel_id, message.channel.send, "Sorry, the generation failed.")
+
+    async def on_queued(position):
+        # Direct mentions get their queue position, idle-window chatter just a reaction
+        if mentioned:
+            await trigger.reply(f"⏳ You're #{position} in the queue, I'll answer shortly.", mention_author=False)
+        else:
+            await trigger.add_reaction("⏳")
+
     try:
-        synced = await client.tree.sync()
-        print(f"Synced {len(synced)} commands")
+        # Queue wait, prompt building, generation and sending, from the coalesced batch on
+        with client.metrics.stage("text", "total"):
+            await client.scheduler.run(
+                "generate",
+                channel_key(message.channel),
+                generate_reply,
+                priority=PRIORITY_HIGH if mentioned else PRIORITY_LOW,
+                on_queued=on_queued
+            )
+    except QueueFull:
+        await trigger.reply("The bot is busy. Please try again later.", mention_author=False)
+    except GenerationCancelled as e:
+        print(f"Reply in channel {channel_id} cancelled ({e.reason}).")
     except Exception as e:
-        print("Error syncing commands:", e)
+        client.outbox.send(channel_id, message.channel.send, f"An error occurred: {e}")
+
+# Messages that should be answered are debounced and batched per channel, so a burst of
+# messages gets one reply instead of one generation each
+client.replies = ReplyCoalescer(
+    reply_to_messages,
+    client.generations,
+    debounce=config["reply_debounce"],
+    max_delay=config["reply_max_delay"],
+    policy=config["reply_policy"]
+)
 
 @client.event
 async def on_message(message):
@@ -67,49 +424,53 @@ async def on_message(message):
     currchannel = get_channel_data(channel_id)
 
     # Track the user by display name
-    if message.author.display_name not in currchannel.users:
-        currchannel.users.append(message.author.display_name)
+    currchannel.add_user(message.author.display_name)
 
     # Append incoming message to history
     append_history(channel_id, message.author.display_name, message.clean_content)
 
     # Check if bot should respond
-    if (time.time() - currchannel.bot_reply_timestamp < currchannel.bot_idletime or
-        client.user in message.mentions or
-        client.user.display_name.lower() in message.clean_content.lower()):
-        if client.busy.acquire(blocking=False):
-            try:
-                async with message.channel.typing():
-                    currchannel.bot_reply_timestamp = time.time()
-                    payload = prepare_payload(
-                        client.user.display_name,
-                        currchannel,
-                        client.config["maxlen"],
-                        user_display_name=message.author.display_name
-                    )
-                    # Use aiohttp for the HTTP POST request
-                    async with aiohttp.ClientSession() as session:
-                        async with session.post(submit_endpoint, json=payload) as resp:
-                            if resp.status == 200:
-                                data = await resp.json()
-                                result = data["results"][0]["text"]
-                                append_history(channel_id, client.user.display_name, result)
-                                if len(result) > 2000:
-                                    chunks = [result[i:i+2000] for i in range(0, len(result), 2000)]
-                                    for chunk in chunks:
-                                        await message.channel.send(chunk)
-                                else:
-                                    await message.channel.send(result)
-                                export_config()
-                            else:
-                                await message.channel.send("Sorry, the generation failed.")
-            except Exception as e:
-                await message.channel.send(f"An error occurred: {e}")
-            finally:
-                client.busy.release()
-
-try:
-    client.run(BOT_TOKEN)
-except discord.errors.LoginFailure:
-    print("Bot failed to login to Discord")
+    mentioned = (client.user in message.mentions or
+                 client.user.display_name.lower() in message.clean_content.lower())
+    if mentioned or time.time() - currchannel.bot_reply_timestamp < currchannel.bot_idletime:
+        client.replies.submit(channel_id, (message, mentioned))
+
+async def shutdown():
+    # Clean shutdown: stop the scheduler and probes, flush unsaved channel data, close HTTP sessions
+    await client.metrics.stop()
+    if client.memory is not None:
+        await client.memory.stop()
+    await client.scheduler.stop()
+    if shared_slots is not None:
+        shared_slots.close()
+    await client.outbox.stop()
+    await client.backends.stop()
+    await client.persistence.stop()
+    client.persistence.store.close()
+    if client.describe_cache.store is not None:
+        client.describe_cache.store.close()
+    if client.memory is not None:
+        client.memory.store.close()
+    await client.kobold_http.close()
+
+async def run_bot():
+    async with client:
+        try:
+            await client.start(BOT_TOKEN)
+        finally:
+            await shutdown()
+
+# Only start the bot when run as a script, so benchmarks can import the handlers
+if __name__ == "__main__" and SHARD_PROCESSES > 1 and SHARD_IDS is None:
+    # Supervisor: migrate legacy data once, then run the shards in worker processes
+    import_config(JsonChannelStore(os.getenv("DATA_DIR", "botdata")))
+    run_sharded(BOT_TOKEN, SHARD_COUNT, SHARD_PROCESSES)
+elif __name__ == "__main__":
+    try:
+        discord.utils.setup_logging()
+        asyncio.run(run_bot())
+    except discord.errors.LoginFailure:
+        print("Bot failed to login to Discord")
+    except KeyboardInterrupt:
+        pass
 
@@ -0,0 +1,314 @@
+import asyncio
+import re
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+import bot_data
+from payload import new_genkey
+from scheduler import QueueFull
+
+# Dimensions of the hashing embeddings
+EMBED_DIM = 256
+# Cosine similarity below which a snippet is not worth recalling
+MIN_SCORE = 0.2
+# Messages with fewer words than this are not indexed ("lol", "ok thanks")
+MIN_WORDS = 4
+# Tokens kept for the summary request's own instructions and output
+SUMMARY_LENGTH = 160
+
+_WORD = re.compile(r"\w+")
+STOP_WORDS = frozenset(
+    "a an and are as at be but by do for from have he her his i if in is it its me my no not of on or "
+    "our she so that the their them they this to was we were what when which who will with you your".split()
+)
+
+def hash_embed(texts: list, dim: int = EMBED_DIM) -> np.ndarray:
+    """
+    Embed texts with the hashing trick: words and word pairs (stop words dropped) are
+    hashed into `dim` signed buckets and each row is L2-normalized. Needs no model and
+    is deterministic across restarts (crc32, not Python's salted hash).
+    """
+    matrix = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        words = [word for word in _WORD.findall(text.lower()) if word not in STOP_WORDS]
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            code = zlib.crc32(feature.encode("utf-8"))
+            matrix[row, code % dim] += 1.0 if code & 0x80000000 else -1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-6)
+
+async def hashing_embedder(texts: list) -> np.ndarray:
+    return hash_embed(texts)
+
+def with_hashing_fallback(embed):
+    """
+    Wrap an embedder so that once it fails, hashing embeddings are used for good (a
+    KoboldCpp without an embeddings model fails every request, so retrying is pointless).
+    """
+    failed = False
+
+    async def embedder(texts: list) -> np.ndarray:
+        nonlocal failed
+        if not failed:
+            vectors = await embed(texts)
+            if vectors is not None:
+                return vectors
+            failed = True
+            print("Embeddings backend unavailable, using hashing embeddings from now on")
+        return hash_embed(texts)
+    return embedder
+
+def summary_payload(previous: str, conversation: str, max_context_length: int) -> dict:
+    """
+    Build a lean generate request that folds `conversation` into the previous rolling summary.
+    """
+    # Keep the most recent part of the conversation if it would not fit the context (~3 chars a token)
+    room = max(max_context_length - SUMMARY_LENGTH * 2 - len(previous) // 3, 256) * 3
+    conversation = conversation[-room:]
+    earlier = f"Summary so far: {previous}\n\n" if previous else ""
+    return {
+        "prompt": (
+            "### Instruction:\nSummarize the conversation below in a few sentences. Keep names, "
+            "facts, preferences and decisions; drop small talk.\n\n"
+            f"{earlier}Conversation:\n{conversation}\n\n### Response:\n"
+        ),
+        "max_context_length": max_context_length,
+        "max_length": SUMMARY_LENGTH,
+        "temperature": 0.3,
+        "top_p": 0.9,
+        "rep_pen": 1.05,
+        "genkey": new_genkey(),
+        "quiet": True,
+        "trim_stop": True,
+        "stop_sequence": ["\n###", "### "]
+    }
+
+class ChannelMemory:
+    __slots__ = ("archived", "summary", "texts", "vectors")
+
+    def __init__(self, archived: int = None, summary: str = "", texts: list = None, vectors: np.ndarray = None):
+        self.archived = archived  # messages before this number are summarized and indexed (None: not yet)
+        self.summary = summary    # latest rolling summary
+        self.texts = texts or []
+        self.vectors = vectors    # float32 (len(texts), dim), rows L2-normalized
+
+class LongTermMemory:
+    """
+    Per-channel long-term memory for the history that has left the prompt window.
+
+    The prompt builder reports each channel's window (`observe`); once `chunk` messages
+    have fallen out of it, a background task summarizes them with a low-priority generate
+    request, folding them into the channel's rolling summary, and embeds them into the
+    channel's vector index. Replies never wait on this. When building a prompt, `recall`
+    returns the latest summary and the most similar indexed snippets, packed into a fixed
+    token budget.
+
+    `generate(channel_id, payload)` runs a generate request and returns the JSON response
+    or None; `embed(texts)` returns an array of L2-normalized rows, or None on failure.
+    Indexes are kept in SQLite (SqliteMemoryStore) and loaded into an LRU on first use.
+    """
+
+    def __init__(self, store, generate, embed=hashing_embedder, token_budget: int = 256, snippets: int = 4,
+                 chunk: int = 8, max_snippets: int = 2000, interval: float = 30.0,
+                 max_context_length: int = 4096, cache_size: int = 256, metrics=None):
+        self.store = store
+        self.generate = generate
+        self.embed = embed
+        self.token_budget = token_budget
+        self.snippets = snippets
+        self.chunk = max(1, chunk)
+        self.max_snippets = max_snippets
+        self.interval = interval
+        self.max_context_length = max_context_length
+        self.cache_size = cache_size
+        self.metrics = metrics
+        self.channels = OrderedDict()  # channel_id -> ChannelMemory
+        self.pending = OrderedDict()   # channel ids with enough history to archive
+        self.task = None
+        self.stats = {
+            "archived": 0,
+            "lost": 0,
+            "summaries": 0,
+            "summary_failures": 0,
+            "indexed": 0,
+            "recalls": 0,
+            "recalled": 0,
+        }
+
+    def _channel(self, channel_id) -> ChannelMemory:
+        memory = self.channels.get(channel_id)
+        if memory is not None:
+            self.channels.move_to_end(channel_id)
+            return memory
+        memory = ChannelMemory()
+        try:
+            record = self.store.load(channel_id)
+        except Exception as e:
+            print(f"Failed to load memory for channel {channel_id}:", e)
+            record = None
+        if record is not None:
+            memory.archived, memory.summary, rows = record
+            # Vectors of another size come from a different embedder and are dropped
+            rows = [(text, vector) for text, vector in rows if len(vector) == len(rows[-1][1])] if rows else []
+            if rows:
+                memory.texts = [text for text, _ in rows]
+                memory.vectors = np.frombuffer(
+                    b"".join(vector for _, vector in rows), dtype=np.float16
+                ).reshape(len(rows), -1).astype(np.float32)
+        self.channels[channel_id] = memory
+        while len(self.channels) > self.cache_size:
+            self.channels.popitem(last=False)
+        return memory
+
+    def observe(self, channel_id, channel_data):
+        """
+        Note a channel's current prompt window; queues it for archiving once enough
+        messages have fallen out.
+        """
+        memory = self._channel(channel_id)
+        if memory.archived is None:
+            # New to memory: start from the oldest message still in the history buffer
+            memory.archived = channel_data.message_count - len(channel_data.chat_history)
+        elif memory.archived > channel_data.message_count:
+            # History from before message numbers were persisted: treat it as archived
+            memory.archived = channel_data.message_count
+        if channel_data.prompt_start - memory.archived >= self.chunk:
+            self.pending[channel_id] = None
+
+    async def recall(self, counter, channel_id, query: str) -> list:
+        """
+        Return lines of remembered context for a prompt: the rolling summary, then the
+        indexed snippets most similar to `query`, as many as fit the token budget.
+        """
+        memory = self._channel(channel_id)
+        candidates = []
+        if memory.summary:
+            candidates.append(f"[Summary of earlier conversation: {memory.summary}]")
+        if memory.vectors is not None and query:
+            vectors = await self.embed([query])
+            if vectors is not None and vectors.shape[1] == memory.vectors.shape[1]:
+                scores = memory.vectors @ vectors[0]
+                top = np.argsort(scores)[::-1][:self.snippets]
+                candidates += [f"[Remembered: {memory.texts[i]}]" for i in top if scores[i] >= MIN_SCORE]
+        if not candidates:
+            return []
+        counts = await counter.count_many(candidates)
+        lines = []
+        used = 0
+        for line, count in zip(candidates, counts):
+            if used + count + 1 <= self.token_budget:
+                lines.append(line)
+                used += count + 1
+        self.stats["recalls"] += 1
+        self.stats["recalled"] += len(lines)
+        return lines
+
+    def forget(self, channel_id):
+        """
+        Drop a channel's summary and index (on /reset).
+        """
+        self.channels.pop(channel_id, None)
+        self.pending.pop(channel_id, None)
+        try:
+            self.store.delete(channel_id)
+        except Exception as e:
+            print(f"Failed to delete memory for channel {channel_id}:", e)
+        # Start over from the current end of the history, which /reset just emptied
+        self.channels[channel_id] = ChannelMemory(archived=bot_data.get_channel_data(channel_id).message_count)
+
+    # === Background archiving ===
+
+    def start(self):
+        """
+        Start the archiving task. Must be called from within the running event loop.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(), name="memory-archive")
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            # One channel at a time, so archiving never takes more than one generation slot
+            while self.pending:
+                channel_id, _ = self.pending.popitem(last=False)
+                try:
+                    await self.archive(channel_id)
+                except Exception as e:
+                    print(f"Archiving memory for channel {channel_id} failed: {e}")
+
+    async def archive(self, channel_id) -> int:
+        """
+        Summarize and index the messages of a channel that left its prompt window since
+        the last run. Returns the number of messages archived.
+        """
+        data = bot_data.get_channel_data(channel_id)
+        memory = self._channel(channel_id)
+        if memory.archived is None:
+            self.observe(channel_id, data)
+        offset = data.message_count - len(data.chat_history)
+        start = max(memory.archived, offset)
+        end = data.prompt_start
+        if end - start < 1:
+            return 0
+        started = time.perf_counter()
+        messages = list(data.chat_history)[start - offset:end - offset]
+
+        summary = memory.summary
+        try:
+            resp = await self.generate(
+                channel_id, summary_payload(memory.summary, "\n".join(messages), self.max_context_length)
+            )
+        except QueueFull:
+            self.pending[channel_id] = None  # the bot is busy, retry next round
+            return 0
+        try:
+            text = resp["results"][0]["text"].strip() if resp else ""
+        except (KeyError, IndexError, TypeError):
+            text = ""
+        if text:
+            summary = " ".join(text.split())
+            self.stats["summaries"] += 1
+        else:
+            self.stats["summary_failures"] += 1
+
+        turns = [message for message in messages if len(_WORD.findall(message)) >= MIN_WORDS]
+        # The summary being replaced is indexed too, so older context stays recallable
+        if memory.summary and summary != memory.summary:
+            turns.append(memory.summary)
+        vectors = await self.embed(turns) if turns else None
+        if turns and vectors is None:
+            self.pending[channel_id] = None  # embedding backend unavailable, retry next round
+            return 0
+        if memory is not self.channels.get(channel_id):
+            return 0  # forgotten (/reset) while waiting
+
+        rows = []
+        if turns:
+            compact = vectors.astype(np.float16)
+            rows = [(text, compact[i].tobytes()) for i, text in enumerate(turns)]
+            vectors = compact.astype(np.float32)
+            if memory.vectors is not None and memory.vectors.shape[1] == vectors.shape[1]:
+                memory.texts = (memory.texts + turns)[-self.max_snippets:]
+                memory.vectors = np.concatenate([memory.vectors, vectors])[-self.max_snippets:]
+            else:
+                memory.texts, memory.vectors = turns[-self.max_snippets:], vectors[-self.max_snippets:]
+        # Messages that left the history buffer before they could be archived are gone
+        self.stats["lost"] += start - memory.archived
+        memory.archived = end
+        memory.summary = summary
+        await asyncio.to_thread(self.store.append, channel_id, end, summary, rows, self.max_snippets)
+
+        self.stats["archived"] += end - start
+        self.stats["indexed"] += len(rows)
+        if self.metrics is not None:
+            self.metrics.observe("memory_archive_seconds", time.perf_counter() - started)
+        return end - start
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from aiohttp import web
+
+# Histogram bucket upper bounds in seconds, from sub-millisecond loop work to long generations.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+PREFIX = "ketisbot_"
+
+class Histogram:
+    """
+    Cumulative-bucket latency histogram (Prometheus style). `observe` is a bisect and two
+    additions, cheap enough for every request on the hot path.
+    """
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimate a quantile by linear interpolation within its bucket.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Metrics:
+    """
+    In-process metrics: per-stage latency histograms, counters, and gauges read from the
+    bot's components at scrape time, plus event loop lag.
+
+    Stages are timed with `stage(pipeline, name)` (text, slash and voice pipelines);
+    components with their own stats dicts are exported through `collect` callbacks that
+    return (name, type, labels dict, value) tuples, so they cost nothing between scrapes.
+    `render()` produces the Prometheus text format, served by `serve()` on a local port.
+    """
+
+    def __init__(self, buckets: tuple = DEFAULT_BUCKETS, lag_interval: float = 0.5):
+        self.buckets = buckets
+        self.lag_interval = lag_interval
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> value
+        self.collectors = []
+        self.lag_task = None
+        self.runner = None
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def stage(self, pipeline: str, stage: str):
+        """
+        Time a block as one stage of a pipeline (text, slash or voice).
+        """
+        return self.timer("stage_seconds", pipeline=pipeline, stage=stage)
+
+    def collect(self, collector):
+        """
+        Register `collector()`, called on every scrape, returning (name, type, labels, value)
+        tuples where type is "gauge" or "counter".
+        """
+        self.collectors.append(collector)
+
+    # === Event loop lag ===
+
+    async def _watch_loop(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.lag_interval)
+            self.observe("event_loop_lag_seconds", max(0.0, time.perf_counter() - started - self.lag_interval))
+
+    def start(self):
+        """
+        Start measuring event loop lag. Must be called from within the running event loop.
+        """
+        if self.lag_task is None and self.lag_interval > 0:
+            self.lag_task = asyncio.create_task(self._watch_loop(), name="loop-lag")
+
+    async def stop(self):
+        if self.lag_task is not None:
+            self.lag_task.cancel()
+            await asyncio.gather(self.lag_task, return_exceptions=True)
+            self.lag_task = None
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    # === Export ===
+
+    def _collected(self) -> list:
+        samples = []
+        for collector in self.collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                print(f"Metrics collector failed: {e}")
+        return samples
+
+    def render(self) -> str:
+        """
+        Return every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} {kind}")
+
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            declare(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), histogram.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{PREFIX}{name}_bucket{_labels(labels, le)} {cumulative}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {histogram.count}")
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+        for name, kind, labels, value in sorted(self._collected(), key=lambda sample: sample[0]):
+            declare(name, kind)
+            lines.append(f"{PREFIX}{name}{_labels(tuple(sorted(labels.items())))} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> list:
+        """
+        Human-readable lines for the stage histograms and event loop lag: count, p50, p99.
+        """
+        lines = []
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            title = " ".join([name.removesuffix("_seconds")] + [str(value) for _, value in labels])
+            lines.append(
+                f"{title}: n={histogram.count}, "
+                f"p50 {histogram.quantile(0.5) * 1000:.0f} ms, p99 {histogram.quantile(0.99) * 1000:.0f} ms"
+            )
+        return lines
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9108):
+        """
+        Serve `render()` at http://host:port/metrics for Prometheus to scrape.
+        """
+        async def handle(request):
+            return web.Response(body=self.render().encode("utf-8"),
+                                headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+        app = web.Application()
+        app.add_routes([web.get("/metrics", handle)])
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
@@ -0,0 +1,368 @@
+import asyncio
+import re
+import time
+from collections import deque
+
+import discord
+
+DISCORD_LIMIT = 2000
+
+# Discord's message-create limits: 5 messages per 5 seconds per channel, and about 50
+# requests per second for the whole bot.
+CHANNEL_RATE = 5
+CHANNEL_PERIOD = 5.0
+GLOBAL_RATE = 50
+GLOBAL_PERIOD = 1.0
+
+# Cut preferences, best first: before a code block, between paragraphs, lines, sentences, words.
+SEPARATORS = ("\n```", "\n\n", "\n", ". ", "! ", "? ", " ")
+_FENCE = re.compile(r"^```[^\n]*", re.M)
+
+def open_fence(text: str):
+    """
+    Return the opening line of the code block still open at the end of `text`, or None.
+    """
+    opening = None
+    for match in _FENCE.finditer(text):
+        opening = match.group(0)[:24] if opening is None else None
+    return opening
+
+def _cut(text: str, limit: int) -> int:
+    for separator in SEPARATORS:
+        index = text.rfind(separator, limit // 2, limit)
+        if index == -1:
+            continue
+        if separator == "\n```":
+            if open_fence(text[:index]) is not None:
+                continue  # that is the end of a code block, not the start of one
+            return index + 1
+        return index + len(separator)
+    return limit
+
+def split_message(text: str, limit: int = DISCORD_LIMIT) -> list:
+    """
+    Split text into messages of at most `limit` characters, at the most natural Markdown
+    boundary available. A code block cut in two is closed at the end of one message and
+    reopened (with its language) at the start of the next. Stretches holding nothing but
+    whitespace and code fences never make a message of their own (Discord rejects empty
+    ones), so blank text gives no messages.
+    """
+    chunks = []
+    fence = None
+    while _FENCE.sub("", text).strip():
+        head = f"{fence}\n" if fence is not None else ""
+        text = head + text
+        if len(text) <= limit:
+            chunks.append(text)
+            break
+        cut = _cut(text, limit - 4)  # room to close a code block
+        chunk = text[:cut].rstrip()
+        fence = open_fence(chunk)
+        if fence is not None:
+            chunk += "\n```"
+        if _FENCE.sub("", text[len(head):cut]).strip():
+            chunks.append(chunk)
+        text = text[cut:].lstrip("\n")
+    return chunks
+
+class RateBucket:
+    """
+    Token bucket allowing `rate` sends per `period` seconds.
+    """
+    __slots__ = ("rate", "period", "tokens", "updated", "paused_until")
+
+    def __init__(self, rate: int, period: float):
+        self.rate = rate
+        self.period = period
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.period)
+        self.updated = now
+
+    def wait(self, now: float) -> float:
+        """
+        Seconds until a send is allowed (0 if it is allowed now).
+        """
+        self._refill(now)
+        return max(self.paused_until - now, (1 - self.tokens) * self.period / self.rate, 0.0)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        """
+        Hold every send for `seconds` (after Discord reported a rate limit).
+        """
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.rate and now >= self.paused_until
+
+class _Outgoing:
+    __slots__ = ("send", "content", "kwargs", "futures", "queued_at", "pipeline")
+
+    def __init__(self, send, content, kwargs, future, pipeline):
+        self.send = send
+        self.content = content
+        self.kwargs = kwargs
+        self.futures = [future]
+        self.queued_at = time.perf_counter()
+        self.pipeline = pipeline
+
+class OutboxStream:
+    """
+    A reply streamed into a channel through the Outbox (see Outbox.stream). The generating
+    side calls `update` with the text so far and `close` at the end, neither of which
+    waits on Discord; the channel's worker posts and edits the messages. `error` is set
+    if that failed, and `future` resolves to the last Message once the final text is shown.
+    """
+    __slots__ = ("send", "text", "closed", "closed_at", "error", "changed", "future", "edit_interval", "pipeline")
+
+    def __init__(self, send, future, edit_interval: float, pipeline):
+        self.send = send
+        self.text = ""
+        self.closed = False
+        self.closed_at = 0.0
+        self.error = None
+        self.changed = asyncio.Event()
+        self.future = future
+        self.edit_interval = edit_interval
+        self.pipeline = pipeline
+
+    def update(self, text: str):
+        self.text = text
+        self.changed.set()
+
+    def close(self, text: str = None):
+        if text is not None:
+            self.text = text
+        if not self.closed:
+            self.closed = True
+            self.closed_at = time.perf_counter()
+        self.changed.set()
+
+class Outbox:
+    """
+    Per-channel outbound message queues, paced by rate-limit buckets.
+
+    `send` only queues the message, so the caller (usually a generation holding a
+    scheduler slot) can move on; each channel with pending messages has its own worker
+    that delivers them in order. Long texts are split at Markdown boundaries (see
+    split_message), and small texts that pile up for the same destination are merged
+    into one message. Streamed replies (`stream`) take their turn in the same queue and
+    are edited at most once per edit interval. Every post and edit waits for its
+    channel's bucket and the global bucket, so a burst is spread out instead of running
+    into 429 back-offs, and a throttled channel only delays its own messages.
+
+    With `metrics`, delivery latency is recorded per pipeline as its "send" stage.
+    """
+
+    def __init__(self, channel_rate: int = CHANNEL_RATE, channel_period: float = CHANNEL_PERIOD,
+                 global_rate: int = GLOBAL_RATE, global_period: float = GLOBAL_PERIOD,
+                 max_pending: int = 50, metrics=None):
+        self.channel_rate = channel_rate
+        self.channel_period = channel_period
+        self.global_bucket = RateBucket(global_rate, global_period)
+        self.max_pending = max_pending
+        self.metrics = metrics
+        self.queues = {}   # channel id -> deque of _Outgoing
+        self.buckets = {}  # channel id -> RateBucket
+        self.workers = {}  # channel id -> task
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "merged": 0,
+            "split": 0,
+            "throttled": 0,
+            "rate_limited": 0,
+            "dropped": 0,
+            "failed": 0,
+        }
+
+    def send(self, channel_id, send, content: str = None, pipeline: str = None, **kwargs) -> asyncio.Future:
+        """
+        Queue `send(content, **kwargs)` (e.g. channel.send or interaction.followup.send)
+        for a channel. Returns a future with the last Message sent, or None if delivery
+        failed; await it to wait for delivery. `pipeline` labels the delivery latency.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self.queues.setdefault(channel_id, deque())
+        if len(queue) >= self.max_pending:
+            self.stats["dropped"] += 1
+            future.set_result(None)
+            return future
+        self._enqueue(channel_id, queue, _Outgoing(send, content, kwargs, future, pipeline))
+        return future
+
+    def stream(self, channel_id, send, edit_interval: float = 1.0, pipeline: str = None) -> OutboxStream:
+        """
+        Open a streamed reply in a channel, posted with `send` and edited as it grows
+        (see OutboxStream). Text past the message limit rolls over into new messages,
+        cut with split_message.
+        """
+        stream = OutboxStream(send, asyncio.get_running_loop().create_future(), edit_interval, pipeline)
+        # Never dropped: the generation behind it is already running
+        self._enqueue(channel_id, self.queues.setdefault(channel_id, deque()), stream)
+        return stream
+
+    def _enqueue(self, channel_id, queue: deque, item):
+        queue.append(item)
+        self.stats["queued"] += 1
+        if channel_id not in self.workers:
+            self.workers[channel_id] = asyncio.create_task(self._run(channel_id), name=f"outbox-{channel_id}")
+
+    def _observe(self, pipeline, seconds: float):
+        if self.metrics is None:
+            return
+        if pipeline is not None:
+            self.metrics.observe("stage_seconds", seconds, pipeline=pipeline, stage="send")
+        else:
+            self.metrics.observe("outbound_delivery_seconds", seconds)
+
+    def _bucket(self, channel_id) -> RateBucket:
+        bucket = self.buckets.get(channel_id)
+        if bucket is None:
+            if len(self.buckets) > 1000:
+                # Forget channels whose bucket has refilled; a fresh one behaves the same
+                now = time.monotonic()
+                for key in [key for key, old in self.buckets.items() if key not in self.workers and old.idle(now)]:
+                    del self.buckets[key]
+            bucket = self.buckets[channel_id] = RateBucket(self.channel_rate, self.channel_period)
+        return bucket
+
+    def _next(self, queue: deque):
+        item = queue.popleft()
+        if isinstance(item, OutboxStream) or item.kwargs or item.content is None:
+            return item
+        # Merge plain texts for the same destination while they fit in one message
+        while (queue and isinstance(queue[0], _Outgoing) and not queue[0].kwargs
+               and queue[0].content is not None and queue[0].send == item.send
+               and len(item.content) + 1 + len(queue[0].content) <= DISCORD_LIMIT):
+            following = queue.popleft()
+            item.content = f"{item.content}\n{following.content}"
+            item.futures += following.futures
+            self.stats["merged"] += 1
+        return item
+
+    async def _run(self, channel_id):
+        queue = self.queues[channel_id]
+        bucket = self._bucket(channel_id)
+        try:
+            while queue:
+                item = self._next(queue)
+                if isinstance(item, OutboxStream):
+                    await self._present(channel_id, bucket, item)
+                    continue
+                message = None
+                try:
+                    if item.content is None or item.kwargs:
+                        message = await self._deliver(bucket, item.send, item.content, item.kwargs)
+                    else:
+                        # Blank text has no chunks and sends nothing
+                        chunks = split_message(item.content)
+                        self.stats["split"] += max(len(chunks) - 1, 0)
+                        for chunk in chunks:
+                            message = await self._deliver(bucket, item.send, chunk, {})
+                    self._observe(item.pipeline, time.perf_counter() - item.queued_at)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    message = None
+                    print(f"Failed to send a message to channel {channel_id}: {e}")
+                for future in item.futures:
+                    if not future.done():
+                        future.set_result(message)
+        finally:
+            for item in queue:
+                for future in item.futures if isinstance(item, _Outgoing) else [item.future]:
+                    if not future.done():
+                        future.set_result(None)
+            del self.queues[channel_id]
+            del self.workers[channel_id]
+
+    async def _present(self, channel_id, bucket: RateBucket, stream: OutboxStream):
+        # Show a streamed reply: post its messages and edit the latest snapshot of its
+        # text, at most once per edit interval (longer when edits get slow). Intermediate
+        # snapshots are skipped, so a throttled channel costs edits, not generation time.
+        messages = []
+        shown = []
+        interval = stream.edit_interval
+        last_update = 0.0
+        try:
+            while True:
+                stream.changed.clear()
+                final = stream.closed
+                chunks = split_message(stream.text)
+                for index, chunk in enumerate(chunks):
+                    if index < len(shown) and shown[index] == chunk:
+                        continue
+                    started = time.monotonic()
+                    if index < len(messages):
+                        await self._deliver(bucket, messages[index].edit, None, {"content": chunk})
+                        shown[index] = chunk
+                    else:
+                        messages.append(await self._deliver(bucket, stream.send, chunk, {}))
+                        shown.append(chunk)
+                        if index:
+                            self.stats["split"] += 1
+                    last_update = time.monotonic()
+                    interval = max(stream.edit_interval, (last_update - started) * 2)
+                if final:
+                    break
+                await stream.changed.wait()
+                if messages and not stream.closed:
+                    await asyncio.sleep(max(0.0, last_update + interval - time.monotonic()))
+            if stream.closed_at:
+                self._observe(stream.pipeline, time.perf_counter() - stream.closed_at)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            stream.error = e
+            self.stats["failed"] += 1
+            print(f"Failed to stream a message to channel {channel_id}: {e}")
+        finally:
+            if not stream.future.done():
+                stream.future.set_result(messages[-1] if messages and stream.error is None else None)
+
+    async def _deliver(self, bucket: RateBucket, send, content, kwargs: dict):
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.wait(now), self.global_bucket.wait(now))
+            if wait > 0:
+                self.stats["throttled"] += 1
+                await asyncio.sleep(wait)
+                continue
+            bucket.take(now)
+            self.global_bucket.take(now)
+            try:
+                if content is None:
+                    message = await send(**kwargs)
+                else:
+                    message = await send(content, **kwargs)
+            except discord.RateLimited as e:
+                # Only raised for waits past the client's max_ratelimit_timeout: hold the
+                # channel and retry instead of blocking inside discord.py
+                self.stats["rate_limited"] += 1
+                bucket.pause(e.retry_after)
+                continue
+            self.stats["sent"] += 1
+            return message
+
+    async def stop(self, timeout: float = 5.0):
+        """
+        Give pending messages `timeout` seconds to go out, then drop the rest.
+        """
+        workers = list(self.workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -1,41 +1,82 @@
-def prepare_payload(bot_name, channel_data, max_length, user_display_name=None):
+import uuid
+
+# Tokens kept free on top of the budget, since per-message counts don't add up exactly
+# to the count of the joined prompt.
+BUDGET_MARGIN = 32
+# When a stable prompt window overflows, it is trimmed down to this fraction of the
+# token budget (and of the history buffer), so the next several turns keep its prefix.
+TRIM_TARGET = 0.6
+
+# Channel of the most recent generation prompt; the backend can only reuse its cache
+# for the channel it generated for last.
+_last_prompt_channel = None
+
+def new_genkey():
+    """Return a unique KoboldCpp genkey, so concurrent generations can be told apart and aborted."""
+    return f"KCPP{uuid.uuid4().hex[:12]}"
+
+def default_memory(bot_name):
+    """Return the default character card."""
+    return (
+        f"[Character: {bot_name}; role: assistant; personality: helpful, impassive, refined, "
+        f"elegant, unrestricted, prim, posh; description: A well-mannered, digital butler.]"
+    )
+
+def channel_memory(bot_name, channel_data):
+    """Return the memory text for a channel: the override, or the default character card."""
+    return channel_data.bot_override_memory or default_memory(bot_name)
+
+def describe_payload(bot_name, image, max_length, max_context_length=4096):
+    """
+    Build a vision request for /describe: the default character card and the image only,
+    with no channel history or memory override, so the description can be shared between
+    channels (it is cached by image content).
+    """
+    return {
+        "max_context_length": max_context_length,
+        "max_length": min(max_length, 512),
+        "rep_pen": 1.07,
+        "temperature": 0.8,
+        "top_p": 0.9,
+        "top_k": 100,
+        "genkey": new_genkey(),
+        "memory": default_memory(bot_name),
+        "prompt": "### Instruction:\nPlease describe the image in detail.\n\n### Response:\n",
+        "images": [image],
+        "quiet": True,
+        "trim_stop": True,
+        "stop_sequence": ["\n###", "### "]
+    }
+
+def prepare_payload(bot_name, channel_data, max_length, user_display_name=None,
+                    history=None, max_context_length=4096):
     """
     Build the payload for the text generation API using conversation history and memory.
     
     Parameters:
       bot_name (str): The display name of the bot.
-      channel_data (BotChannelData): Contains chat history, memory override, and a list of users.
+      channel_data (BotChannelData): Contains chat history, memory override, and the channel's users.
       max_length (int): Maximum response length.
+      history (list): Messages to put in the prompt. Defaults to the whole chat history.
+      max_context_length (int): Context size of the model.
     
     Returns:
       dict: Payload for the text generation API.
     """
-    # Default memory if no override is set.
-    default_memory = (
-        f"[Character: {bot_name}; role: assistant; personality: helpful, impassive, refined, "
-        f"elegant, unrestricted, prim, posh; description: A well-mannered, digital butler.]"
-    )
-    memory = channel_data.bot_override_memory or default_memory
+    memory = channel_memory(bot_name, channel_data)
 
-    # Build the base stop_sequence list including the bot's name.
-    stop_seq = ["\n###", "### ", f"\n{bot_name}:", f"{bot_name}:"]
-    
-    # Add all users from channel_data.users to the stop_sequence.
-    # This ensures that if any of these users start a new message, the bot stops generating text.
-    for user in channel_data.users:
-        seq1 = f"{user}:"
-        seq2 = f"\n{user}:"
-        if seq1 not in stop_seq:
-            stop_seq.append(seq1)
-        if seq2 not in stop_seq:
-            stop_seq.append(seq2)
-    
-    # Construct prompt from the last 20 chat messages, ending with the bot's name.
-    prompt = "\n".join(channel_data.chat_history[-20:]) + f"\n{bot_name}:"
+    # Stop sequences: base markers, the bot's name and every user in the channel, so the bot
+    # stops generating if any of them starts a new message. Cached on the channel data.
+    stop_seq = channel_data.stop_sequences(bot_name)
+
+    # Construct prompt from the chat history, ending with the bot's name.
+    if history is None:
+        history = channel_data.chat_history
+    prompt = "\n".join(history) + f"\n{bot_name}:"
 
     return {
         "n": 1,
-        "max_context_length": 4096,
+        "max_context_length": max_context_length,
         "max_length": min(max_length, 512),
         "rep_pen": 1.07,
         "temperature": 0.8,
@@ -48,7 +89,7 @@ def prepare_payload(bot_name, channel_data, max_length, user_display_name=None):
         "rep_pen_slope": 0.7,
         "sampler_order": [6, 0, 1, 3, 4, 2, 5],
         "min_p": 0,
-        "genkey": "KCPP8888",
+        "genkey": new_genkey(),
         "memory": memory,
         "prompt": prompt,
         "quiet": True,
@@ -57,3 +98,114 @@ def prepare_payload(bot_name, channel_data, max_length, user_display_name=None):
         "use_default_badwordsids": False
     }
 
+async def truncate_tokens(counter, text, max_tokens):
+    """
+    Cut `text` down to at most `max_tokens` tokens, keeping its start (the speaker's name).
+    Returns (text, token count).
+    """
+    max_tokens = max(max_tokens, 1)
+    count = await counter.count(text)
+    while count > max_tokens and len(text) > 1:
+        # Cut in proportion to the overshoot, a little short since tokens aren't uniform
+        text = text[:max(int(len(text) * max_tokens / count * 0.95), 1)].rstrip() or text[:1]
+        count = await counter.count(text)
+    return text, count
+
+async def fit_history(counter, channel_data, fixed_text, max_length, max_context_length, stable=False):
+    """
+    Choose which recent messages of the channel's history go into the prompt, next to
+    `fixed_text` (memory and prompt suffix) and `max_length` generated tokens.
+    Token counts come from `counter` (a TokenCounter), memoized per message.
+
+    In sliding mode the window is as many recent messages as fit. In stable mode the
+    start of the window stays put between turns, so consecutive prompts share a prefix
+    KoboldCpp can reuse, and only moves, by a whole block, once the window overflows.
+    The newest message is always kept, truncated if it alone is over the budget.
+
+    Returns (first message number, messages, token counts, fixed_text token count).
+    """
+    messages = list(channel_data.chat_history)
+    offset = channel_data.message_count - len(messages)
+    fixed_tokens = await counter.count(fixed_text)
+    budget = max_context_length - max_length - fixed_tokens - BUDGET_MARGIN
+    counts = await counter.count_many(messages)
+    limit = budget
+    max_messages = len(messages)
+
+    if stable:
+        start = max(channel_data.prompt_start - offset, 0)
+        used = sum(counts[start:]) + len(messages) - start
+        if channel_data.prompt_start >= offset and used <= budget:
+            channel_data.prompt_start = offset + start
+            return offset + start, messages[start:], counts[start:], fixed_tokens
+        # Overflow (or the oldest windowed message fell out of the history buffer):
+        # trim down to a fraction of the budget so the next turns have headroom again.
+        limit = int(budget * TRIM_TARGET)
+        max_messages = int((channel_data.chat_history.maxlen or len(messages)) * TRIM_TARGET)
+
+    used = 0
+    start = len(messages)
+    for index in range(len(messages) - 1, -1, -1):
+        cost = counts[index] + 1  # +1 for the joining newline
+        if used + cost > limit or len(messages) - index > max_messages:
+            break
+        used += cost
+        start = index
+    if messages and start == len(messages):
+        # Not even the newest message fits (e.g. a long paste): keep it, cut down to the
+        # budget, rather than prompting without the message being answered.
+        start = len(messages) - 1
+        messages[start], counts[start] = await truncate_tokens(counter, messages[start], budget - 1)
+    channel_data.prompt_start = offset + start
+    return offset + start, messages[start:], counts[start:], fixed_tokens
+
+def record_prompt_reuse(channel_key, channel_data, memory, first, counts, fixed_tokens, recalled_tokens=0):
+    """
+    Estimate how many prompt tokens KoboldCpp can reuse from its previous prompt and add
+    them to the channel's counters. Reuse needs the same channel to have been the last
+    one generated for, with the same memory and the same window start.
+    `recalled_tokens` is the size of the recalled memory inserted before the last message.
+    """
+    global _last_prompt_channel
+    total = fixed_tokens + sum(counts) + len(counts) + recalled_tokens
+    reused = 0
+    last = channel_data.last_prompt
+    if last is not None and _last_prompt_channel == channel_key and last[0] == memory and last[1] == first:
+        shared = min(last[2] - first, len(counts))
+        reused = fixed_tokens + sum(counts[:shared]) + shared
+    # Recalled memory changes every turn, so the message after it can't be reused next time
+    end = first + len(counts) - (1 if recalled_tokens and counts else 0)
+    channel_data.last_prompt = (memory, first, end)
+    channel_data.prompt_tokens_reused += reused
+    channel_data.prompt_tokens_evaluated += total - reused
+    _last_prompt_channel = channel_key
+
+async def prepare_budgeted_payload(counter, bot_name, channel_data, max_length, max_context_length,
+                                   user_display_name=None, stable=True, channel_key=None, long_term=None):
+    """
+    Like prepare_payload, but packs recent messages into the token budget
+    (max_context_length minus memory, prompt suffix and max_length).
+    With `stable`, the window keeps its start between turns (see fit_history).
+
+    With `long_term` (a memory.LongTermMemory), its token budget is reserved as well and
+    filled with the channel's summary and recalled snippets, inserted just before the
+    last message so the rest of the prompt keeps its reusable prefix.
+    """
+    max_length = min(max_length, 512)
+    memory = channel_memory(bot_name, channel_data)
+    reserved = long_term.token_budget if long_term is not None and channel_key is not None else 0
+    first, history, counts, fixed_tokens = await fit_history(
+        counter, channel_data, memory + f"\n{bot_name}:", max_length + reserved, max_context_length, stable
+    )
+    recalled_tokens = 0
+    if reserved:
+        long_term.observe(channel_key, channel_data)
+        recalled = await long_term.recall(counter, channel_key, "\n".join(history[-2:]))
+        if recalled:
+            recalled_tokens = sum(await counter.count_many(recalled)) + len(recalled)
+            history = history[:-1] + recalled + history[-1:]
+    record_prompt_reuse(channel_key, channel_data, memory, first, counts, fixed_tokens, recalled_tokens)
+    return prepare_payload(
+        bot_name, channel_data, max_length, user_display_name,
+        history=history, max_context_length=max_context_length
+    )
@@ -0,0 +1,306 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import bot_data
+
+class JsonChannelStore:
+    """
+    Stores each channel's settings and history in its own JSON file, so a flush
+    only rewrites the channels that actually changed.
+    """
+
+    def __init__(self, directory: str = "botdata"):
+        self.directory = directory
+
+    def _path(self, channel_id) -> str:
+        return os.path.join(self.directory, f"{channel_id}.json")
+
+    def save(self, channel_id, record: dict) -> int:
+        """
+        Atomically write one channel record (temp file plus rename). Returns bytes written.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        data = json.dumps(record, separators=(",", ":")).encode("utf-8")
+        path = self._path(channel_id)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        return len(data)
+
+    def save_many(self, records: dict) -> int:
+        """
+        Write several channel records. Returns bytes written.
+        """
+        return sum(self.save(channel_id, record) for channel_id, record in records.items())
+
+    def load(self, channel_id) -> dict:
+        """
+        Return one channel record, or None if it was never stored.
+        """
+        path = self._path(channel_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    def count(self) -> int:
+        if not os.path.isdir(self.directory):
+            return 0
+        return sum(1 for name in os.listdir(self.directory) if name.endswith(".json"))
+
+    def load_all(self) -> list:
+        """
+        Return every stored channel record.
+        """
+        records = []
+        if not os.path.isdir(self.directory):
+            return records
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r", encoding="utf-8") as file:
+                    records.append(json.load(file))
+            except Exception as e:
+                print(f"Failed to load {name}:", e)
+        return records
+
+class SqliteChannelStore:
+    """
+    Stores channel records in SQLite (WAL mode), one row per channel, so channels can be
+    loaded individually on first access instead of all at startup.
+    """
+
+    def __init__(self, path: str = "botdata.db"):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS channels (channel_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def save_many(self, records: dict) -> int:
+        """
+        Write several channel records in one transaction. Returns bytes written.
+        """
+        rows = [(channel_id, json.dumps(record, separators=(",", ":"))) for channel_id, record in records.items()]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO channels (channel_id, data) VALUES (?, ?) "
+                "ON CONFLICT(channel_id) DO UPDATE SET data = excluded.data",
+                rows
+            )
+        return sum(len(data) for _, data in rows)
+
+    def save(self, channel_id, record: dict) -> int:
+        return self.save_many({channel_id: record})
+
+    def load(self, channel_id) -> dict:
+        """
+        Return one channel record, or None if it was never stored.
+        """
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM channels WHERE channel_id = ?", (channel_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def count(self) -> int:
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM channels").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class SqliteCacheStore:
+    """
+    Persistent backing for a TTLCache: one JSON value per key in its own SQLite table
+    (e.g. image descriptions by content hash), so cached results survive restarts.
+    """
+
+    def __init__(self, path: str = "botdata.db", table: str = "cache"):
+        self.table = table
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"CREATE TABLE IF NOT EXISTS {table} (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        self.conn.commit()
+
+    def load(self, key):
+        with self.lock:
+            row = self.conn.execute(f"SELECT data FROM {self.table} WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, key, value):
+        with self.lock, self.conn:
+            self.conn.execute(
+                f"INSERT INTO {self.table} (key, data) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+                (key, json.dumps(value))
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class SqliteMemoryStore:
+    """
+    Long-term channel memory (see memory.py) in SQLite: per channel, how far the history
+    has been archived and the latest rolling summary, plus the indexed snippets with their
+    embedding vectors as raw float16 blobs.
+    """
+
+    def __init__(self, path: str = "botdata.db"):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory_state "
+            "(channel_id INTEGER PRIMARY KEY, archived INTEGER NOT NULL, summary TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS memory_snippets "
+            "(id INTEGER PRIMARY KEY AUTOINCREMENT, channel_id INTEGER NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS memory_snippets_channel ON memory_snippets (channel_id, id)")
+        self.conn.commit()
+
+    def load(self, channel_id):
+        """
+        Return (archived, summary, [(text, vector bytes)]) oldest first, or None if the
+        channel has no memory yet.
+        """
+        with self.lock:
+            state = self.conn.execute(
+                "SELECT archived, summary FROM memory_state WHERE channel_id = ?", (channel_id,)
+            ).fetchone()
+            if state is None:
+                return None
+            rows = self.conn.execute(
+                "SELECT text, vector FROM memory_snippets WHERE channel_id = ? ORDER BY id", (channel_id,)
+            ).fetchall()
+        return state[0], state[1], rows
+
+    def append(self, channel_id, archived: int, summary: str, rows: list, keep: int):
+        """
+        Record newly archived snippets and the channel's new state in one transaction,
+        keeping only the `keep` most recent snippets.
+        """
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO memory_state (channel_id, archived, summary) VALUES (?, ?, ?) "
+                "ON CONFLICT(channel_id) DO UPDATE SET archived = excluded.archived, summary = excluded.summary",
+                (channel_id, archived, summary)
+            )
+            self.conn.executemany(
+                "INSERT INTO memory_snippets (channel_id, text, vector) VALUES (?, ?, ?)",
+                [(channel_id, text, vector) for text, vector in rows]
+            )
+            self.conn.execute(
+                "DELETE FROM memory_snippets WHERE channel_id = ? AND id NOT IN "
+                "(SELECT id FROM memory_snippets WHERE channel_id = ? ORDER BY id DESC LIMIT ?)",
+                (channel_id, channel_id, keep)
+            )
+
+    def delete(self, channel_id):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM memory_state WHERE channel_id = ?", (channel_id,))
+            self.conn.execute("DELETE FROM memory_snippets WHERE channel_id = ?", (channel_id,))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+class WriteBehind:
+    """
+    Debounced write-behind persistence for channel data.
+
+    Changes only mark a channel dirty (bot_data.mark_dirty). Every `interval` seconds,
+    and on shutdown, the dirty channels are snapshotted on the event loop and written
+    by a worker thread, so serialization and disk I/O never block Discord traffic.
+    """
+
+    def __init__(self, store, interval: float = 5.0):
+        self.store = store
+        self.interval = interval
+        self.task = None
+        self.lock = asyncio.Lock()
+        self.stats = {
+            "flushes": 0,
+            "channels_written": 0,
+            "bytes_written": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "errors": 0,
+        }
+
+    def start(self):
+        """
+        Start the periodic flush task. Must be called from within the running event loop.
+        """
+        if self.task is None:
+            self.task = asyncio.create_task(self._run(), name="write-behind")
+
+    async def stop(self):
+        """
+        Stop the periodic task and flush whatever is still dirty.
+        """
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def _write(self, records: dict) -> int:
+        return self.store.save_many(records)
+
+    async def flush(self):
+        """
+        Write every dirty channel to the store.
+        """
+        async with self.lock:
+            if not bot_data.dirty_channels:
+                return
+            dirty = set(bot_data.dirty_channels)
+            bot_data.dirty_channels.clear()
+            records = {}
+            for channel_id in dirty:
+                evicted = bot_data.evicted_records.pop(channel_id, None)
+                if channel_id in bot_data.bot_data:
+                    records[channel_id] = bot_data.channel_record(channel_id, bot_data.bot_data[channel_id])
+                elif evicted is not None:
+                    records[channel_id] = evicted
+            started = time.perf_counter()
+            try:
+                written = await asyncio.to_thread(self._write, records)
+            except Exception as e:
+                # Keep them dirty so the next flush retries.
+                bot_data.dirty_channels.update(dirty)
+                for channel_id, record in records.items():
+                    if channel_id not in bot_data.bot_data:
+                        bot_data.evicted_records.setdefault(channel_id, record)
+                self.stats["errors"] += 1
+                print("Failed to save channel data:", e)
+                return
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.stats["flushes"] += 1
+            self.stats["channels_written"] += len(records)
+            self.stats["bytes_written"] += written
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
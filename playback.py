@@ -0,0 +1,166 @@
+import asyncio
+import re
+import time
+from io import BytesIO
+
+import discord
+
+from audio import wav_to_pcm
+
+# Sentence boundaries: end punctuation followed by whitespace, or a line break.
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+def split_sentences(text: str, min_chars: int = 12, max_chars: int = 300) -> list:
+    """
+    Split a reply into sentences for TTS. Fragments shorter than `min_chars` are merged
+    into the next one (fewer tiny requests), and sentences longer than `max_chars` are
+    cut at a space so no single request holds up playback for long.
+    """
+    sentences = []
+    pending = ""
+    for part in SENTENCE_END.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        pending = f"{pending} {part}" if pending else part
+        if len(pending) < min_chars:
+            continue
+        while len(pending) > max_chars:
+            cut = pending.rfind(" ", 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            sentences.append(pending[:cut].strip())
+            pending = pending[cut:].strip()
+        sentences.append(pending)
+        pending = ""
+    if pending:
+        if sentences and len(sentences[-1]) + len(pending) < max_chars:
+            sentences[-1] = f"{sentences[-1]} {pending}"
+        else:
+            sentences.append(pending)
+    return sentences
+
+def audio_source(data: bytes) -> discord.AudioSource:
+    """
+    Wrap TTS output in an in-memory AudioSource. WAV is decoded in-process; any other
+    format is piped through ffmpeg from memory.
+    """
+    try:
+        return discord.PCMAudio(BytesIO(wav_to_pcm(data)))
+    except ValueError:
+        return discord.FFmpegPCMAudio(BytesIO(data), pipe=True)
+
+class TTSPlayer:
+    """
+    Per-voice-client TTS playback queue.
+
+    Replies are split into sentences and synthesized ahead of playback, at most
+    `lookahead` clips at a time, while clips are played strictly in order. Playback
+    starts as soon as the first sentence is ready, and replies that arrive while
+    something is playing are queued behind it instead of being dropped.
+
+    `synthesize(text, voice)` is an async callable returning the TTS audio bytes. With
+    `metrics`, the time from a reply being queued to its first clip playing is recorded.
+    """
+
+    def __init__(self, vc: discord.VoiceClient, synthesize, lookahead: int = 3, metrics=None):
+        self.vc = vc
+        self.synthesize = synthesize
+        self.metrics = metrics
+        self.replies = asyncio.Queue()
+        self.clips = asyncio.Queue()
+        self.lookahead = asyncio.Semaphore(lookahead)
+        self.tasks = []
+        self.stats = {
+            "replies": 0,
+            "sentences": 0,
+            "failed": 0,
+            "last_first_audio_ms": 0.0,
+        }
+
+    def start(self):
+        """
+        Start the synthesis and playback tasks. Must be called from within the running event loop.
+        """
+        if not self.tasks:
+            self.tasks = [
+                asyncio.create_task(self._synthesize_replies(), name="tts-synthesize"),
+                asyncio.create_task(self._play_clips(), name="tts-play")
+            ]
+
+    def speak(self, text: str, voice: str):
+        """
+        Queue a reply for playback and return immediately.
+        """
+        self.start()
+        self.replies.put_nowait((text, voice, time.perf_counter()))
+
+    async def _render(self, sentence: str, voice: str) -> discord.AudioSource:
+        data = await self.synthesize(sentence, voice)
+        if not data:
+            raise Exception("No response received")
+        return await asyncio.to_thread(audio_source, data)
+
+    async def _synthesize_replies(self):
+        while True:
+            text, voice, queued_at = await self.replies.get()
+            self.stats["replies"] += 1
+            for index, sentence in enumerate(split_sentences(text)):
+                # Wait for a lookahead slot so long replies don't flood the TTS lane.
+                await self.lookahead.acquire()
+                clip = asyncio.create_task(self._render(sentence, voice))
+                await self.clips.put((clip, queued_at if index == 0 else None))
+
+    async def _play_clips(self):
+        while True:
+            clip, queued_at = await self.clips.get()
+            try:
+                source = await clip
+            except Exception as e:
+                self.stats["failed"] += 1
+                print("TTS failed:", e)
+                continue
+            finally:
+                self.lookahead.release()
+            self.stats["sentences"] += 1
+            if queued_at is not None:
+                self.stats["last_first_audio_ms"] = (time.perf_counter() - queued_at) * 1000
+                if self.metrics is not None:
+                    self.metrics.observe("stage_seconds", time.perf_counter() - queued_at,
+                                         pipeline="voice", stage="first_audio")
+            await self._play(source)
+
+    async def _play(self, source: discord.AudioSource):
+        if not self.vc.is_connected():
+            source.cleanup()
+            return
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def after(error):
+            if error:
+                print("TTS playback error:", error)
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+
+        # Something else (not queued here) may still be playing; let it finish first.
+        while self.vc.is_playing():
+            await asyncio.sleep(0.1)
+        try:
+            self.vc.play(source, after=after)
+        except Exception as e:
+            print("TTS playback error:", e)
+            return
+        await done
+
+    async def close(self):
+        """
+        Stop playback and drop everything still queued.
+        """
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        while not self.clips.empty():
+            clip, _ = self.clips.get_nowait()
+            clip.cancel()
+        if self.vc.is_playing():
+            self.vc.stop()
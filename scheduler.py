@@ -0,0 +1,247 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+# Job priorities, lower runs first.
+PRIORITY_HIGH = 0    # direct mentions and voice turns
+PRIORITY_NORMAL = 1  # slash commands
+PRIORITY_LOW = 2     # idle-window chatter
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+class QueueFull(Exception):
+    """
+    Raised when a job cannot be queued because the lane or the channel is at capacity.
+    """
+
+def channel_key(channel) -> tuple:
+    """
+    Return the (guild_id, channel_id) fairness key for a Discord channel.
+    DMs have no guild and share the guild slot 0.
+    """
+    guild = getattr(channel, "guild", None)
+    return (guild.id if guild else 0, channel.id)
+
+class Job:
+    __slots__ = ("kind", "key", "priority", "factory", "future", "queued_at")
+
+    def __init__(self, kind, key, priority, factory, future):
+        self.kind = kind
+        self.key = key
+        self.priority = priority
+        self.factory = factory
+        self.future = future
+        self.queued_at = time.perf_counter()
+
+class _Lane:
+    """
+    Queues for one endpoint kind. Each priority level holds guild -> channel -> jobs,
+    served round-robin first across guilds and then across channels within a guild.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = max(1, concurrency)
+        self.levels = {p: OrderedDict() for p in PRIORITIES}
+        self.per_key = {}
+        self.size = 0
+        self.running = 0
+        self.ready = asyncio.Semaphore(0)
+
+    def push(self, job: Job):
+        guild_id, _ = job.key
+        guilds = self.levels[job.priority]
+        channels = guilds.setdefault(guild_id, OrderedDict())
+        channels.setdefault(job.key, deque()).append(job)
+        self.per_key[job.key] = self.per_key.get(job.key, 0) + 1
+        self.size += 1
+
+    def pop(self) -> Job:
+        for priority in PRIORITIES:
+            guilds = self.levels[priority]
+            if not guilds:
+                continue
+            guild_id, channels = guilds.popitem(last=False)
+            key, jobs = channels.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                channels[key] = jobs
+            if channels:
+                guilds[guild_id] = channels
+            self.size -= 1
+            remaining = self.per_key[key] - 1
+            if remaining:
+                self.per_key[key] = remaining
+            else:
+                del self.per_key[key]
+            return job
+        return None
+
+    def order(self) -> list:
+        """
+        Return queued jobs in the order pop() would hand them out, without mutating.
+        """
+        result = []
+        for priority in PRIORITIES:
+            guilds = deque(
+                deque((key, deque(jobs)) for key, jobs in channels.items())
+                for channels in self.levels[priority].values()
+            )
+            while guilds:
+                channels = guilds.popleft()
+                key, jobs = channels.popleft()
+                result.append(jobs.popleft())
+                if jobs:
+                    channels.append((key, jobs))
+                if channels:
+                    guilds.append(channels)
+        return result
+
+class GenerationScheduler:
+    """
+    Asyncio job scheduler in front of the KoboldCpp backend.
+
+    Jobs are queued per endpoint kind (generate, txt2img, transcribe, tts, ...) with a
+    bounded queue and a configurable number of concurrent workers per kind. Within a kind,
+    higher priority jobs run first and equal priority jobs are served round-robin across
+    guilds and channels, so one busy channel cannot starve the others.
+
+    With `metrics` (see metrics.Metrics), the time each job waited in the queue is
+    recorded per kind. With `admission` (sharding.SharedSlots), every job also takes one
+    of the slots shared with the other worker processes before it starts.
+    """
+
+    def __init__(self, concurrency: dict = None, max_queue: int = 100, max_per_channel: int = 5, metrics=None,
+                 admission=None):
+        self.concurrency = dict(concurrency or {})
+        self.max_queue = max_queue
+        self.max_per_channel = max_per_channel
+        self.metrics = metrics
+        self.admission = admission
+        self.lanes = {}
+        self.workers = []
+        self._started = False
+
+    def _lane(self, kind: str) -> _Lane:
+        lane = self.lanes.get(kind)
+        if lane is None:
+            lane = _Lane(self.concurrency.get(kind, 1))
+            self.lanes[kind] = lane
+            if self._started:
+                self._spawn(kind, lane)
+        return lane
+
+    def _spawn(self, kind: str, lane: _Lane):
+        for _ in range(lane.concurrency):
+            self.workers.append(asyncio.create_task(self._worker(kind, lane), name=f"scheduler-{kind}"))
+
+    def start(self):
+        """
+        Start the worker tasks. Must be called from within the running event loop.
+        """
+        if self._started:
+            return
+        for kind in self.concurrency:
+            self._lane(kind)
+        # Lanes created from now on spawn their own workers (see _lane)
+        self._started = True
+        for kind, lane in self.lanes.items():
+            self._spawn(kind, lane)
+
+    async def stop(self):
+        """
+        Cancel the workers and fail any jobs that are still queued.
+        """
+        for task in self.workers:
+            task.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers.clear()
+        self._started = False
+        for lane in self.lanes.values():
+            while (job := lane.pop()) is not None:
+                if not job.future.done():
+                    job.future.cancel()
+
+    def submit(self, kind: str, key: tuple, factory, priority: int = PRIORITY_NORMAL) -> Job:
+        """
+        Queue `factory` (a zero-argument coroutine function) on the `kind` lane.
+        Raises QueueFull if the lane or this channel already has too many pending jobs.
+        """
+        lane = self._lane(kind)
+        if lane.size >= self.max_queue or lane.per_key.get(key, 0) >= self.max_per_channel:
+            raise QueueFull(kind)
+        job = Job(kind, key, priority, factory, asyncio.get_running_loop().create_future())
+        lane.push(job)
+        lane.ready.release()
+        return job
+
+    def position(self, job: Job, shared_free: int = None) -> int:
+        """
+        Return how many jobs will start before `job` (0 means a worker is free for it).
+        `shared_free` is the number of free slots shared with the other worker processes
+        (see SharedSlots.free): idle workers only count as free as far as there are slots
+        for them. Jobs queued in the other processes can't be seen, so with sharding this
+        is the position in this process's queue.
+        """
+        lane = self.lanes[job.kind]
+        queued = lane.order()
+        if job not in queued:
+            return 0
+        ahead = queued.index(job)
+        free = lane.concurrency - lane.running
+        if shared_free is not None:
+            free = min(free, shared_free)
+        return 0 if ahead < free else ahead - free + 1
+
+    def depth(self, kind: str) -> int:
+        """
+        Return the number of queued (not yet running) jobs for a kind.
+        """
+        lane = self.lanes.get(kind)
+        return lane.size if lane else 0
+
+    async def run(self, kind: str, key: tuple, factory, priority: int = PRIORITY_NORMAL, on_queued=None):
+        """
+        Queue a job and wait for its result. If the job has to wait behind others,
+        `on_queued(position)` is awaited first so the caller can tell the user.
+        """
+        job = self.submit(kind, key, factory, priority)
+        if on_queued is not None:
+            shared_free = await self.admission.free(kind) if self.admission is not None else None
+            position = self.position(job, shared_free)
+            if position > 0:
+                try:
+                    await on_queued(position)
+                except Exception as e:
+                    print(f"Queue feedback failed: {e}")
+        return await job.future
+
+    async def _worker(self, kind: str, lane: _Lane):
+        while True:
+            await lane.ready.acquire()
+            token = await self.admission.acquire(kind) if self.admission is not None else None
+            try:
+                job = lane.pop()
+                if job is None or job.future.done():
+                    continue
+                await self._execute(lane, job)
+            finally:
+                if token is not None:
+                    self.admission.release(token)
+
+    async def _execute(self, lane: _Lane, job: Job):
+        if self.metrics is not None:
+            self.metrics.observe("queue_wait_seconds", time.perf_counter() - job.queued_at, kind=job.kind)
+        lane.running += 1
+        try:
+            result = await job.factory()
+        except asyncio.CancelledError:
+            if not job.future.done():
+                job.future.cancel()
+            raise
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            lane.running -= 1
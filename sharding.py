@@ -0,0 +1,185 @@
+import asyncio
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import uuid
+
+GATEWAY_URL = "https://discord.com/api/v10/gateway/bot"
+
+def recommended_shards(token: str) -> int:
+    """
+    Ask Discord how many shards it recommends for this bot.
+    """
+    request = urllib.request.Request(GATEWAY_URL, headers={
+        "Authorization": f"Bot {token}",
+        "User-Agent": "DiscordBot (https://github.com/Ketis21/KetisBot, 1.0)"
+    })
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return int(json.load(response)["shards"])
+
+def shard_plan(shard_count: int, processes: int) -> list:
+    """
+    Split shard ids over worker processes round-robin: process i gets shards i, i + processes, ...
+    Processes without a shard are left out.
+    """
+    processes = max(1, min(processes, shard_count))
+    return [list(range(index, shard_count, processes)) for index in range(processes)]
+
+class ShardSupervisor:
+    """
+    Runs the bot as several worker processes, each an AutoShardedClient for its share of
+    the shards (see shard_plan). Every guild's events, voice connection and audio
+    processing stay in the process that owns its shard, so CPU-heavy work spreads across
+    cores; channel state lives in the shared SQLite store (DB_PATH), which all workers
+    open in WAL mode. Workers that crash are restarted after `restart_delay` seconds.
+
+    `command` is the worker command line; each worker gets SHARD_COUNT, SHARD_IDS and
+    SHARD_PROCESS_INDEX in its environment.
+    """
+
+    def __init__(self, command: list, shard_count: int, processes: int, restart_delay: float = 5.0):
+        self.command = command
+        self.shard_count = shard_count
+        self.plan = shard_plan(shard_count, processes)
+        self.restart_delay = restart_delay
+        self.workers = {}  # process index -> Popen
+
+    def _spawn(self, index: int) -> subprocess.Popen:
+        env = dict(os.environ)
+        env.update({
+            "SHARD_COUNT": str(self.shard_count),
+            "SHARD_IDS": ",".join(str(shard_id) for shard_id in self.plan[index]),
+            "SHARD_PROCESS_INDEX": str(index),
+        })
+        print(f"Starting worker {index} with shards {self.plan[index]} of {self.shard_count}")
+        return subprocess.Popen(self.command, env=env)
+
+    def run(self):
+        """
+        Start every worker and keep them running until interrupted.
+        """
+        for index in range(len(self.plan)):
+            self.workers[index] = self._spawn(index)
+        try:
+            while self.workers:
+                time.sleep(1)
+                for index, worker in list(self.workers.items()):
+                    code = worker.poll()
+                    if code is None:
+                        continue
+                    if code == 0:
+                        # Clean exit (e.g. failed login): don't restart it.
+                        print(f"Worker {index} exited")
+                        del self.workers[index]
+                        continue
+                    print(f"Worker {index} crashed with exit code {code}, restarting in {self.restart_delay:.0f}s")
+                    time.sleep(self.restart_delay)
+                    self.workers[index] = self._spawn(index)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        for worker in self.workers.values():
+            if worker.poll() is None:
+                worker.terminate()
+        for worker in self.workers.values():
+            try:
+                worker.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        self.workers.clear()
+
+class SharedSlots:
+    """
+    Admission control shared by the worker processes: a fixed number of concurrency slots
+    per endpoint kind, kept in the shared SQLite database. Each worker's scheduler takes a
+    slot before starting a job (see GenerationScheduler), so together the workers never
+    run more jobs of a kind than one process would on its own.
+
+    Slots are leases: a worker that dies without releasing its slots gets them back when
+    it is restarted under the same process index, and any slot is reclaimed after `lease`
+    seconds regardless.
+    """
+
+    def __init__(self, path: str, limits: dict, holder: int, lease: float = 900.0, poll: float = 0.05):
+        self.holder = holder
+        self.lease = lease
+        self.poll = poll
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS scheduler_slots (kind TEXT NOT NULL, slot INTEGER NOT NULL, "
+                "holder INTEGER, token TEXT, expires REAL NOT NULL DEFAULT 0, PRIMARY KEY (kind, slot))"
+            )
+            for kind, limit in limits.items():
+                self.conn.execute("DELETE FROM scheduler_slots WHERE kind = ? AND slot >= ?", (kind, limit))
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO scheduler_slots (kind, slot) VALUES (?, ?)",
+                    [(kind, slot) for slot in range(max(1, limit))]
+                )
+            # Slots left behind by this process index before a crash
+            self.conn.execute(
+                "UPDATE scheduler_slots SET holder = NULL, token = NULL, expires = 0 WHERE holder = ?", (holder,)
+            )
+
+    def _try(self, kind: str):
+        token = uuid.uuid4().hex
+        now = time.time()
+        with self.lock, self.conn:
+            # One statement, so it is atomic under SQLite's write lock across processes
+            taken = self.conn.execute(
+                "UPDATE scheduler_slots SET holder = ?, token = ?, expires = ? WHERE rowid = "
+                "(SELECT rowid FROM scheduler_slots WHERE kind = ? AND (token IS NULL OR expires < ?) LIMIT 1)",
+                (self.holder, token, now + self.lease, kind, now)
+            ).rowcount
+        return token if taken else None
+
+    def _free(self, kind: str) -> int:
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM scheduler_slots WHERE kind = ? AND (token IS NULL OR expires < ?)",
+                (kind, time.time())
+            ).fetchone()[0]
+
+    async def free(self, kind: str) -> int:
+        """
+        Return how many slots of `kind` no worker holds right now.
+        """
+        return await asyncio.to_thread(self._free, kind)
+
+    async def acquire(self, kind: str) -> str:
+        """
+        Wait for a free slot of `kind` and return its token.
+        """
+        while True:
+            token = await asyncio.to_thread(self._try, kind)
+            if token is not None:
+                return token
+            await asyncio.sleep(self.poll)
+
+    def release(self, token: str):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE scheduler_slots SET holder = NULL, token = NULL, expires = 0 WHERE token = ?", (token,)
+            )
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+def run_sharded(token: str, shard_count: str, processes: int):
+    """
+    Entry point for SHARD_PROCESSES > 1: resolve the shard count ("auto" asks Discord)
+    and supervise the worker processes running this script.
+    """
+    count = recommended_shards(token) if shard_count in ("", "auto") else int(shard_count)
+    ShardSupervisor([sys.executable] + sys.argv, count, processes).run()
@@ -0,0 +1,105 @@
+import json
+
+from backends import DeliveryFailed
+from http_client import KoboldHTTP
+
+async def stream_tokens(http: KoboldHTTP, url: str, payload: dict, timeout: float = None):
+    """
+    POST a generation payload to KoboldCpp's SSE stream endpoint and yield tokens as they arrive.
+    """
+    session = http.session_for(url)
+    async with session.post(url, json=payload, timeout=http.timeout_for(url, timeout)) as resp:
+        if resp.status != 200:
+            text = await resp.text()
+            raise Exception(f"Status code: {resp.status}, body: {text}")
+        async for raw in resp.content:
+            line = raw.decode("utf-8").strip()
+            if not line.startswith("data:"):
+                continue
+            token = json.loads(line[5:]).get("token", "")
+            if token:
+                yield token
+
+class StreamingReply:
+    """
+    Tracks the text of a reply while it is being generated and hands what can be shown
+    to `sink` (an outbound.OutboxStream), which posts and edits the Discord messages at
+    the channel's own pace, so reading tokens never waits on Discord.
+
+    Stop sequences are trimmed, and text that could still become a stop sequence is held
+    back until it is known not to be one.
+    """
+
+    def __init__(self, sink, stop_sequences=()):
+        self.sink = sink
+        self.stop_sequences = [s for s in stop_sequences if s]
+        self.raw = ""
+        self.shown = ""
+        self.stopped = False
+
+    def _visible(self, final: bool = False) -> str:
+        text = self.raw
+        for seq in self.stop_sequences:
+            index = text.find(seq)
+            if index != -1:
+                text = text[:index]
+                self.stopped = True
+        if not final and not self.stopped:
+            # Hold back a tail that might be the beginning of a stop sequence.
+            for seq in self.stop_sequences:
+                for size in range(min(len(seq) - 1, len(text)), 0, -1):
+                    if text.endswith(seq[:size]):
+                        text = text[:-size]
+                        break
+        return text
+
+    def feed(self, token: str) -> bool:
+        """
+        Add a token. Returns True once a stop sequence was hit. Raises DeliveryFailed if
+        showing the reply in Discord failed.
+        """
+        if self.sink.error is not None:
+            raise DeliveryFailed(self.sink.error)
+        self.raw += token
+        visible = self._visible()
+        if visible != self.shown:
+            self.shown = visible
+            self.sink.update(visible)
+        return self.stopped
+
+    def finish(self) -> str:
+        """
+        Hand over the final text and return it; the sink delivers it afterwards.
+        """
+        visible = self._visible(final=True)
+        self.sink.close(visible)
+        return visible
+
+async def stream_reply(http: KoboldHTTP, url: str, payload: dict, sink, on_stop=None):
+    """
+    Stream a generation into `sink` (see Outbox.stream). Returns the final text as soon
+    as the generation ends, while the last edits may still be on their way, or None if
+    it failed before anything was shown. Discord errors raise DeliveryFailed, so the
+    backend router doesn't take them for a backend failure.
+
+    `on_stop()` is called when a stop sequence ends the reply here: KoboldCpp keeps
+    generating after the client stops reading, so it should abort the genkey.
+    """
+    reply = StreamingReply(sink, payload.get("stop_sequence", []))
+    try:
+        try:
+            async for token in stream_tokens(http, url, payload):
+                if reply.feed(token):
+                    if on_stop is not None:
+                        on_stop()
+                    break
+        except DeliveryFailed:
+            raise
+        except Exception as e:
+            print(f"❌ stream_reply error: {e}")
+            if not reply.shown.strip():
+                return None
+        return reply.finish()
+    finally:
+        # Also on failure or cancellation, so the channel's queue moves on
+        sink.close()
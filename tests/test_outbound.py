@@ -0,0 +1,18 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from outbound import split_message
+
+def test_blank_text_has_no_chunks():
+    assert split_message("") == []
+    assert split_message("  \n\n \n") == []
+
+def test_blank_stretches_are_not_sent():
+    text = "a" * 300 + "\n\n" + " " * 900 + "\n\n" + "```py\n" + "\n" * 300 + " " * 400 + "\n```\n\nend"
+    chunks = split_message(text, 400)
+    assert chunks
+    for chunk in chunks:
+        assert len(chunk) <= 400
+        assert chunk.strip() and chunk.strip("`py\n ")
@@ -0,0 +1,42 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bot_data import BotChannelData
+from payload import fit_history, prepare_budgeted_payload
+
+class WordCounter:
+    """Stands in for TokenCounter: one token per word."""
+
+    async def count(self, text):
+        return len(text.split())
+
+    async def count_many(self, texts):
+        return [len(text.split()) for text in texts]
+
+def channel(*messages):
+    data = BotChannelData()
+    for message in messages:
+        data.chat_history.append(message)
+        data.message_count += 1
+    return data
+
+def test_oversized_message_is_truncated_not_dropped():
+    paste = "User: " + " ".join(f"word{i}" for i in range(5000))
+    data = channel("User: hello", "KetisBot: hi", paste)
+    for stable in (True, False):
+        first, history, counts, _ = asyncio.run(
+            fit_history(WordCounter(), data, "memory\nKetisBot:", 512, 2048, stable=stable)
+        )
+        assert first == 2
+        assert len(history) == 1
+        assert history[0].startswith("User: word0 word1")
+        assert len(history[0].split()) == counts[0] < 2048 - 512
+
+def test_oversized_message_reaches_the_prompt():
+    paste = "User: " + "x " * 10000
+    payload = asyncio.run(prepare_budgeted_payload(WordCounter(), "KetisBot", channel(paste), 512, 2048))
+    assert payload["prompt"].startswith("User: x x")
+    assert payload["prompt"].endswith("\nKetisBot:")
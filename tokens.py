@@ -0,0 +1,77 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from backends import BackendRouter
+from http_client import KoboldHTTP
+
+class TokenCounter:
+    """
+    Counts tokens with KoboldCpp's token-count endpoint, memoized per text.
+
+    Chat history lines never change once written, so each message is counted once and
+    served from a bounded LRU afterwards. If the endpoint is unavailable, a rough
+    character-based estimate is used (and not memoized, so a later call can still get
+    the real count), and the endpoint is left alone for `retry_after` seconds, so turns
+    use the estimate meanwhile instead of waiting on a failing request each time.
+    """
+
+    def __init__(self, http: KoboldHTTP, backends: BackendRouter, max_entries: int = 20000, max_concurrency: int = 8,
+                 retry_after: float = 30.0):
+        self.http = http
+        self.backends = backends
+        self.max_entries = max_entries
+        self.cache = OrderedDict()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.retry_after = retry_after
+        self.unavailable_until = 0.0
+
+    @staticmethod
+    def estimate(text: str) -> int:
+        return len(text) // 3 + 1
+
+    async def _post(self, url: str, text: str) -> int:
+        try:
+            session = self.http.session_for(url)
+            async with session.post(url, json={"prompt": text}, timeout=self.http.timeout_for(url)) as resp:
+                if resp.status != 200:
+                    raise Exception(f"Status code: {resp.status}")
+                data = await resp.json()
+                return int(data["value"])
+        except Exception as e:
+            print(f"❌ token count error: {e}")
+            return None
+
+    async def _fetch(self, text: str) -> int:
+        async with self.semaphore:
+            return await self.backends.call("tokencount", lambda url: self._post(url, text))
+
+    async def count(self, text: str) -> int:
+        """
+        Return the token count of `text`.
+        """
+        return (await self.count_many([text]))[0]
+
+    async def count_many(self, texts: list) -> list:
+        """
+        Return token counts for several texts, fetching only the ones not cached yet.
+        """
+        missing = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        if missing and time.monotonic() >= self.unavailable_until:
+            fetched = await asyncio.gather(*(self._fetch(text) for text in missing))
+            for text, value in zip(missing, fetched):
+                if value is not None:
+                    self.cache[text] = value
+            if None in fetched:
+                self.unavailable_until = time.monotonic() + self.retry_after
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+        counts = []
+        for text in texts:
+            value = self.cache.get(text)
+            if value is None:
+                value = self.estimate(text)
+            else:
+                self.cache.move_to_end(text)
+            counts.append(value)
+        return counts
@@ -0,0 +1,320 @@
+import asyncio
+import math
+import re
+import threading
+import time
+
+import numpy as np
+
+# Discord delivers 48 kHz, 16-bit, stereo PCM in 20 ms packets.
+SAMPLE_RATE = 48000
+CHANNELS = 2
+SAMPLE_WIDTH = 2
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * CHANNELS * SAMPLE_WIDTH  # 3840
+FRAME_SAMPLES = FRAME_BYTES // SAMPLE_WIDTH
+
+# Initial per-speaker buffer size; it grows (up to max_utterance) for longer utterances.
+INITIAL_BUFFER_SECONDS = 5
+
+# Wake phrase that makes the bot respond to an utterance ("bot" or "hey bot")
+WAKE_PATTERN = r"\b(hey[, ]+)?bot\b"
+
+# Frames whose zero-crossing rate is above this look like broadband noise, not voice.
+MAX_VOICED_ZCR = 0.35
+
+# A frame of digital silence (what Discord's silence packets decode to), and its level:
+# the RMS is clamped to one step, as for every frame.
+SILENT_FRAME = bytes(FRAME_BYTES)
+SILENCE_DB = 20 * math.log10(1.0 / 32768.0)
+
+def frame_level(pcm, offset: int = 0):
+    """
+    Return (RMS level in dBFS, samples as float32) of the 20 ms frame at `offset` in `pcm`.
+    Digital silence is recognized without decoding it (samples is None).
+    """
+    if (pcm if len(pcm) == FRAME_BYTES else pcm[offset:offset + FRAME_BYTES]) == SILENT_FRAME:
+        return SILENCE_DB, None
+    samples = np.frombuffer(pcm, dtype="<i2", count=FRAME_SAMPLES, offset=offset).astype(np.float32)
+    power = float(np.dot(samples, samples)) / FRAME_SAMPLES
+    return 10 * math.log10(max(power, 1.0) / (32768.0 * 32768.0)), samples
+
+def zero_crossing_rate(samples: np.ndarray) -> float:
+    """
+    Return the zero-crossing rate of a frame's left channel.
+    """
+    signs = np.signbit(samples[::CHANNELS])
+    return np.count_nonzero(signs[1:] != signs[:-1]) / (signs.size - 1)
+
+class Segment:
+    """
+    One utterance from one speaker: raw 48 kHz stereo PCM plus who said it.
+    `ended_at` is the time.monotonic() of its last voiced packet.
+    """
+    __slots__ = ("ssrc", "user", "pcm", "voiced_ms", "ended_at")
+
+    def __init__(self, ssrc, user, pcm, voiced_ms, ended_at=None):
+        self.ssrc = ssrc
+        self.user = user
+        self.pcm = pcm
+        self.voiced_ms = voiced_ms
+        self.ended_at = ended_at
+
+    @property
+    def duration(self) -> float:
+        return len(self.pcm) / (SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+
+class _Utterance:
+    """
+    An utterance in progress: a preallocated buffer and a fill level. The buffer doubles
+    when a long utterance outgrows it. Whoever pops it from VoiceSegmenter.open owns it,
+    and hands it back to the speaker for reuse once the audio is copied out.
+    """
+    __slots__ = ("buffer", "view", "length", "voiced_ms", "last_voiced")
+
+    def __init__(self, capacity):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self.voiced_ms = 0
+        self.last_voiced = 0.0
+
+    def append(self, pcm: bytes, limit: int):
+        end = min(self.length + len(pcm), limit)
+        if end > len(self.buffer):
+            # A memoryview pins the bytearray's size, so grow by copying into a new one.
+            buffer = bytearray(min(max(end, len(self.buffer) * 2), limit))
+            buffer[:self.length] = self.view[:self.length]
+            self.buffer, self.view = buffer, memoryview(buffer)
+        self.view[self.length:end] = pcm[:end - self.length]
+        self.length = end
+
+class _Speaker:
+    __slots__ = ("user", "noise_floor", "spare")
+
+    def __init__(self, user, threshold_db):
+        self.user = user
+        self.noise_floor = threshold_db - 10
+        self.spare = None
+
+class VoiceSegmenter:
+    """
+    Per-speaker (per-SSRC) voice activity detection and utterance segmentation.
+
+    Each 20 ms frame is voiced if it is louder than both `threshold_db` and the speaker's
+    adaptive noise floor plus `noise_margin_db`, and its zero-crossing rate is not that of
+    broadband noise. An utterance starts on the first voiced frame and ends `hangover`
+    seconds after the last one. Utterances with less than `min_utterance` seconds of
+    voiced audio are dropped, so silence and short noise bursts never reach transcription.
+
+    `feed` runs directly on the voice receive (sink) thread and only copies the packet into
+    the speaker's reusable buffer, without event loop calls. The event loop is woken once
+    per finished utterance (`on_segment` via call_soon_threadsafe). Speakers who stop
+    sending packets are closed by a watchdog thread that only runs while an utterance is
+    open; a lock keeps it and the sink thread from touching the same buffers at once.
+    """
+
+    def __init__(self, on_segment, threshold_db: float = -45.0, noise_margin_db: float = 12.0,
+                 hangover: float = 0.8, min_utterance: float = 0.4, max_utterance: float = 30.0,
+                 loop: asyncio.AbstractEventLoop = None):
+        self.on_segment = on_segment
+        self.threshold_db = threshold_db
+        self.noise_margin_db = noise_margin_db
+        self.hangover = hangover
+        self.min_voiced_ms = int(min_utterance * 1000)
+        self.max_bytes = int(max_utterance * SAMPLE_RATE) * CHANNELS * SAMPLE_WIDTH
+        self.initial_bytes = min(self.max_bytes, INITIAL_BUFFER_SECONDS * SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+        self.speakers = {}
+        self.open = {}  # ssrc -> _Utterance in progress
+        self.loop = loop or asyncio.get_running_loop()
+        self.stats = {
+            "packets": 0,
+            "bytes": 0,
+            "segments": 0,
+            "dropped": 0,
+            "callback_seconds": 0.0,
+        }
+        self._lock = threading.Lock()  # guards speakers, open utterances and stats
+        self._active = threading.Event()
+        self._closed = False
+        self._watchdog = threading.Thread(target=self._watch, name="voice-segmenter", daemon=True)
+        self._watchdog.start()
+
+    def feed(self, ssrc: int, user, pcm: bytes):
+        """
+        Add one packet of PCM from a speaker. Called on the sink thread.
+        """
+        started = time.perf_counter()
+        usable = len(pcm) - len(pcm) % FRAME_BYTES
+        with self._lock:
+            speaker = self.speakers.get(ssrc)
+            if speaker is None:
+                speaker = self.speakers[ssrc] = _Speaker(user, self.threshold_db)
+            speaker.user = user or speaker.user
+            if usable:
+                self._ingest(ssrc, speaker, pcm, usable)
+            self.stats["packets"] += 1
+            self.stats["bytes"] += len(pcm)
+            self.stats["callback_seconds"] += time.perf_counter() - started
+
+    def _ingest(self, ssrc: int, speaker: _Speaker, pcm: bytes, usable: int):
+        now = time.monotonic()
+        utterance = self.open.get(ssrc)
+        if utterance is not None and now - utterance.last_voiced >= self.hangover:
+            # The speaker paused for longer than the hangover; close before appending.
+            self._finish(ssrc)
+            utterance = None
+
+        # Frame by frame with scalar math: a packet is usually a single frame, for which
+        # whole-array numpy calls cost more than the work. The zero-crossing rate is only
+        # needed for frames loud enough to be voiced.
+        threshold = max(self.threshold_db, speaker.noise_floor + self.noise_margin_db)
+        voiced_frames = 0
+        quietest = None
+        for offset in range(0, usable, FRAME_BYTES):
+            level, samples = frame_level(pcm, offset)
+            if level > threshold and zero_crossing_rate(samples) < MAX_VOICED_ZCR:
+                voiced_frames += 1
+            elif quietest is None or level < quietest:
+                quietest = level
+
+        # Track the background level from unvoiced frames only: fall quickly towards quiet
+        # frames, rise slowly, so steady noise lifts the floor over a couple of seconds.
+        # Voiced frames never move it, or sustained speech would raise the floor to its
+        # own level and be cut off.
+        if quietest is not None:
+            rate = 0.2 if quietest < speaker.noise_floor else 0.02
+            speaker.noise_floor += rate * (quietest - speaker.noise_floor)
+
+        if voiced_frames and utterance is None:
+            utterance = speaker.spare or _Utterance(self.initial_bytes)
+            speaker.spare = None
+            utterance.last_voiced = now
+            self.open[ssrc] = utterance
+            self._active.set()
+        if utterance is not None:
+            # Trailing silence inside the hangover window stays part of the utterance.
+            if voiced_frames:
+                utterance.voiced_ms += voiced_frames * FRAME_MS
+                utterance.last_voiced = now
+            utterance.append(pcm, self.max_bytes)
+            if utterance.length >= self.max_bytes:
+                self._finish(ssrc)
+
+    def _finish(self, ssrc: int):
+        # Called with the lock held, so the buffer isn't appended to while it is copied
+        # out and handed back as the speaker's spare.
+        utterance = self.open.pop(ssrc, None)
+        speaker = self.speakers.get(ssrc)
+        if utterance is None or speaker is None:
+            return
+        pcm, voiced_ms, ended_at = bytes(utterance.view[:utterance.length]), utterance.voiced_ms, utterance.last_voiced
+        utterance.length = 0
+        utterance.voiced_ms = 0
+        speaker.spare = utterance
+        if voiced_ms < self.min_voiced_ms:
+            self.stats["dropped"] += 1
+            return
+        self.stats["segments"] += 1
+        try:
+            self.loop.call_soon_threadsafe(self.on_segment, Segment(ssrc, speaker.user, pcm, voiced_ms, ended_at))
+        except RuntimeError:
+            # The event loop is already closed.
+            pass
+
+    def _watch(self):
+        # The sink thread closes utterances itself when the next packet arrives after the
+        # hangover. This only handles speakers whose packets stopped; the extra frame of
+        # grace keeps it from closing an utterance the sink thread is still appending to.
+        grace = self.hangover + FRAME_MS / 1000
+        while not self._closed:
+            self._active.wait()
+            if self._closed:
+                break
+            if not self.open:
+                self._active.clear()
+                if self.open:
+                    self._active.set()
+                continue
+            with self._lock:
+                now = time.monotonic()
+                for ssrc, utterance in list(self.open.items()):
+                    if now - utterance.last_voiced >= grace:
+                        self._finish(ssrc)
+            time.sleep(min(0.1, self.hangover / 4))
+
+    def close(self):
+        """
+        Stop the watchdog thread and drop buffered audio.
+        """
+        self._closed = True
+        self._active.set()
+        with self._lock:
+            self.open.clear()
+            self.speakers.clear()
+
+class WakeGate:
+    """
+    Two-stage wake-phrase gating for voice transcription.
+
+    Only the first `window` seconds of an utterance are transcribed at first; the full
+    utterance is transcribed only if that leading window contains the wake phrase, so
+    ordinary conversation costs the transcription backend a short clip instead of the
+    whole utterance. Utterances barely longer than the window are transcribed in one go.
+    If the window transcription fails, `fallback` decides: "full" transcribes the whole
+    utterance anyway, "drop" skips it. With `enabled` off, every utterance is transcribed
+    in full and matched afterwards.
+
+    `transcribe(pcm)` is an async callable returning the lowercased transcript, or None
+    on failure.
+    """
+
+    def __init__(self, pattern: str = WAKE_PATTERN, window: float = 2.0, fallback: str = "full", enabled: bool = True):
+        self.pattern = re.compile(pattern, re.IGNORECASE)
+        self.window_bytes = int(window * SAMPLE_RATE) * CHANNELS * SAMPLE_WIDTH
+        self.fallback = fallback
+        self.enabled = enabled
+        self.stats = {
+            "segments": 0,
+            "gated_out": 0,
+            "fully_transcribed": 0,
+            "gate_errors": 0,
+            "seconds_transcribed": 0.0,
+            "seconds_saved": 0.0,
+        }
+
+    def matches(self, text: str) -> bool:
+        return bool(text) and self.pattern.search(text) is not None
+
+    async def _transcribe(self, transcribe, pcm: bytes) -> str:
+        self.stats["seconds_transcribed"] += len(pcm) / (SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+        return await transcribe(pcm)
+
+    async def transcribe(self, segment: Segment, transcribe) -> str:
+        """
+        Return the transcript of `segment` if it contains the wake phrase, else None.
+        """
+        self.stats["segments"] += 1
+        pcm = segment.pcm
+        if not self.enabled or len(pcm) <= self.window_bytes * 5 // 4:
+            self.stats["fully_transcribed"] += 1
+            text = await self._transcribe(transcribe, pcm)
+            return text if self.matches(text) else None
+
+        lead = await self._transcribe(transcribe, pcm[:self.window_bytes])
+        if lead is None:
+            self.stats["gate_errors"] += 1
+            if self.fallback != "full":
+                return None
+        elif not self.matches(lead):
+            self.stats["gated_out"] += 1
+            self.stats["seconds_saved"] += (len(pcm) - self.window_bytes) / (SAMPLE_RATE * CHANNELS * SAMPLE_WIDTH)
+            return None
+
+        self.stats["fully_transcribed"] += 1
+        text = await self._transcribe(transcribe, pcm)
+        if lead is None:
+            return text if self.matches(text) else None
+        # The wake phrase was heard in the leading window; keep the full transcript even
+        # if it words the start slightly differently.
+        return text or lead